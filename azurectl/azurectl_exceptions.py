@@ -37,6 +37,10 @@ class AzureAccountLoadFailed(AzureError):
     pass
 
 
+class AzureBandwidthShareError(AzureError):
+    pass
+
+
 class AzureBlobServicePropertyError(AzureError):
     pass
 
@@ -69,6 +73,10 @@ class AzureCloudServiceOpenSSLError(AzureError):
     pass
 
 
+class AzureCodecNotAvailable(AzureError):
+    pass
+
+
 class AzureCommandNotLoaded(AzureError):
     pass
 
@@ -261,7 +269,15 @@ class AzurePageBlobUpdateError(AzureError):
     pass
 
 
-class AzurePageBlobZeroPageError(AzureError):
+class AzurePageIndexError(AzureError):
+    pass
+
+
+class AzurePageManifestError(AzureError):
+    pass
+
+
+class AzureQCow2FormatError(AzureError):
     pass
 
 
@@ -333,6 +349,10 @@ class AzureStorageAccountUpdateError(AzureError):
     pass
 
 
+class AzureStorageCopyError(AzureError):
+    pass
+
+
 class AzureStorageDeleteError(AzureError):
     pass
 
@@ -377,6 +397,10 @@ class AzureSubscriptionPrivateKeyDecodeError(AzureError):
     pass
 
 
+class AzureTarArchiveError(AzureError):
+    pass
+
+
 class AzureUnknownCommand(AzureError):
     pass
 
@@ -389,6 +413,14 @@ class AzureUnrecognizedManagementUrl(AzureError):
     pass
 
 
+class AzureUploadJournalError(AzureError):
+    pass
+
+
+class AzureVHDFormatError(AzureError):
+    pass
+
+
 class AzureVmCreateError(AzureError):
     pass
 
@@ -407,3 +439,7 @@ class AzureVmShutdownError(AzureError):
 
 class AzureVmStartError(AzureError):
     pass
+
+
+class AzureXZIndexError(AzureError):
+    pass
@@ -91,6 +91,13 @@ class CliTask(object):
             self.command_args[cmd_arg]
         )
 
+    def validate_size(self, cmd_arg, alignment=1):
+        return Validations.validate_size(
+            cmd_arg,
+            self.command_args[cmd_arg],
+            alignment
+        )
+
     def validate_at_least_one_argument_is_set(self, keys):
         return Validations.validate_at_least_one_argument_is_set(
             self.command_args,
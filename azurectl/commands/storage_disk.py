@@ -19,7 +19,36 @@ usage: azurectl storage disk -h | --help
        azurectl storage disk upload --source=<file>
            [--blob-name=<blobname>]
            [--max-chunk-size=<size>]
+           [--auto-tune]
+           [--hedge]
+           [--max-bandwidth=<rate>]
+           [--shared-bandwidth]
+           [--threads=<count>]
+           [--processes=<count>]
+           [--decompress-threads=<count>]
+           [--read-ahead=<size>]
+           [--resume|--delta|--base-blob=<name>]
+           [--targets=<targetlist>]
+           [--to-vhd]
+           [--member=<name>]
+           [--size=<size>]
+           [--progress-fd=<fd>]
            [--quiet]
+       azurectl storage disk upload --batch=<file>
+           [--parallel=<count>]
+           [--max-in-flight=<size>]
+           [--max-chunk-size=<size>]
+           [--auto-tune]
+           [--hedge]
+           [--max-bandwidth=<rate>]
+           [--shared-bandwidth]
+           [--threads=<count>]
+           [--decompress-threads=<count>]
+           [--read-ahead=<size>]
+           [--progress-fd=<fd>]
+           [--quiet]
+       azurectl storage disk scan --source=<file>
+           [--decompress-threads=<count>]
        azurectl storage disk sas --blob-name=<blobname>
            [--start-datetime=<start>]
            [--expiry-datetime=<expiry>]
@@ -35,19 +64,62 @@ commands:
     sas
         generate a shared access signature URL allowing limited access to the
         specified disk image without an access key
+    scan
+        find the non zero pages of a disk image, print the size to
+        upload and keep the result as page index for the upload
     upload
-        upload xz compressed disk image to the given container
-        (will automatically skip zero'd blocks)
+        upload xz, gzip, zstd or bzip2 compressed or uncompressed disk
+        image, or qcow2 or dynamic VHD image as fixed VHD, to the given
+        container (will automatically skip zero'd blocks), and print a
+        summary of the upload
 
 options:
+    --auto-tune
+        adapt the chunk size and the number of page writes in flight
+        to the measured latency and throughput of the page writes, the
+        max chunk size and the number of threads become upper limits
+    --batch=<file>
+        file listing the images to upload, one per line as source
+        file optionally followed by the blob name. The images are
+        uploaded in parallel and their page writes share the limits
+        given by --threads and --max-in-flight
+    --base-blob=<name>
+        server side copy the given blob of a previous image version to
+        the new blob and upload only the blocks which differ from it,
+        according to the hash manifest stored with the base blob
     --blob-name=<blobname>
         name of the file in the storage pool
+    --delta
+        upload only the blocks which changed since the previous upload
+        to the same blob, according to the hash manifest stored with
+        the blob, and record a new manifest
+    --decompress-threads=<count>
+        number of threads decompressing the blocks of a multi block
+        xz image in parallel, default is the number of CPUs
     --expiry-datetime=<expiry>
         Date (and optionally time) to cease access via a shared access
         signature. [default: 30 days from start]
         Example format: YYYY-MM-DDThh:mm:ssZ
+    --hedge
+        issue a page write a second time on another connection if it
+        takes longer than 95% of the recent page writes, the write
+        which finishes first counts
+    --max-bandwidth=<rate>
+        max number of bytes per second sent by the page writes of the
+        upload, for all targets, processes or images of a batch
+        together. By default the upload is not limited
     --max-chunk-size=<size>
         max chunk size in bytes for upload, default 4MB
+    --max-in-flight=<size>
+        max number of bytes of the page writes in flight of all images
+        of a batch upload, by default only --threads limits them
+    --member=<name>
+        the source is a tar archive, optionally compressed, upload the
+        archive member of the given name. The blob name defaults to
+        the file name of the member
+    --parallel=<count>
+        number of images of a batch uploaded at the same time
+        [default: 4]
     --permissions=<permissions>
         String of permitted actions on a storage element via shared access
         signature.
@@ -56,22 +128,59 @@ options:
         d  Delete
         l  List
         [default: rl]
+    --progress-fd=<fd>
+        write the upload progress as one JSON object per line to the
+        given open file descriptor
+    --processes=<count>
+        number of worker processes uploading stripes of the image in
+        parallel, each with its own connection and threads
+        [default: 1]
     --quiet
         suppress progress information on upload
+    --read-ahead=<size>
+        max size in bytes of the chunks read and decompressed ahead of
+        the upload, default 64MB, 0 disables read ahead
+    --resume
+        record the committed pages in a local journal and continue an
+        interrupted upload of the same file to the same blob from it
+    --shared-bandwidth
+        share the limit given by --max-bandwidth with the other
+        uploads on this host using it, each upload taking part gets
+        an equal share of the limit
+    --size=<size>
+        size in bytes of the image read from stdin with --source=-,
+        512 byte aligned unless the image is converted with --to-vhd
     --source=<file>
-        file to upload
+        file to upload, - reads the image from stdin
     --start-datetime=<start>
         Date (and optionally time) to grant access via a shared access
         signature. [default: now]
         Example format: YYYY-MM-DDThh:mm:ssZ
+    --targets=<targetlist>
+        comma separated list of further storage accounts of the
+        subscription to upload the image to, each optionally followed
+        by /container, by default the configured container. The image
+        is read once and written to the configured storage account and
+        all targets concurrently, a failed target does not stop the
+        upload to the others
+    --threads=<count>
+        number of page writes to keep in flight concurrently on upload,
+        per target, in total for all images of a batch upload
+        [default: 4]
+    --to-vhd
+        upload a raw image as fixed VHD, the image is padded to a
+        multiple of 1MB and a fixed VHD footer is appended while
+        uploading
 """
 import datetime
+import os
 from pytz import utc
 from apscheduler.schedulers.background import BackgroundScheduler
 
 # project
 from azurectl.commands.base import CliTask
 from azurectl.account.service import AzureAccount
+from azurectl.azurectl_exceptions import AzureStorageFileNotFound
 from azurectl.help import Help
 from azurectl.logger import log
 from azurectl.storage.storage import Storage
@@ -116,6 +225,8 @@ class StorageDiskTask(CliTask):
             self.__upload()
         elif self.command_args['delete']:
             self.__delete()
+        elif self.command_args['scan']:
+            self.__scan()
         elif self.command_args['sas']:
             self.__sas(
                 container_name,
@@ -132,24 +243,50 @@ class StorageDiskTask(CliTask):
         return self.manual
 
     def __upload(self):
-        if self.command_args['--quiet']:
-            self.__upload_no_progress()
-        else:
-            self.__upload_with_progress()
+        if self.command_args['--size']:
+            # a raw image converted to VHD is padded to the VHD alignment
+            self.validate_size(
+                '--size', 1 if self.command_args['--to-vhd'] else 512
+            )
+        progress_stream = None
+        if self.command_args['--progress-fd']:
+            progress_stream = os.fdopen(
+                int(self.command_args['--progress-fd']), 'w'
+            )
+        try:
+            if self.command_args['--quiet']:
+                self.__upload_no_progress(progress_stream)
+            else:
+                self.__upload_with_progress(progress_stream)
+            if progress_stream:
+                self.storage.write_upload_status(progress_stream)
+        finally:
+            if progress_stream:
+                progress_stream.close()
+        result = DataCollector()
+        out = DataOutput(
+            result,
+            self.global_args['--output-format'],
+            self.global_args['--output-style']
+        )
+        source = self.command_args['--source'] or self.command_args['--batch']
+        result.add(source + ':upload', self.storage.upload_summary())
+        out.display()
 
-    def __upload_no_progress(self):
+    def __upload_no_progress(self, progress_stream):
+        progress = self.__progress_scheduler(progress_stream)
         try:
             self.__process_upload()
+            progress.shutdown()
         except (KeyboardInterrupt):
+            progress.shutdown()
             raise SystemExit('azurectl aborted by keyboard interrupt')
 
-    def __upload_with_progress(self):
-        image = self.command_args['--source']
-        progress = BackgroundScheduler(timezone=utc)
+    def __upload_with_progress(self, progress_stream):
+        progress = self.__progress_scheduler(progress_stream)
         progress.add_job(
             self.storage.print_upload_status, 'interval', seconds=3
         )
-        progress.start()
         try:
             self.__process_upload()
             self.storage.print_upload_status()
@@ -158,16 +295,107 @@ class StorageDiskTask(CliTask):
             progress.shutdown()
             raise SystemExit('azurectl aborted by keyboard interrupt')
         print()
-        log.info('Uploaded %s', image)
+        if self.command_args['--batch']:
+            for upload in self.storage.batch_uploads:
+                log.info(
+                    'Uploaded %s to %s', upload['source'], upload['blob_name']
+                )
+        else:
+            log.info('Uploaded %s', self.command_args['--source'])
+        log.info(
+            'Skipped %d bytes of zero pages',
+            self.storage.upload_status['skipped_bytes']
+        )
+        if self.command_args['--delta'] or self.command_args['--base-blob']:
+            log.info(
+                'Skipped %d bytes of unchanged blocks',
+                self.storage.upload_status['unchanged_bytes']
+            )
+        log.info(
+            'Retried %d page writes',
+            self.storage.upload_status['retries']
+        )
+        if self.command_args['--hedge']:
+            log.info(
+                'Hedged %d page writes',
+                self.storage.upload_status['hedged_writes']
+            )
+        for target in sorted(self.storage.target_status):
+            log.info('Uploaded to %s', target)
+
+    def __progress_scheduler(self, progress_stream):
+        progress = BackgroundScheduler(timezone=utc)
+        if progress_stream:
+            progress.add_job(
+                self.storage.write_upload_status, 'interval', seconds=3,
+                args=[progress_stream]
+            )
+        progress.start()
+        return progress
 
     def __process_upload(self):
+        if self.command_args['--batch']:
+            self.storage.upload_batch(
+                self.__batch_sources(),
+                self.command_args['--parallel'],
+                self.command_args['--max-in-flight'],
+                self.command_args['--max-chunk-size'],
+                max_threads=self.command_args['--threads'],
+                decompress_threads=self.command_args['--decompress-threads'],
+                read_ahead_size=self.command_args['--read-ahead'],
+                auto_tune=self.command_args['--auto-tune'],
+                hedge=self.command_args['--hedge'],
+                max_bandwidth=self.command_args['--max-bandwidth'],
+                shared_bandwidth=self.command_args['--shared-bandwidth']
+            )
+            return
         self.storage.upload(
-
             self.command_args['--source'],
             self.command_args['--blob-name'],
-            self.command_args['--max-chunk-size']
+            self.command_args['--max-chunk-size'],
+            max_threads=self.command_args['--threads'],
+            decompress_threads=self.command_args['--decompress-threads'],
+            resume=self.command_args['--resume'],
+            delta=self.command_args['--delta'],
+            base_blob=self.command_args['--base-blob'],
+            read_ahead_size=self.command_args['--read-ahead'],
+            max_processes=self.command_args['--processes'],
+            auto_tune=self.command_args['--auto-tune'],
+            hedge=self.command_args['--hedge'],
+            targets=self.__targets(),
+            max_bandwidth=self.command_args['--max-bandwidth'],
+            shared_bandwidth=self.command_args['--shared-bandwidth'],
+            to_vhd=self.command_args['--to-vhd'],
+            member=self.command_args['--member'],
+            size=self.command_args['--size']
         )
 
+    def __batch_sources(self):
+        batch_file = self.command_args['--batch']
+        if not os.path.exists(batch_file):
+            raise AzureStorageFileNotFound('File %s not found' % batch_file)
+        sources = []
+        with open(batch_file) as batch:
+            for line in batch:
+                # source [blob-name], comments start with #
+                fields = line.split('#', 1)[0].split()
+                if fields:
+                    sources.append(
+                        [fields[0], fields[1] if len(fields) > 1 else None]
+                    )
+        return sources
+
+    def __targets(self):
+        if not self.command_args['--targets']:
+            return None
+        targets = []
+        for target in self.command_args['--targets'].split(','):
+            account_name, _, container = target.partition('/')
+            targets.append(
+                [account_name, container or self.account.storage_container()]
+            )
+        return targets
+
     def __sas(self, container_name, start, expiry, permissions):
         result = DataCollector()
         out = DataOutput(
@@ -188,6 +416,22 @@ class StorageDiskTask(CliTask):
         )
         out.display()
 
+    def __scan(self):
+        result = DataCollector()
+        out = DataOutput(
+            result,
+            self.global_args['--output-format'],
+            self.global_args['--output-style']
+        )
+        result.add(
+            self.command_args['--source'] + ':scan',
+            self.storage.scan(
+                self.command_args['--source'],
+                self.command_args['--decompress-threads']
+            )
+        )
+        out.display()
+
     def __delete(self):
         image = self.command_args['--blob-name']
         self.storage.delete(image)
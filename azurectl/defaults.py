@@ -11,6 +11,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import os
 from collections import namedtuple
 from pkg_resources import resource_filename
 
@@ -41,6 +42,16 @@ class Defaults(object):
             if account_type_tuple.account_type == account_type:
                 return account_type_tuple.command
 
+    @classmethod
+    def cache_directory(self):
+        """
+            Directory for data kept between azurectl invocations,
+            following the XDG base directory specification
+        """
+        cache_home = os.environ.get('XDG_CACHE_HOME') or \
+            os.path.join(os.path.expanduser('~'), '.cache')
+        return os.path.join(cache_home, 'azurectl')
+
     @classmethod
     def max_vm_luns(self):
         """
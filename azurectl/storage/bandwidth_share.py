@@ -0,0 +1,101 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import time
+
+# project
+from azurectl.defaults import Defaults
+from azurectl.azurectl_exceptions import AzureBandwidthShareError
+
+
+class BandwidthShare(object):
+    """
+        Registry of the uploads of a host sharing one bandwidth limit
+
+        Every upload taking part registers a file named after its
+        process id in the bandwidth-share directory of the cache and
+        refreshes its modification time while it is running. Files of
+        processes which no longer exist or did not refresh their file
+        for STALE_TIME seconds are not counted and get removed
+    """
+    STALE_TIME = 60
+
+    def __init__(self, share_dir=None):
+        self.share_dir = share_dir or os.path.join(
+            Defaults.cache_directory(), 'bandwidth-share'
+        )
+        self.filename = os.path.join(
+            self.share_dir, '%d-%x' % (os.getpid(), id(self))
+        )
+        try:
+            if not os.path.isdir(self.share_dir):
+                os.makedirs(self.share_dir)
+            with open(self.filename, 'w'):
+                pass
+        except Exception as e:
+            raise AzureBandwidthShareError(
+                '%s: %s' % (type(e).__name__, format(e))
+            )
+
+    def participants(self):
+        """
+            Number of uploads taking part in the share, this one
+            included
+        """
+        now = time.time()
+        self.__touch(now)
+        try:
+            names = os.listdir(self.share_dir)
+        except OSError:
+            return 1
+        participants = 0
+        for name in names:
+            filename = os.path.join(self.share_dir, name)
+            if self.__alive(name, filename, now):
+                participants += 1
+            else:
+                self.__remove(filename)
+        return max(participants, 1)
+
+    def close(self):
+        self.__remove(self.filename)
+
+    def __touch(self, now):
+        # a removed file is recreated
+        try:
+            if os.path.exists(self.filename):
+                os.utime(self.filename, (now, now))
+            else:
+                open(self.filename, 'w').close()
+        except OSError:
+            pass
+
+    def __alive(self, name, filename, now):
+        try:
+            pid = int(name.split('-', 1)[0])
+            if now - os.path.getmtime(filename) > self.STALE_TIME:
+                return False
+            os.kill(pid, 0)
+        except PermissionError:
+            # the process exists but belongs to another user
+            return True
+        except (ValueError, OSError):
+            return False
+        return True
+
+    def __remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
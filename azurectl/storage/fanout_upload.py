@@ -0,0 +1,217 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import time
+from azure.storage.blob.pageblobservice import PageBlobService
+
+# project
+from azurectl.logger import log
+from azurectl.storage.hedge_policy import HedgePolicy
+from azurectl.storage.page_blob import PageBlob
+from azurectl.storage.retry_policy import RetryPolicy
+from azurectl.storage.upload_controller import UploadController
+from azurectl.storage.upload_telemetry import UploadTelemetry
+from azurectl.utils.zeropages import ZeroPages
+
+
+class FanoutTarget(object):
+    """
+        Page blob in the container of one storage account a fan-out
+        upload writes to, along with the connection, retry policy and
+        hedge policy of its own
+    """
+    def __init__(
+        self, account_name, account_key, blob_service_host_base, container
+    ):
+        self.name = '%s/%s' % (account_name, container)
+        self.account_name = account_name
+        self.account_key = account_key
+        self.blob_service_host_base = blob_service_host_base
+        self.container = container
+        self.blob_service = PageBlobService(
+            account_name, account_key,
+            endpoint_suffix=blob_service_host_base
+        )
+        self.page_blob = None
+        self.retry_policy = RetryPolicy()
+        self.hedge_policy = None
+        self.current_bytes = 0
+        self.error = None
+
+    def open(
+        self, blob_name, image_size, max_threads, max_chunk_size,
+        auto_tune, retry_budget, hedge, telemetry, rate_limiter=None
+    ):
+        """
+            Create the page blob of the target
+        """
+        controller = None
+        if auto_tune:
+            controller = UploadController(max_chunk_size, max_threads)
+        self.retry_policy = RetryPolicy(retry_budget)
+        if hedge:
+            self.hedge_policy = HedgePolicy(
+                PageBlobService(
+                    self.account_name, self.account_key,
+                    endpoint_suffix=self.blob_service_host_base
+                )
+            )
+        self.page_blob = PageBlob(
+            self.blob_service, blob_name, self.container, image_size,
+            max_threads, controller=controller,
+            retry_policy=self.retry_policy, hedge_policy=self.hedge_policy,
+            telemetry=telemetry, rate_limiter=rate_limiter
+        )
+
+    def write(self, data, length, max_attempts, non_zero_ranges):
+        self.current_bytes = self.page_blob.write(
+            data, length, max_attempts, non_zero_ranges
+        )
+
+    def flush(self):
+        self.page_blob.flush()
+        self.current_bytes = self.page_blob.page_start
+
+    def close(self):
+        if self.page_blob:
+            self.page_blob.close()
+
+    def status(self):
+        return {
+            'current_bytes': self.current_bytes,
+            'skipped_bytes':
+                self.page_blob.zero_bytes_skipped if self.page_blob else 0,
+            'retries': self.retry_policy.retries,
+            'hedged_writes':
+                self.hedge_policy.hedged if self.hedge_policy else 0,
+            'error': self.error
+        }
+
+
+class FanoutUpload(object):
+    """
+        Implements the upload of one image into page blobs of the same
+        name in several storage accounts
+
+        The image is read, decompressed and checked for zero pages
+        once, every chunk is then handed to the page blobs of all
+        targets. Each target writes its pages through page write
+        threads of its own, such that the targets are written to
+        concurrently. The read position follows the slowest target,
+        which bounds the memory in use to the pages in flight. A
+        target whose page writes fail is dropped from the upload, the
+        other targets continue
+    """
+    PAGE_SIZE = 512
+
+    def __init__(self, targets, blob_name, image_size):
+        self.targets = targets
+        self.blob_name = blob_name
+        self.image_size = image_size
+        self.zero_pages = ZeroPages()
+
+    def chunk_size(self, max_chunk_size=None):
+        return int(max_chunk_size or PageBlobService.MAX_CHUNK_GET_SIZE)
+
+    def upload(
+        self, data_stream, progress_callback, max_chunk_size=None,
+        max_attempts=5, max_threads=1, auto_tune=False, retry_budget=None,
+        hedge=False, telemetry=None, page_index=None, rate_limiter=None
+    ):
+        """
+            Upload the data stream to all targets. progress_callback
+            is called with the status of the targets after every chunk.
+            With a page index, the non zero ranges of the data stream
+            are added to the index. A rate limiter limits the bytes
+            sent to all targets together
+        """
+        telemetry = telemetry or UploadTelemetry()
+        for target in self.targets:
+            self.__run(
+                target, target.open, self.blob_name, self.image_size,
+                max_threads, max_chunk_size, auto_tune, retry_budget,
+                hedge, telemetry, rate_limiter
+            )
+        chunk_size = self.chunk_size(max_chunk_size)
+        buffer = bytearray(chunk_size)
+        offset = 0
+        try:
+            while self.active_targets():
+                read_start_time = time.time()
+                if hasattr(data_stream, 'seek_data'):
+                    offset = data_stream.seek_data(self.PAGE_SIZE)
+                    for target in self.active_targets():
+                        self.__run(
+                            target, target.page_blob.skip_hole,
+                            offset, max_attempts
+                        )
+                data, length = self.__read(
+                    data_stream, buffer,
+                    min(chunk_size, max(self.image_size - offset, 0))
+                )
+                telemetry.add('read', time.time() - read_start_time)
+                if not length:
+                    break
+
+                zero_check_start_time = time.time()
+                non_zero_ranges = self.zero_pages.non_zero_ranges(
+                    data, length
+                )
+                if page_index:
+                    for range_start, range_end in non_zero_ranges:
+                        page_index.add(
+                            offset + range_start, offset + range_end
+                        )
+                telemetry.add(
+                    'zero_check', time.time() - zero_check_start_time
+                )
+                for target in self.active_targets():
+                    self.__run(
+                        target, target.write, data, length, max_attempts,
+                        non_zero_ranges
+                    )
+                offset += length
+                progress_callback(self.status())
+            for target in self.active_targets():
+                self.__run(target, target.flush)
+        finally:
+            for target in self.targets:
+                target.close()
+        progress_callback(self.status())
+
+    def active_targets(self):
+        return [target for target in self.targets if not target.error]
+
+    def failed_targets(self):
+        return [target for target in self.targets if target.error]
+
+    def status(self):
+        return {target.name: target.status() for target in self.targets}
+
+    def __run(self, target, method, *args):
+        # failures are isolated to the target they occur in
+        try:
+            method(*args)
+        except Exception as e:
+            target.error = '%s: %s' % (type(e).__name__, format(e))
+            log.warning(
+                'Upload to %s failed, continuing with the other '
+                'targets: %s', target.name, target.error
+            )
+            target.close()
+
+    def __read(self, data_stream, buffer, size):
+        if not hasattr(data_stream, 'readinto'):
+            data = data_stream.read(size)
+            return data, len(data) if data else 0
+        return buffer, data_stream.readinto(memoryview(buffer)[:size])
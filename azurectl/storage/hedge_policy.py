@@ -0,0 +1,63 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import collections
+import threading
+
+
+class HedgePolicy(object):
+    """
+        Implements the decision when to hedge a page write
+
+        A page write which has not finished after the given percentile
+        of the recent write latencies is issued a second time through
+        blob_service, a blob service with a connection pool of its
+        own. Whichever write finishes first counts, page writes are
+        idempotent. No write is hedged before MIN_SAMPLES latencies
+        are known
+    """
+    MIN_SAMPLES = 20
+    WINDOW_SIZE = 200
+
+    def __init__(self, blob_service, percentile=95):
+        self.blob_service = blob_service
+        self.percentile = percentile
+        self.latencies = collections.deque(maxlen=self.WINDOW_SIZE)
+        self.hedged = 0
+        self.hedges_won = 0
+        self.lock = threading.Lock()
+
+    def threshold(self):
+        """
+            Seconds after which a page write is hedged, None as long
+            as not enough latencies are known
+        """
+        with self.lock:
+            if len(self.latencies) < self.MIN_SAMPLES:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[
+            min(len(latencies) * self.percentile // 100, len(latencies) - 1)
+        ]
+
+    def record(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def hedge_started(self):
+        with self.lock:
+            self.hedged += 1
+
+    def hedge_won(self):
+        with self.lock:
+            self.hedges_won += 1
@@ -11,8 +11,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    wait
+)
+from functools import partial
+from azure.common import AzureMissingResourceHttpError
+
+# project
+from azurectl.storage.retry_policy import RetryPolicy
+from azurectl.storage.upload_telemetry import UploadTelemetry
+from azurectl.utils.ranges import ByteRanges
+from azurectl.utils.zeropages import ZeroPages
 from azurectl.azurectl_exceptions import (
-    AzurePageBlobZeroPageError,
     AzurePageBlobAlignmentViolation,
     AzurePageBlobSetupError,
     AzurePageBlobUpdateError
@@ -23,11 +37,20 @@ class PageBlob(object):
     """
         Page blob iterator to control a stream of data to an Azure page blob
     """
-    def __init__(self, blob_service, blob_name, container, byte_size):
+    PAGE_SIZE = 512
+
+    def __init__(
+        self, blob_service, blob_name, container, byte_size, max_in_flight=1,
+        journal=None, manifest=None, stripe=None, controller=None,
+        retry_policy=None, hedge_policy=None, telemetry=None,
+        page_index=None, budget=None, rate_limiter=None
+    ):
         """
             Create a new page blob of the specified byte_size with
             name blob_name in the specified container. An azure page
-            blob must be 512 byte aligned
+            blob must be 512 byte aligned. The optional journal, manifest,
+            stripe, page_index and the upload policies control resume,
+            incremental update, striping and retry/hedge behavior
         """
         self.container = container
         self.blob_service = blob_service
@@ -37,64 +60,186 @@ class PageBlob(object):
 
         self.rest_bytes = byte_size
         self.page_start = 0
+        self.zero_bytes_skipped = 0
+        self.zero_pages = ZeroPages()
+        self.read_buffer = bytearray()
+        self.journal = journal
+        self.committed_ranges = []
+        self.resumed_bytes = 0
+        self.manifest = manifest
+        self.unchanged_bytes = 0
+        self.read_alignment = self.PAGE_SIZE
+        if self.manifest:
+            self.read_alignment = self.manifest.block_size
 
-        try:
-            self.blob_service.create_blob(
-                self.container, self.blob_name, byte_size
+        self.max_in_flight = int(max_in_flight)
+        self.upload_pool = None
+        self.pending_pages = []
+        self.bytes_in_flight = 0
+        self.pages_in_flight = 0
+        self.in_flight_lock = threading.Lock()
+        self.in_flight_changed = threading.Condition(self.in_flight_lock)
+        self.controller = controller
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.hedge_policy = hedge_policy
+        self.telemetry = telemetry or UploadTelemetry()
+        self.page_index = page_index
+        self.budget = budget
+        self.rate_limiter = rate_limiter
+        self.hedge_pool = None
+        if self.max_in_flight > 1:
+            self.upload_pool = ThreadPoolExecutor(
+                max_workers=self.max_in_flight
             )
-        except Exception as e:
-            raise AzurePageBlobSetupError(
-                '%s: %s' % (type(e).__name__, format(e))
+        if self.hedge_policy:
+            # a write and its hedge per page in flight, plus hedged
+            # writes which lost but did not finish yet
+            self.hedge_pool = ThreadPoolExecutor(
+                max_workers=4 * self.max_in_flight
             )
 
+        if stripe:
+            self.page_start, stripe_end = stripe
+            self.rest_bytes = stripe_end - self.page_start
+        else:
+            self.__setup_blob(byte_size)
+
+        # page writes are retried by the retry policy only, the
+        # default exponential retry of the blob services is replaced
+        self.blob_service.retry = self.retry_policy.retry
+        if self.hedge_policy:
+            self.hedge_policy.blob_service.retry = self.retry_policy.retry
+
     def next(self, data_stream, max_chunk_byte_size=None, max_attempts=5):
-        if not max_chunk_byte_size:
-            max_chunk_byte_size = self.blob_service.MAX_CHUNK_GET_SIZE
-        max_chunk_byte_size = int(max_chunk_byte_size)
+        """
+            Read the next chunk from data_stream and write its non
+            zero pages to the page blob. Returns the number of bytes
+            processed so far, pages still in flight excluded
+        """
+        if self.controller:
+            max_chunk_byte_size = self.controller.chunk_size
+        max_chunk_byte_size = self.chunk_size(max_chunk_byte_size)
+
+        read_start_time = time.time()
+        if hasattr(data_stream, 'seek_data'):
+            # sparse data streams skip holes without reading them
+            self.skip_hole(
+                data_stream.seek_data(self.read_alignment), max_attempts
+            )
 
         requested_bytes = min(
             self.rest_bytes, max_chunk_byte_size
         )
 
-        if requested_bytes != max_chunk_byte_size:
-            zero_page = self.__read_zero_page(requested_bytes)
-        else:
-            zero_page = self.__read_zero_page(max_chunk_byte_size)
-
-        data = data_stream.read(requested_bytes)
+        data, length = self.__read(data_stream, requested_bytes)
+        self.telemetry.add('read', time.time() - read_start_time)
 
-        if not data:
+        if not length:
+            self.flush()
             raise StopIteration()
 
-        length = len(data)
-        page_end = self.page_start + length - 1
-
-        if not data == zero_page:
-            upload_errors = []
-            while len(upload_errors) < max_attempts:
-                try:
-                    self.blob_service.update_page(
-                        self.container,
-                        self.blob_name,
-                        data,
-                        self.page_start,
-                        page_end
-                    )
-                    break
-                except Exception as e:
-                    upload_errors.append(
-                        '%s: %s' % (type(e).__name__, format(e))
-                    )
+        return self.write(data, length, max_attempts)
 
-            if len(upload_errors) == max_attempts:
-                raise AzurePageBlobUpdateError(
-                    'Page update failed with: %s' % '\n'.join(upload_errors)
+    def write(self, data, length, max_attempts=5, non_zero_ranges=None):
+        """
+            Write the non zero pages of the first length bytes of data,
+            the chunk following the data written so far. The non zero
+            ranges of the chunk are looked up unless given. Returns the
+            number of bytes processed so far, pages still in flight
+            excluded
+        """
+        zero_check_start_time = time.time()
+        if non_zero_ranges is None:
+            non_zero_ranges = self.zero_pages.non_zero_ranges(data, length)
+        if self.page_index:
+            for range_start, range_end in non_zero_ranges:
+                self.page_index.add(
+                    self.page_start + range_start, self.page_start + range_end
                 )
+        self.zero_bytes_skipped += length - ByteRanges.size(non_zero_ranges)
+        clear_ranges = []
+        if self.manifest:
+            upload_ranges, clear_ranges = self.__changed_ranges(
+                data, length, non_zero_ranges
+            )
+        else:
+            upload_ranges = self.__uncommitted_ranges(non_zero_ranges)
+            self.resumed_bytes += ByteRanges.size(non_zero_ranges) - \
+                ByteRanges.size(upload_ranges)
+        self.telemetry.add('zero_check', time.time() - zero_check_start_time)
+
+        for range_start, range_end in upload_ranges:
+            self.__write_page(
+                self.__page_data(data, range_start, range_end),
+                self.page_start + range_start,
+                self.page_start + range_end - 1,
+                max_attempts
+            )
+        for range_start, range_end in clear_ranges:
+            self.__write_page(
+                None,
+                self.page_start + range_start,
+                self.page_start + range_end - 1,
+                max_attempts
+            )
 
         self.rest_bytes -= length
         self.page_start += length
 
-        return self.page_start
+        with self.in_flight_lock:
+            return self.page_start - self.bytes_in_flight
+
+    def chunk_size(self, max_chunk_byte_size=None):
+        """
+            Size of the chunks read from the data stream for the given
+            max chunk size, by default the max chunk size of the blob
+            service
+        """
+        if not max_chunk_byte_size:
+            max_chunk_byte_size = self.blob_service.MAX_CHUNK_GET_SIZE
+        max_chunk_byte_size = int(max_chunk_byte_size)
+        if self.read_alignment != self.PAGE_SIZE:
+            # chunks must start and end on manifest block boundaries
+            unaligned_bytes = max_chunk_byte_size % self.read_alignment
+            max_chunk_byte_size = max(
+                max_chunk_byte_size - unaligned_bytes, self.read_alignment
+            )
+        return max_chunk_byte_size
+
+    def skip_hole(self, data_start, max_attempts=5):
+        """
+            Skip the zero pages up to data_start, the start of the
+            next data of a sparse data stream
+        """
+        hole_size = min(data_start - self.page_start, self.rest_bytes)
+        if self.manifest and hole_size > 0:
+            self.__clear_hole(self.page_start + hole_size, max_attempts)
+        self.page_start += hole_size
+        self.rest_bytes -= hole_size
+        self.zero_bytes_skipped += hole_size
+
+    def flush(self):
+        """
+            Wait for the page writes in flight, raises if one of
+            them failed
+        """
+        for page in self.pending_pages:
+            page.result()
+        self.pending_pages = []
+
+    def close(self):
+        """
+            Stop the upload worker threads. Page writes not yet
+            started are cancelled, running ones are waited for
+        """
+        if self.upload_pool:
+            for page in self.pending_pages:
+                page.cancel()
+            self.upload_pool.shutdown(wait=True)
+            self.pending_pages = []
+        if self.hedge_pool:
+            # writes which lost the race must not land after the upload
+            self.hedge_pool.shutdown(wait=True)
 
     def __iter__(self):
         return self
@@ -106,11 +251,311 @@ class PageBlob(object):
                 'Uncompressed size %d is not 512 byte aligned' % byte_size
             )
 
-    def __read_zero_page(self, requested_bytes):
+    def __read(self, data_stream, size):
+        """
+            Read the next chunk of up to size bytes and return it along
+            with its length. Data streams providing readinto fill the
+            preallocated read buffer, which is reused for every chunk
+            and may be longer than the chunk it holds
+        """
+        if not hasattr(data_stream, 'readinto'):
+            data = data_stream.read(size)
+            return data, len(data) if data else 0
+        if len(self.read_buffer) < size:
+            self.read_buffer = bytearray(size)
+        return self.read_buffer, data_stream.readinto(
+            memoryview(self.read_buffer)[:size]
+        )
+
+    def __page_data(self, data, start, end):
+        # the blob service only accepts bytes, this is the one copy
+        # a chunk read into the read buffer goes through
+        if isinstance(data, bytes) and end - start == len(data):
+            return data
+        return bytes(memoryview(data)[start:end])
+
+    def __write_page(self, data, page_start, page_end, max_attempts):
+        if self.upload_pool:
+            self.__submit_page(data, page_start, page_end, max_attempts)
+            return
+        length = len(data) if data is not None else 0
+        if self.budget:
+            self.budget.acquire(length)
+        try:
+            self.__update_page(data, page_start, page_end, max_attempts)
+        finally:
+            if self.budget:
+                self.budget.release(length)
+
+    def __update_page(self, data, page_start, page_end, max_attempts):
+        # data None clears the page range
+        upload_errors = []
+        if self.controller:
+            self.controller.page_started()
+        start_time = time.time()
+        failed = False
+        while not failed:
+            try:
+                if self.hedge_policy:
+                    self.__hedged_put_page(data, page_start, page_end)
+                else:
+                    self.__put_page(
+                        self.blob_service, data, page_start, page_end
+                    )
+                break
+            except Exception as e:
+                upload_errors.append(
+                    '%s: %s' % (type(e).__name__, format(e))
+                )
+                delay = self.retry_policy.delay(
+                    getattr(e, 'response', None), len(upload_errors),
+                    max_attempts
+                )
+                if delay is None:
+                    failed = True
+                else:
+                    time.sleep(delay)
+
+        latency = time.time() - start_time
+        self.telemetry.add('network', latency)
+        if self.controller:
+            self.controller.page_done(
+                0 if failed or data is None else len(data),
+                latency, len(upload_errors)
+            )
+        if failed:
+            raise AzurePageBlobUpdateError(
+                'Page update failed with: %s' % '\n'.join(upload_errors)
+            )
+        if self.journal:
+            self.journal.record(page_start, page_end + 1)
+
+    def __put_page(self, blob_service, data, page_start, page_end):
+        if self.rate_limiter and data is not None:
+            self.rate_limiter.consume(len(data))
+        try:
+            if data is None:
+                blob_service.clear_page(
+                    self.container,
+                    self.blob_name,
+                    page_start,
+                    page_end
+                )
+            else:
+                blob_service.update_page(
+                    self.container,
+                    self.blob_name,
+                    data,
+                    page_start,
+                    page_end
+                )
+        except Exception as e:
+            # the write may have failed in another thread than the one
+            # retrying it, the error carries the response along
+            e.response = self.retry_policy.failed_response()
+            raise
+
+    def __hedged_put_page(self, data, page_start, page_end):
+        """
+            Write the page and hedge the write if it takes longer
+            than the hedge threshold. Raises the error of the first
+            write if no write succeeded
+        """
+        threshold = self.hedge_policy.threshold()
+        start_time = time.time()
+        write = self.hedge_pool.submit(
+            self.__put_page, self.blob_service, data, page_start, page_end
+        )
+        writes = [write]
+        if threshold is not None and wait(writes, threshold).not_done:
+            self.hedge_policy.hedge_started()
+            writes.append(
+                self.hedge_pool.submit(
+                    self.__put_page, self.hedge_policy.blob_service,
+                    data, page_start, page_end
+                )
+            )
+        while True:
+            done, writes = wait(writes, return_when=FIRST_COMPLETED)
+            succeeded = [page for page in done if not page.exception()]
+            if succeeded:
+                break
+            if not writes:
+                write.result()
+        if write not in succeeded:
+            self.hedge_policy.hedge_won()
+        self.hedge_policy.record(time.time() - start_time)
+
+    def __submit_page(self, data, page_start, page_end, max_attempts):
+        # raise early if one of the previous page writes has failed,
+        # then block until the number of writes in flight is below limit
+        self.__raise_on_failed_pages()
+        length = len(data) if data is not None else 0
+        with self.in_flight_changed:
+            while self.pages_in_flight >= self.__max_pages_in_flight():
+                self.in_flight_changed.wait()
+            self.pages_in_flight += 1
+            self.bytes_in_flight += length
+        if self.budget:
+            self.budget.acquire(length)
+        page = self.upload_pool.submit(
+            self.__update_page, data, page_start, page_end, max_attempts
+        )
+        page.add_done_callback(partial(self.__page_done, length))
+        self.pending_pages.append(page)
+
+    def __page_done(self, length, page):
+        if self.budget:
+            self.budget.release(length)
+        with self.in_flight_changed:
+            self.pages_in_flight -= 1
+            self.bytes_in_flight -= length
+            self.in_flight_changed.notify()
+
+    def __max_pages_in_flight(self):
+        if self.controller:
+            return min(self.controller.in_flight, self.max_in_flight)
+        return self.max_in_flight
+
+    def __raise_on_failed_pages(self):
+        pending_pages = []
+        for page in self.pending_pages:
+            if page.done():
+                # result() re-raises the exception of a failed page write
+                page.result()
+            else:
+                pending_pages.append(page)
+        self.pending_pages = pending_pages
+
+    def __setup_blob(self, byte_size):
+        if self.journal and self.journal.ranges:
+            self.committed_ranges = self.__verify_committed_ranges(
+                self.journal.ranges, byte_size
+            )
+        if self.manifest and self.manifest.previous_hashes is not None:
+            if not self.__blob_matches_manifest(byte_size):
+                self.manifest.discard_previous()
+        if self.committed_ranges:
+            self.journal.resume(self.committed_ranges)
+        elif self.manifest and self.manifest.previous_hashes is not None:
+            # delta upload over the existing blob
+            pass
+        else:
+            try:
+                self.blob_service.create_blob(
+                    self.container, self.blob_name, byte_size
+                )
+            except Exception as e:
+                raise AzurePageBlobSetupError(
+                    '%s: %s' % (type(e).__name__, format(e))
+                )
+            if self.journal:
+                self.journal.reset()
+
+    def __verify_committed_ranges(self, journal_ranges, byte_size):
+        # only ranges the existing blob of the same size confirms as
+        # valid pages count as committed
         try:
-            with open('/dev/zero', 'rb') as zero_stream:
-                return zero_stream.read(requested_bytes)
+            blob = self.blob_service.get_blob_properties(
+                self.container, self.blob_name
+            )
+            if blob.properties.content_length != byte_size:
+                return []
+            page_ranges = self.blob_service.get_page_ranges(
+                self.container, self.blob_name
+            )
+        except AzureMissingResourceHttpError:
+            return []
         except Exception as e:
-            raise AzurePageBlobZeroPageError(
-                'Reading zero page failed with: %s' % format(e)
+            raise AzurePageBlobSetupError(
+                '%s: %s' % (type(e).__name__, format(e))
+            )
+        return ByteRanges.intersect(
+            journal_ranges, ByteRanges.merge(
+                [[page.start, page.end + 1] for page in page_ranges]
+            )
+        )
+
+    def __blob_matches_manifest(self, byte_size):
+        try:
+            blob = self.blob_service.get_blob_properties(
+                self.container, self.blob_name
             )
+        except AzureMissingResourceHttpError:
+            return False
+        except Exception as e:
+            raise AzurePageBlobSetupError(
+                '%s: %s' % (type(e).__name__, format(e))
+            )
+        return blob.properties.content_length == byte_size and \
+            blob.properties.etag == self.manifest.etag
+
+    def __changed_ranges(self, data, length, non_zero_ranges):
+        """
+            Hash the manifest blocks of the chunk and return the ranges
+            to upload and to clear in order to turn the previous blob
+            content into the new one
+        """
+        upload_ranges = []
+        clear_ranges = []
+        block_size = self.manifest.block_size
+        for block_start in range(0, length, block_size):
+            block_end = min(block_start + block_size, length)
+            block_ranges = ByteRanges.intersect(
+                non_zero_ranges, [[block_start, block_end]]
+            )
+            block_data = None
+            # coalesced ranges may bridge whole zero blocks
+            if block_ranges and not self.zero_pages.is_zero(
+                data, block_start, block_end
+            ):
+                block_data = memoryview(data)[block_start:block_end]
+            else:
+                block_ranges = []
+            changed = self.manifest.update(
+                (self.page_start + block_start) // block_size, block_data
+            )
+            if not changed:
+                self.unchanged_bytes += block_end - block_start
+            elif self.manifest.previous_hashes is None:
+                # new blob, zero pages need no write
+                upload_ranges += block_ranges
+            elif block_ranges:
+                upload_ranges.append([block_start, block_end])
+            else:
+                clear_ranges.append([block_start, block_end])
+        return ByteRanges.merge(upload_ranges), ByteRanges.merge(clear_ranges)
+
+    def __uncommitted_ranges(self, ranges):
+        if not self.committed_ranges:
+            return ranges
+        # committed ranges before the current chunk are done with
+        while self.committed_ranges and \
+                self.committed_ranges[0][1] <= self.page_start:
+            del self.committed_ranges[0]
+        uncommitted_ranges = ByteRanges.subtract(
+            [
+                [self.page_start + start, self.page_start + end]
+                for start, end in ranges
+            ],
+            self.committed_ranges
+        )
+        return [
+            [start - self.page_start, end - self.page_start]
+            for start, end in uncommitted_ranges
+        ]
+
+    def __clear_hole(self, hole_end, max_attempts):
+        # blocks of a hole are zero blocks in the manifest, which
+        # need to be cleared if they had data before
+        block_size = self.manifest.block_size
+        clear_ranges = []
+        for block_start in range(self.page_start, hole_end, block_size):
+            block_end = min(block_start + block_size, hole_end)
+            changed = self.manifest.update(block_start // block_size, None)
+            if not changed:
+                self.unchanged_bytes += block_end - block_start
+            elif self.manifest.previous_hashes is not None:
+                clear_ranges.append([block_start, block_end])
+        for range_start, range_end in ByteRanges.merge(clear_ranges):
+            self.__write_page(None, range_start, range_end - 1, max_attempts)
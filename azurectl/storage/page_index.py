@@ -0,0 +1,158 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import hashlib
+import json
+import os
+from array import array
+
+# project
+from azurectl.defaults import Defaults
+from azurectl.utils.zeropages import ZeroPages
+from azurectl.azurectl_exceptions import AzurePageIndexError
+
+
+class PageIndex(object):
+    """
+        Index of the non zero pages of a source image, kept in the
+        cache directory such that the image needs to be scanned for
+        zero pages only once
+
+        The index lists the [start, end) byte ranges of the
+        uncompressed image holding non zero pages, zero gaps bridged
+        by the upload included. It is keyed by the source path, inode,
+        size and mtime and by the hash of the first and last MB of
+        the source, such that a changed source never uses the index
+        of a previous version. The index of a member of a tar archive
+        source is keyed by the member name in addition
+
+        The index file consists of a json header line followed by the
+        range boundaries as array of unsigned 64bit integers in native
+        byte order
+    """
+    SAMPLE_SIZE = 1024 * 1024
+    SCAN_CHUNK_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, source, index_dir=None, member=None):
+        source_stat = os.stat(source)
+        self.key = {
+            'source': os.path.abspath(source),
+            'inode': source_stat.st_ino,
+            'size': source_stat.st_size,
+            'mtime': source_stat.st_mtime,
+            'sample': self.__sample_hash(source, source_stat.st_size)
+        }
+        if member:
+            self.key['member'] = member
+        index_id = hashlib.sha1(
+            json.dumps(self.key, sort_keys=True).encode()
+        ).hexdigest()
+        self.index_dir = index_dir or os.path.join(
+            Defaults.cache_directory(), 'page-index'
+        )
+        self.filename = os.path.join(self.index_dir, index_id)
+        self.image_size = None
+        self.extents = array('Q')
+        self.cached = self.__load()
+
+    def add(self, start, end):
+        """
+            Add a non zero [start, end) range, ranges are expected
+            in ascending order
+        """
+        if self.extents and self.extents[-1] >= start:
+            self.extents[-1] = max(self.extents[-1], end)
+        else:
+            self.extents.extend((start, end))
+
+    def ranges(self):
+        return [
+            [start, end] for start, end in zip(
+                self.extents[0::2], self.extents[1::2]
+            )
+        ]
+
+    def non_zero_bytes(self):
+        return sum(self.extents[1::2]) - sum(self.extents[0::2])
+
+    def scan(self, data_stream, image_size=None):
+        """
+            Build the index by reading the data stream from start
+            to end. Holes of sparse data streams are skipped. Without
+            an image size, the size of the data read is taken
+        """
+        self.extents = array('Q')
+        zero_pages = ZeroPages()
+        buffer = bytearray(self.SCAN_CHUNK_SIZE)
+        offset = 0
+        while True:
+            if hasattr(data_stream, 'seek_data'):
+                offset = data_stream.seek_data(ZeroPages.PAGE_SIZE)
+            length = data_stream.readinto(buffer)
+            if not length:
+                break
+            for start, end in zero_pages.non_zero_ranges(buffer, length):
+                self.add(offset + start, offset + end)
+            offset += length
+        self.image_size = offset if image_size is None else image_size
+
+    def save(self, image_size):
+        """
+            Save the index for an image of image_size bytes. Ranges
+            beyond the image size, like the footer of an image
+            converted while uploading, are cut off
+        """
+        while self.extents and self.extents[-2] >= image_size:
+            del self.extents[-2:]
+        if self.extents and self.extents[-1] > image_size:
+            self.extents[-1] = image_size
+        self.image_size = image_size
+        index_file_name = self.filename + '.tmp'
+        try:
+            if not os.path.isdir(self.index_dir):
+                os.makedirs(self.index_dir)
+            with open(index_file_name, 'wb') as index_file:
+                index_file.write(
+                    json.dumps(
+                        {'key': self.key, 'image_size': image_size},
+                        sort_keys=True
+                    ).encode() + b'\n'
+                )
+                index_file.write(self.extents.tobytes())
+            os.replace(index_file_name, self.filename)
+        except Exception as e:
+            raise AzurePageIndexError(
+                '%s: %s' % (type(e).__name__, format(e))
+            )
+
+    def __load(self):
+        try:
+            with open(self.filename, 'rb') as index_file:
+                header = json.loads(index_file.readline().decode())
+                extents = array('Q')
+                extents.frombytes(index_file.read())
+        except (IOError, OSError, ValueError):
+            return False
+        if header.get('key') != self.key or len(extents) % 2:
+            return False
+        self.image_size = header['image_size']
+        self.extents = extents
+        return True
+
+    def __sample_hash(self, source, size):
+        sample = hashlib.sha1()
+        with open(source, 'rb') as source_file:
+            sample.update(source_file.read(self.SAMPLE_SIZE))
+            source_file.seek(max(size - self.SAMPLE_SIZE, 0))
+            sample.update(source_file.read(self.SAMPLE_SIZE))
+        return sample.hexdigest()
@@ -0,0 +1,115 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import hashlib
+import json
+from azure.common import AzureMissingResourceHttpError
+
+# project
+from azurectl.azurectl_exceptions import AzurePageManifestError
+
+
+class PageManifest(object):
+    """
+        Per block hash manifest of the content of a page blob
+
+        The manifest is stored as block blob <blob_name>.manifest next
+        to the page blob. It lists the sha1 hash of every block of
+        block_size bytes, zero blocks are listed with an empty hash.
+        Together with the etag of the page blob at the time the
+        manifest was written it allows to upload only the blocks
+        which differ from the previous upload
+    """
+    BLOCK_SIZE = 1024 * 1024
+    MANIFEST_SUFFIX = '.manifest'
+
+    def __init__(self, blob_service, container, blob_name, byte_size):
+        self.blob_service = blob_service
+        self.container = container
+        self.blob_name = blob_name
+        self.manifest_name = blob_name + self.MANIFEST_SUFFIX
+        self.block_size = self.BLOCK_SIZE
+        self.byte_size = byte_size
+        self.hashes = [''] * (
+            (byte_size + self.block_size - 1) // self.block_size
+        )
+        self.previous_hashes = None
+        self.etag = None
+
+    def load(self, blob_name=None):
+        """
+            Load the stored manifest as previous manifest, by default
+            the manifest of the page blob itself or the one of the given
+            blob_name. Returns False if there is no manifest matching
+            the block layout
+        """
+        manifest_name = self.manifest_name
+        if blob_name:
+            manifest_name = blob_name + self.MANIFEST_SUFFIX
+        try:
+            manifest = json.loads(
+                self.blob_service.get_blob_to_bytes(
+                    self.container, manifest_name
+                ).content.decode()
+            )
+        except AzureMissingResourceHttpError:
+            return False
+        except Exception as e:
+            raise AzurePageManifestError(
+                '%s: %s' % (type(e).__name__, format(e))
+            )
+        if manifest.get('block_size') != self.block_size or \
+                manifest.get('byte_size') != self.byte_size:
+            return False
+        self.previous_hashes = manifest['hashes']
+        self.etag = manifest['etag']
+        return True
+
+    def discard_previous(self):
+        self.previous_hashes = None
+        self.etag = None
+
+    def update(self, block_index, block_data):
+        """
+            Record the hash of the given block, None for a zero block.
+            Returns whether the block differs from the previous manifest
+        """
+        block_hash = ''
+        if block_data is not None:
+            block_hash = hashlib.sha1(block_data).hexdigest()
+        self.hashes[block_index] = block_hash
+        if self.previous_hashes is None:
+            return True
+        return self.previous_hashes[block_index] != block_hash
+
+    def save(self, etag):
+        """
+            Store the manifest for the page blob in the state
+            identified by etag
+        """
+        manifest = {
+            'block_size': self.block_size,
+            'byte_size': self.byte_size,
+            'etag': etag,
+            'hashes': self.hashes
+        }
+        try:
+            self.blob_service.create_blob_from_bytes(
+                self.container,
+                self.manifest_name,
+                json.dumps(manifest).encode()
+            )
+        except Exception as e:
+            raise AzurePageManifestError(
+                '%s: %s' % (type(e).__name__, format(e))
+            )
@@ -0,0 +1,75 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+import time
+
+
+class RateLimiter(object):
+    """
+        Implements a token bucket limiting the bytes per second sent
+        by page writes
+
+        The bucket holds up to one second of tokens. A page write takes
+        its length from the bucket and waits until the bucket is no
+        longer in debt, such that concurrent page writes are delayed
+        in turn and the average rate stays at the limit
+
+        With a bandwidth share, the limit is divided by the number of
+        uploads of the host taking part in the share, which is looked
+        up again every SHARE_INTERVAL seconds
+    """
+    SHARE_INTERVAL = 2
+
+    def __init__(self, max_bandwidth, share=None):
+        self.max_bandwidth = int(max_bandwidth)
+        self.share = share
+        self.rate = self.max_bandwidth
+        self.tokens = self.rate
+        self.last_time = time.time()
+        self.share_time = None
+        # seconds page writes were delayed
+        self.delay_time = 0
+        self.lock = threading.Lock()
+
+    def consume(self, length):
+        """
+            Take length bytes from the bucket, waits until they are
+            covered by the rate
+        """
+        with self.lock:
+            now = time.time()
+            self.__update_rate(now)
+            self.tokens = min(
+                self.tokens + (now - self.last_time) * self.rate, self.rate
+            )
+            self.last_time = now
+            self.tokens -= length
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.delay_time += delay
+        if delay:
+            time.sleep(delay)
+
+    def close(self):
+        if self.share:
+            self.share.close()
+
+    def __update_rate(self, now):
+        if not self.share:
+            return
+        if self.share_time is None or \
+                now - self.share_time >= self.SHARE_INTERVAL:
+            self.share_time = now
+            self.rate = max(
+                self.max_bandwidth // self.share.participants(), 1
+            )
@@ -0,0 +1,110 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import random
+import threading
+
+
+class RetryPolicy(object):
+    """
+        Implements the retry decision and the delay between the
+        attempts of a page write
+
+        The delay grows exponentially from base_delay up to max_delay
+        and is drawn at random below that bound (full jitter), such
+        that the writes of concurrent threads and processes do not
+        retry in lock step. Responses telling the storage account is
+        busy wait at least THROTTLED_DELAY, or as long as their
+        Retry-After header asks for. Client errors other than timeout
+        and throttling are not retried. All writes of one upload share
+        the retry budget, once it is used up failed writes are no
+        longer retried
+
+        The policy replaces the retry of the azure storage services,
+        see retry, such that page writes are retried here only
+    """
+    # http status codes of a busy or throttling storage account
+    THROTTLED_STATUS = (429, 500, 503)
+    # client errors which may pass when retried
+    RETRYABLE_CLIENT_STATUS = (408, 429)
+    # seconds
+    THROTTLED_DELAY = 5
+
+    def __init__(self, retry_budget=None, base_delay=1, max_delay=60):
+        self.retry_budget = retry_budget
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self.failed_request = threading.local()
+
+    def retry(self, context):
+        """
+            Retry function of the azure storage services. Keeps the
+            response of the failed request from the retry context for
+            the calling thread and never lets the service retry
+        """
+        self.failed_request.response = context.response
+        return None
+
+    def failed_response(self):
+        """
+            Return and forget the http response of the last failed
+            request of the calling thread, None if it got no response
+        """
+        response = getattr(self.failed_request, 'response', None)
+        self.failed_request.response = None
+        return response
+
+    def delay(self, response, attempts, max_attempts):
+        """
+            Return the seconds to wait before retrying a write which
+            failed after the given number of attempts, or None if the
+            write is not retried. response is the http response of the
+            failed attempt, None if the attempt got no response
+        """
+        status = response.status if response else None
+        if attempts >= max_attempts or not self.__retryable(status):
+            return None
+        with self.lock:
+            if self.retry_budget is not None and \
+                    self.retries >= self.retry_budget:
+                return None
+            self.retries += 1
+            throttled = status in self.THROTTLED_STATUS
+            if throttled:
+                self.throttled += 1
+        delay = random.uniform(
+            0, min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+        )
+        if throttled:
+            delay = max(delay, self.THROTTLED_DELAY)
+        retry_after = self.__retry_after(response)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def __retryable(self, status):
+        if status is None or status >= 500:
+            return True
+        return status < 400 or status in self.RETRYABLE_CLIENT_STATUS
+
+    def __retry_after(self, response):
+        # the storage service lower cases the response headers
+        if not response or not response.headers:
+            return None
+        try:
+            return float(response.headers.get('retry-after'))
+        except (TypeError, ValueError):
+            return None
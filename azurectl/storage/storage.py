@@ -11,20 +11,57 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import copy
+import json
+import multiprocessing
 import os
+import threading
+import time
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    wait
+)
+from azure.storage.blob.blockblobservice import BlockBlobService
 from azure.storage.blob.pageblobservice import PageBlobService
 from azure.storage.sharedaccesssignature import SharedAccessSignature
 
 # project
-from azurectl.utils.xz import XZ
+from azurectl.utils.codec import Codec
 from azurectl.azurectl_exceptions import (
+    AzurePageIndexError,
+    AzureStorageCopyError,
     AzureStorageFileNotFound,
     AzureStorageStreamError,
     AzureStorageUploadError,
     AzureStorageDeleteError
 )
+from azurectl.utils.extentstream import ExtentStream
 from azurectl.utils.filetype import FileType
+from azurectl.utils.pipestream import PipeStream
+from azurectl.utils.readahead import ReadAhead
+from azurectl.utils.sparsefile import SparseFile
+from azurectl.utils.tarmember import TarMember
+from azurectl.utils.vhd import (
+    FixedVHD,
+    VHDFooter
+)
+from azurectl.storage.bandwidth_share import BandwidthShare
+from azurectl.storage.fanout_upload import (
+    FanoutTarget,
+    FanoutUpload
+)
 from azurectl.storage.page_blob import PageBlob
+from azurectl.storage.page_index import PageIndex
+from azurectl.storage.page_manifest import PageManifest
+from azurectl.storage.striped_upload import StripedUpload
+from azurectl.storage.hedge_policy import HedgePolicy
+from azurectl.storage.rate_limiter import RateLimiter
+from azurectl.storage.retry_policy import RetryPolicy
+from azurectl.storage.upload_budget import UploadBudget
+from azurectl.storage.upload_controller import UploadController
+from azurectl.storage.upload_journal import UploadJournal
+from azurectl.storage.upload_telemetry import UploadTelemetry
+from azurectl.utils.ranges import ByteRanges
 from azurectl.logger import log
 
 
@@ -35,53 +72,418 @@ class Storage(object):
     """
         Implements storage operations in Azure storage containers
     """
+    # max size of the chunks read ahead of the upload
+    READ_AHEAD_SIZE = 64 * 1024 * 1024
+    # max number of page write retries of one upload
+    RETRY_BUDGET = 1000
+    # keep an index of the non zero pages of uploaded images
+    PAGE_INDEX = True
+    # seconds between the updates of the status of a batch upload
+    BATCH_STATUS_INTERVAL = 1
+    # source name of images read from stdin
+    STDIN = '-'
+
     def __init__(self, account, container):
         self.account = account
         self.account_name = account.storage_name()
         self.account_key = account.storage_key()
         self.blob_service_host_base = self.account.get_blob_service_host_base()
         self.container = container
-        self.upload_status = {'current_bytes': 0, 'total_bytes': 0}
+        self.upload_status = {
+            'current_bytes': 0, 'total_bytes': 0, 'skipped_bytes': 0,
+            'unchanged_bytes': 0, 'retries': 0, 'hedged_writes': 0
+        }
+        self.target_status = {}
+        self.batch_uploads = []
+        self.upload_status_lock = threading.Lock()
+        self.telemetry = UploadTelemetry()
+        self.copy_poll_interval = 5
 
-    def upload(self, image, name=None, max_chunk_size=None, max_attempts=5):
-        if not os.path.exists(image):
-            raise AzureStorageFileNotFound('File %s not found' % image)
+    def upload(
+        self, image, name=None, max_chunk_size=None, max_attempts=5,
+        max_threads=1, decompress_threads=None, resume=False, delta=False,
+        base_blob=None, read_ahead_size=None, max_processes=1,
+        auto_tune=False, retry_budget=None, hedge=False, targets=None,
+        budget=None, max_bandwidth=None, shared_bandwidth=False,
+        rate_limiter=None, to_vhd=False, member=None, size=None
+    ):
+        """
+            Upload the image as page blob. With a list of targets,
+            [account_name, container] pairs, the image is uploaded to
+            the given containers of other storage accounts of the
+            subscription as well, reading the image once. With an
+            upload budget, the page writes of a single process upload
+            share the budget with other uploads. With max_bandwidth,
+            the page writes send at most that many bytes per second,
+            with shared_bandwidth the limit is divided between the
+            uploads of the host sharing it. A rate limiter given
+            instead is shared with other uploads. With to_vhd, a raw
+            image is uploaded as fixed VHD, padded to the VHD size
+            alignment and followed by a fixed VHD footer. With a
+            member name, the image is a tar archive, optionally
+            compressed, and the given member of the archive is
+            uploaded instead of the image. An image read from stdin,
+            given as '-', is uploaded while it is written to stdin, its
+            size and a blob name are required
+        """
+        if image == self.STDIN:
+            # the image read from stdin can not be looked at up front
+            # and is uploaded as raw sequence of bytes
+            self.__check_stdin_upload(name, size, resume, member)
+            image_type = None
+            blob_name = name
+            data_size = int(size)
+        else:
+            if not os.path.exists(image):
+                raise AzureStorageFileNotFound('File %s not found' % image)
+            image_type = FileType(image)
+            if member:
+                blob_name = (name or os.path.basename(member))
+            else:
+                blob_name = (name or image_type.basename())
+            if not name:
+                log.info('blob-name: %s', blob_name)
+            data_size = self.__upload_byte_size(image, image_type, member)
         blob_service = PageBlobService(
             self.account_name,
             self.account_key,
             endpoint_suffix=self.blob_service_host_base
         )
 
-        image_type = FileType(image)
-        blob_name = (name or image_type.basename())
-        if not name:
-            log.info('blob-name: %s', blob_name)
-        image_size = self.__upload_byte_size(image, image_type)
+        image_size = data_size
+        to_vhd = to_vhd and (
+            image_type is None or self.__vhd_conversion(image_type)
+        )
+        if to_vhd:
+            image_size = VHDFooter.aligned_size(data_size) + \
+                VHDFooter.FOOTER_SIZE
+        self.telemetry = UploadTelemetry()
+        if read_ahead_size is None:
+            read_ahead_size = self.READ_AHEAD_SIZE
+        if retry_budget is None:
+            retry_budget = self.RETRY_BUDGET
+        self.target_status = {}
+        self.batch_uploads = []
+
+        if targets:
+            if resume or delta or base_blob:
+                raise AzureStorageUploadError(
+                    'Resumed and delta uploads are not supported '
+                    'for uploads to multiple targets'
+                )
+            if int(max_processes) > 1:
+                log.warning(
+                    'Striped upload is not supported for uploads to '
+                    'multiple targets, uploading in one process'
+                )
+            return self.__upload_fanout(
+                image, image_type, member, data_size, image_size, to_vhd,
+                blob_name, targets,
+                max_chunk_size, max_attempts, max_threads,
+                decompress_threads, read_ahead_size, auto_tune,
+                retry_budget, hedge, max_bandwidth, shared_bandwidth,
+                rate_limiter
+            )
+
+        if int(max_processes) > 1 and (resume or delta or base_blob):
+            log.warning(
+                'Striped upload is not supported for resumed or '
+                'delta uploads, uploading in one process'
+            )
+        elif int(max_processes) > 1 and image == self.STDIN:
+            log.warning(
+                'Striped upload is not supported for uploads from stdin, '
+                'uploading in one process'
+            )
+        elif int(max_processes) > 1 and member:
+            log.warning(
+                'Striped upload is not supported for uploads of archive '
+                'members, uploading in one process'
+            )
+        elif int(max_processes) > 1 and to_vhd:
+            log.warning(
+                'Striped upload is not supported for uploads converted '
+                'to VHD, uploading in one process'
+            )
+        elif int(max_processes) > 1 and \
+                Codec.supports(image_type.format) and \
+                not image_type.is_xz():
+            log.warning(
+                'Striped upload is not supported for %s images, '
+                'uploading in one process', image_type.format
+            )
+        elif int(max_processes) > 1:
+            striped_upload = StripedUpload(
+                self.account_name, self.account_key,
+                self.blob_service_host_base, self.container, blob_name,
+                image, image_size, image_type.is_xz()
+            )
+            stripes = striped_upload.stripes(
+                int(max_processes),
+                int(max_chunk_size or blob_service.MAX_CHUNK_GET_SIZE)
+            )
+            if len(stripes) > 1:
+                return self.__upload_striped(
+                    blob_service, striped_upload, stripes, blob_name,
+                    image_size, max_chunk_size, max_attempts, max_threads,
+                    decompress_threads, read_ahead_size, auto_tune,
+                    retry_budget, hedge, max_bandwidth, shared_bandwidth
+                )
+            log.info(
+                'Image can not be split into stripes, '
+                'uploading in one process'
+            )
 
         try:
-            stream = self.__open_upload_stream(image, image_type)
+            stream = self.__open_upload_stream(
+                image, image_type, decompress_threads, member, data_size
+            )
         except Exception as e:
             raise AzureStorageStreamError(
                 '%s: %s' % (type(e).__name__, format(e))
             )
+        page_blob = None
+        journal = None
+        manifest = None
+        own_rate_limiter = None
+        source = stream
         try:
+            if not rate_limiter:
+                rate_limiter = own_rate_limiter = self.__rate_limiter(
+                    max_bandwidth, shared_bandwidth
+                )
+            stream, page_index = self.__page_index_stream(
+                image, data_size, stream, member
+            )
+            if to_vhd:
+                stream = FixedVHD(stream, data_size)
+            if resume:
+                journal = UploadJournal(
+                    image, self.account_name, self.container, blob_name
+                )
+            if delta or base_blob:
+                manifest = PageManifest(
+                    BlockBlobService(
+                        self.account_name,
+                        self.account_key,
+                        endpoint_suffix=self.blob_service_host_base
+                    ),
+                    self.container, blob_name, image_size
+                )
+                if base_blob:
+                    self.__copy_base_blob(
+                        blob_service, base_blob, blob_name, manifest
+                    )
+                else:
+                    manifest.load()
+            controller = None
+            if auto_tune:
+                controller = UploadController(max_chunk_size, max_threads)
+            retry_policy = RetryPolicy(int(retry_budget))
+            hedge_policy = None
+            if hedge:
+                hedge_policy = HedgePolicy(
+                    PageBlobService(
+                        self.account_name,
+                        self.account_key,
+                        endpoint_suffix=self.blob_service_host_base
+                    )
+                )
             page_blob = PageBlob(
-                blob_service, blob_name, self.container, image_size
+                blob_service, blob_name, self.container, image_size,
+                max_threads, journal, manifest, controller=controller,
+                retry_policy=retry_policy, hedge_policy=hedge_policy,
+                telemetry=self.telemetry, page_index=page_index,
+                budget=budget, rate_limiter=rate_limiter
             )
+            if int(read_ahead_size) > 0:
+                stream = ReadAhead(
+                    stream, page_blob.chunk_size(max_chunk_size),
+                    read_ahead_size, page_blob.read_alignment
+                )
+            if manifest and manifest.previous_hashes is not None:
+                log.info('Delta upload over existing blob %s', blob_name)
+            if page_blob.committed_ranges:
+                log.info(
+                    'Resuming upload, %d bytes already committed',
+                    ByteRanges.size(page_blob.committed_ranges)
+                )
             self.__upload_status(0, image_size)
             while True:
-                bytes_transfered = page_blob.next(
-                    stream, max_chunk_size, max_attempts
+                try:
+                    bytes_transfered = page_blob.next(
+                        stream, max_chunk_size, max_attempts
+                    )
+                except StopIteration:
+                    break
+                self.__account_decompress_time(source)
+                self.__upload_status(
+                    bytes_transfered, image_size,
+                    page_blob.zero_bytes_skipped, page_blob.unchanged_bytes,
+                    retry_policy.retries,
+                    hedge_policy.hedged if hedge_policy else 0
                 )
-                self.__upload_status(bytes_transfered, image_size)
-        except StopIteration:
-            stream.close()
-            self.__upload_status(image_size, image_size)
+            self.__account_decompress_time(source)
+            if page_index:
+                self.__save_page_index(page_index, data_size)
+            if journal:
+                journal.delete()
+            if manifest:
+                manifest.save(
+                    blob_service.get_blob_properties(
+                        self.container, blob_name
+                    ).properties.etag
+                )
+            self.__upload_status(
+                image_size, image_size,
+                page_blob.zero_bytes_skipped, page_blob.unchanged_bytes,
+                retry_policy.retries,
+                hedge_policy.hedged if hedge_policy else 0
+            )
         except Exception as e:
-            stream.close()
             raise AzureStorageUploadError(
                 '%s: %s' % (type(e).__name__, format(e))
             )
+        finally:
+            stream.close()
+            if page_blob:
+                page_blob.close()
+            if journal:
+                journal.close()
+            if own_rate_limiter:
+                own_rate_limiter.close()
+
+    def upload_batch(
+        self, sources, max_parallel=1, max_in_flight_bytes=None,
+        max_chunk_size=None, max_attempts=5, max_threads=1,
+        decompress_threads=None, read_ahead_size=None, auto_tune=False,
+        retry_budget=None, hedge=False, max_bandwidth=None,
+        shared_bandwidth=False
+    ):
+        """
+            Upload a batch of images, given as list of [image, name]
+            pairs, up to max_parallel images at a time. The page writes
+            of all images share a budget of max_threads page writes and
+            max_in_flight_bytes bytes in flight, as well as the
+            bandwidth limit. A failed image does not stop the upload of
+            the others
+        """
+        uploads = []
+        for image, name in sources:
+            if not os.path.exists(image):
+                raise AzureStorageFileNotFound('File %s not found' % image)
+            image_type = FileType(image)
+            uploads.append(
+                {
+                    'source': image,
+                    'blob_name': name or image_type.basename(),
+                    'total_bytes': self.__upload_byte_size(image, image_type),
+                    'storage': self.__batch_storage(),
+                    'error': None
+                }
+            )
+        blob_names = [upload['blob_name'] for upload in uploads]
+        for blob_name in blob_names:
+            if blob_names.count(blob_name) > 1:
+                raise AzureStorageUploadError(
+                    'Blob name %s used for more than one image' % blob_name
+                )
+        max_parallel = max(min(int(max_parallel), len(uploads)), 1)
+        if read_ahead_size is None:
+            read_ahead_size = self.READ_AHEAD_SIZE
+        if not decompress_threads:
+            decompress_threads = multiprocessing.cpu_count()
+        budget = UploadBudget(max_threads, max_in_flight_bytes)
+        self.telemetry = UploadTelemetry()
+        self.target_status = {}
+        self.batch_uploads = uploads
+        self.__batch_upload_status()
+
+        log.info(
+            'Uploading %d images, %d at a time', len(uploads), max_parallel
+        )
+        pool = ThreadPoolExecutor(max_workers=max_parallel)
+        futures = []
+        rate_limiter = None
+        try:
+            rate_limiter = self.__rate_limiter(max_bandwidth, shared_bandwidth)
+            for upload in uploads:
+                futures.append(
+                    pool.submit(
+                        upload['storage'].upload, upload['source'],
+                        upload['blob_name'], max_chunk_size, max_attempts,
+                        max_threads,
+                        max(int(decompress_threads) // max_parallel, 1),
+                        read_ahead_size=int(read_ahead_size) // max_parallel,
+                        auto_tune=auto_tune, retry_budget=retry_budget,
+                        hedge=hedge, budget=budget, rate_limiter=rate_limiter
+                    )
+                )
+            pending = futures
+            while pending:
+                pending = wait(
+                    pending, timeout=self.BATCH_STATUS_INTERVAL
+                ).not_done
+                self.__batch_upload_status()
+        finally:
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=True)
+            if rate_limiter:
+                rate_limiter.close()
+        failed_uploads = []
+        for upload, future in zip(uploads, futures):
+            error = future.exception()
+            if error:
+                upload['error'] = '%s: %s' % (
+                    type(error).__name__, format(error)
+                )
+                failed_uploads.append(upload)
+        if failed_uploads:
+            raise AzureStorageUploadError(
+                'Upload of %d of %d images failed: %s' % (
+                    len(failed_uploads), len(uploads), ', '.join(
+                        '%s: %s' % (upload['source'], upload['error'])
+                        for upload in failed_uploads
+                    )
+                )
+            )
+
+    def scan(self, image, decompress_threads=None):
+        """
+            Size of the uncompressed image and of its non zero pages,
+            according to the page index of the image. Images without
+            a page index are scanned for zero pages
+        """
+        if not os.path.exists(image):
+            raise AzureStorageFileNotFound('File %s not found' % image)
+        image_type = FileType(image)
+        image_size = self.__upload_byte_size(image, image_type)
+        page_index = PageIndex(image)
+        cached = page_index.cached and page_index.image_size == image_size
+        if not cached:
+            try:
+                stream = self.__open_upload_stream(
+                    image, image_type, decompress_threads
+                )
+                try:
+                    page_index.scan(stream, image_size)
+                finally:
+                    stream.close()
+            except Exception as e:
+                raise AzureStorageStreamError(
+                    '%s: %s' % (type(e).__name__, format(e))
+                )
+            page_index.save(image_size)
+        non_zero_bytes = page_index.non_zero_bytes()
+        return {
+            'image_size': image_size,
+            'non_zero_bytes': non_zero_bytes,
+            'zero_bytes': image_size - non_zero_bytes,
+            'extents': len(page_index.extents) // 2,
+            'cached': cached,
+            'page_index': page_index.filename
+        }
 
     def upload_empty_image(self, image_size, footer, name):
         blob_service = PageBlobService(
@@ -142,22 +544,411 @@ class Storage(object):
             )
 
     def print_upload_status(self):
-        log.progress(
-            self.upload_status['current_bytes'],
-            self.upload_status['total_bytes'],
-            'Uploading'
+        with self.upload_status_lock:
+            current_bytes = self.upload_status['current_bytes']
+            total_bytes = self.upload_status['total_bytes']
+        log.progress(current_bytes, total_bytes, 'Uploading')
+
+    def upload_summary(self):
+        """
+            Upload status along with the throughput, the estimated
+            time to finish and the time spent in the upload stages
+        """
+        with self.upload_status_lock:
+            summary = dict(self.upload_status)
+            if self.target_status:
+                summary['targets'] = self.target_status
+        if self.batch_uploads:
+            summary['images'] = {}
+            for upload in self.batch_uploads:
+                image_summary = upload['storage'].upload_summary()
+                image_summary['source'] = upload['source']
+                image_summary['error'] = upload['error']
+                summary['images'][upload['blob_name']] = image_summary
+        summary.update(
+            self.telemetry.summary(
+                summary['current_bytes'], summary['total_bytes']
+            )
         )
+        return summary
 
-    def __upload_status(self, current, total):
-        self.upload_status['current_bytes'] = current
-        self.upload_status['total_bytes'] = total
+    def write_upload_status(self, progress_stream):
+        """
+            Write the upload summary as one JSON line
+        """
+        progress_stream.write(
+            json.dumps(self.upload_summary(), sort_keys=True) + '\n'
+        )
+        progress_stream.flush()
 
-    def __open_upload_stream(self, image, image_type):
-        if image_type.is_xz():
-            return XZ.open(image)
-        return open(image)
+    def __upload_status(
+        self, current, total, skipped=0, unchanged=0, retries=0, hedged=0
+    ):
+        with self.upload_status_lock:
+            self.upload_status['current_bytes'] = current
+            self.upload_status['total_bytes'] = total
+            self.upload_status['skipped_bytes'] = skipped
+            self.upload_status['unchanged_bytes'] = unchanged
+            self.upload_status['retries'] = retries
+            self.upload_status['hedged_writes'] = hedged
+
+    def __copy_base_blob(self, blob_service, base_blob, blob_name, manifest):
+        """
+            Server side copy of base_blob to blob_name. On success the
+            manifest of the base blob becomes the previous manifest of
+            the copy, such that only the blocks differing from the base
+            are uploaded
+        """
+        if not manifest.load(base_blob):
+            log.warning(
+                'No matching manifest for base blob %s, uploading full image',
+                base_blob
+            )
+            return
+        base = blob_service.get_blob_properties(self.container, base_blob)
+        if base.properties.etag != manifest.etag:
+            log.warning(
+                'Base blob %s changed since its manifest was written, '
+                'uploading full image', base_blob
+            )
+            manifest.discard_previous()
+            return
+        log.info('Copying base blob %s to %s', base_blob, blob_name)
+        copy = blob_service.copy_blob(
+            self.container, blob_name,
+            blob_service.make_blob_url(self.container, base_blob),
+            source_if_match=manifest.etag
+        )
+        while copy.status == 'pending':
+            time.sleep(self.copy_poll_interval)
+            copy = blob_service.get_blob_properties(
+                self.container, blob_name
+            ).properties.copy
+        if copy.status != 'success':
+            raise AzureStorageCopyError(
+                'Copy of base blob %s failed with status %s: %s' % (
+                    base_blob, copy.status, copy.status_description
+                )
+            )
+        manifest.etag = blob_service.get_blob_properties(
+            self.container, blob_name
+        ).properties.etag
 
-    def __upload_byte_size(self, image, image_type):
-        if image_type.is_xz():
-            return XZ.uncompressed_size(image)
-        return os.path.getsize(image)
+    def __upload_striped(
+        self, blob_service, striped_upload, stripes, blob_name,
+        image_size, max_chunk_size, max_attempts, max_threads,
+        decompress_threads, read_ahead_size, auto_tune, retry_budget, hedge,
+        max_bandwidth, shared_bandwidth
+    ):
+        if max_bandwidth and not shared_bandwidth:
+            max_bandwidth = int(max_bandwidth) // len(stripes)
+        try:
+            log.info('Uploading %d stripes in parallel', len(stripes))
+            # creates the blob
+            PageBlob(blob_service, blob_name, self.container, image_size)
+            self.__upload_status(0, image_size)
+            if not decompress_threads:
+                decompress_threads = multiprocessing.cpu_count()
+            striped_upload.upload(
+                stripes,
+                lambda current, skipped, retries, hedged, stage_seconds:
+                self.__striped_upload_status(
+                    image_size, current, skipped, retries, hedged,
+                    stage_seconds
+                ),
+                max_chunk_size, max_attempts, max_threads,
+                max(int(decompress_threads) // len(stripes), 1),
+                int(read_ahead_size) // len(stripes), auto_tune,
+                int(retry_budget) // len(stripes), hedge, max_bandwidth,
+                shared_bandwidth
+            )
+            self.__upload_status(
+                image_size, image_size,
+                self.upload_status['skipped_bytes'],
+                retries=self.upload_status['retries'],
+                hedged=self.upload_status['hedged_writes']
+            )
+        except Exception as e:
+            raise AzureStorageUploadError(
+                '%s: %s' % (type(e).__name__, format(e))
+            )
+
+    def __striped_upload_status(
+        self, image_size, current, skipped, retries, hedged, stage_seconds
+    ):
+        self.telemetry.update(stage_seconds)
+        self.__upload_status(
+            current, image_size, skipped, retries=retries, hedged=hedged
+        )
+
+    def __upload_fanout(
+        self, image, image_type, member, data_size, image_size, to_vhd,
+        blob_name, targets,
+        max_chunk_size, max_attempts, max_threads, decompress_threads,
+        read_ahead_size, auto_tune, retry_budget, hedge, max_bandwidth,
+        shared_bandwidth, rate_limiter
+    ):
+        fanout_targets = [
+            FanoutTarget(
+                self.account_name, self.account_key,
+                self.blob_service_host_base, self.container
+            )
+        ]
+        for account_name, container in targets:
+            fanout_targets.append(
+                FanoutTarget(
+                    account_name, self.account.storage_key(account_name),
+                    self.blob_service_host_base, container
+                )
+            )
+        fanout_upload = FanoutUpload(fanout_targets, blob_name, image_size)
+        try:
+            stream = self.__open_upload_stream(
+                image, image_type, decompress_threads, member, data_size
+            )
+        except Exception as e:
+            raise AzureStorageStreamError(
+                '%s: %s' % (type(e).__name__, format(e))
+            )
+        own_rate_limiter = None
+        source = stream
+        try:
+            log.info('Uploading to %d targets', len(fanout_targets))
+            if not rate_limiter:
+                rate_limiter = own_rate_limiter = self.__rate_limiter(
+                    max_bandwidth, shared_bandwidth
+                )
+            stream, page_index = self.__page_index_stream(
+                image, data_size, stream, member
+            )
+            if to_vhd:
+                stream = FixedVHD(stream, data_size)
+            if int(read_ahead_size) > 0:
+                stream = ReadAhead(
+                    stream, fanout_upload.chunk_size(max_chunk_size),
+                    read_ahead_size, FanoutUpload.PAGE_SIZE
+                )
+            self.__upload_status(0, image_size)
+            fanout_upload.upload(
+                stream,
+                lambda target_status: self.__fanout_upload_status(
+                    image_size, source, target_status
+                ),
+                max_chunk_size, max_attempts, max_threads, auto_tune,
+                int(retry_budget), hedge, self.telemetry, page_index,
+                rate_limiter
+            )
+            if page_index:
+                self.__save_page_index(page_index, data_size)
+        except Exception as e:
+            raise AzureStorageUploadError(
+                '%s: %s' % (type(e).__name__, format(e))
+            )
+        finally:
+            stream.close()
+            if own_rate_limiter:
+                own_rate_limiter.close()
+        failed_targets = fanout_upload.failed_targets()
+        if failed_targets:
+            raise AzureStorageUploadError(
+                'Upload to %d of %d targets failed: %s' % (
+                    len(failed_targets), len(fanout_targets),
+                    ', '.join(
+                        '%s: %s' % (target.name, target.error)
+                        for target in failed_targets
+                    )
+                )
+            )
+
+    def __batch_storage(self):
+        # every image of a batch is uploaded by a storage instance of
+        # its own, which keeps the status of its upload
+        storage = copy.copy(self)
+        storage.upload_status = dict.fromkeys(self.upload_status, 0)
+        storage.upload_status_lock = threading.Lock()
+        storage.telemetry = UploadTelemetry()
+        storage.target_status = {}
+        storage.batch_uploads = []
+        return storage
+
+    def __batch_upload_status(self):
+        status = dict.fromkeys(self.upload_status, 0)
+        stage_seconds = dict.fromkeys(UploadTelemetry.STAGES, 0.0)
+        for upload in self.batch_uploads:
+            storage = upload['storage']
+            with storage.upload_status_lock:
+                for key, value in storage.upload_status.items():
+                    status[key] += value
+            for stage, seconds in storage.telemetry.stages().items():
+                stage_seconds[stage] += seconds
+        # images not started yet count with their size
+        status['total_bytes'] = sum(
+            upload['total_bytes'] for upload in self.batch_uploads
+        )
+        self.telemetry.update(stage_seconds)
+        with self.upload_status_lock:
+            self.upload_status.update(status)
+
+    def __fanout_upload_status(self, image_size, source, target_status):
+        self.__account_decompress_time(source)
+        active_status = [
+            status for status in target_status.values()
+            if not status['error']
+        ] or list(target_status.values())
+        with self.upload_status_lock:
+            self.target_status = target_status
+        self.__upload_status(
+            min(status['current_bytes'] for status in active_status),
+            image_size,
+            max(status['skipped_bytes'] for status in active_status),
+            retries=sum(
+                status['retries'] for status in target_status.values()
+            ),
+            hedged=sum(
+                status['hedged_writes'] for status in target_status.values()
+            )
+        )
+
+    def __rate_limiter(self, max_bandwidth, shared_bandwidth):
+        if not max_bandwidth:
+            return None
+        share = None
+        if shared_bandwidth:
+            share = BandwidthShare()
+        return RateLimiter(max_bandwidth, share)
+
+    def __page_index_stream(self, image, image_size, stream, member=None):
+        """
+            With a page index of the image, the stream reading along
+            the non zero ranges of the index. Otherwise the stream and
+            a new page index to record the non zero ranges in
+        """
+        if not self.PAGE_INDEX or image == self.STDIN:
+            return stream, None
+        page_index = PageIndex(image, member=member)
+        if page_index.cached and page_index.image_size == image_size:
+            log.info(
+                'Using page index, %d bytes of non zero pages',
+                page_index.non_zero_bytes()
+            )
+            return ExtentStream(stream, page_index.ranges(), image_size), \
+                None
+        return stream, page_index
+
+    def __save_page_index(self, page_index, image_size):
+        # the upload succeeded, a missing index only costs a rescan
+        try:
+            page_index.save(image_size)
+        except AzurePageIndexError as e:
+            log.warning('Page index not saved: %s', e)
+
+    def __vhd_conversion(self, image_type):
+        # images of the VHD formats are uploaded as fixed VHD anyway
+        if image_type.format in (
+            FileType.VHD, FileType.VHD_DYNAMIC, FileType.QCOW2
+        ):
+            log.info(
+                'Uploading %s image as it is, no VHD conversion needed',
+                image_type.format
+            )
+            return False
+        return True
+
+    def __account_decompress_time(self, stream):
+        if hasattr(stream, 'decompress_time'):
+            self.telemetry.update({'decompress': stream.decompress_time})
+
+    def __open_upload_stream(
+        self, image, image_type, decompress_threads, member=None,
+        byte_size=None
+    ):
+        if image == self.STDIN:
+            return PipeStream.open(byte_size)
+        if Codec.supports(image_type.format):
+            if not decompress_threads:
+                decompress_threads = multiprocessing.cpu_count()
+            stream = Codec.open(
+                image_type.format, image, threads=decompress_threads
+            )
+        else:
+            stream = SparseFile.open(image)
+        if not member:
+            return stream
+        try:
+            return TarMember(stream, member)
+        except Exception:
+            stream.close()
+            raise
+
+    def __check_stdin_upload(self, name, size, resume, member):
+        # the upload can not look ahead or start over in the image
+        if not size:
+            raise AzureStorageUploadError(
+                'The image size is required for uploads from stdin'
+            )
+        if not name:
+            raise AzureStorageUploadError(
+                'A blob name is required for uploads from stdin'
+            )
+        if resume or member:
+            raise AzureStorageUploadError(
+                'Resumed uploads and uploads of archive members are '
+                'not supported for uploads from stdin'
+            )
+
+    def __upload_byte_size(self, image, image_type, member=None):
+        if member:
+            return self.__member_byte_size(image, image_type, member)
+        if not Codec.supports(image_type.format):
+            return os.path.getsize(image)
+        image_size = Codec.uncompressed_size(image_type.format, image)
+        if image_size is None:
+            image_size = self.__scanned_byte_size(image, image_type)
+        return image_size
+
+    def __member_byte_size(self, image, image_type, member):
+        """
+            Size of an archive member. The size is taken from the page
+            index of the member, otherwise the archive is read up to
+            the header of the member
+        """
+        page_index = PageIndex(image, member=member)
+        if page_index.cached:
+            return page_index.image_size
+        try:
+            with self.__open_upload_stream(
+                image, image_type, None, member
+            ) as stream:
+                return stream.byte_size
+        except Exception as e:
+            raise AzureStorageStreamError(
+                '%s: %s' % (type(e).__name__, format(e))
+            )
+
+    def __scanned_byte_size(self, image, image_type):
+        """
+            Uncompressed size of an image whose format does not record
+            it. The size is taken from the page index of the image,
+            otherwise the image is decompressed once to count it and
+            the page index built along the way is kept for the upload
+        """
+        page_index = PageIndex(image)
+        if page_index.cached:
+            return page_index.image_size
+        log.info(
+            'Uncompressed size of %s compressed image unknown, '
+            'scanning the image', image_type.format
+        )
+        try:
+            stream = self.__open_upload_stream(image, image_type, None)
+            try:
+                page_index.scan(stream)
+            finally:
+                stream.close()
+        except Exception as e:
+            raise AzureStorageStreamError(
+                '%s: %s' % (type(e).__name__, format(e))
+            )
+        if self.PAGE_INDEX:
+            self.__save_page_index(page_index, page_index.image_size)
+        return page_index.image_size
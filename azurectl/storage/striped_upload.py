@@ -0,0 +1,276 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import bisect
+import multiprocessing
+from azure.storage.blob.pageblobservice import PageBlobService
+
+# project
+from azurectl.storage.bandwidth_share import BandwidthShare
+from azurectl.storage.hedge_policy import HedgePolicy
+from azurectl.storage.page_blob import PageBlob
+from azurectl.storage.rate_limiter import RateLimiter
+from azurectl.storage.retry_policy import RetryPolicy
+from azurectl.storage.upload_telemetry import UploadTelemetry
+from azurectl.storage.upload_controller import UploadController
+from azurectl.utils.readahead import ReadAhead
+from azurectl.utils.sparsefile import SparseFile
+from azurectl.utils.xz import (
+    XZ,
+    ParallelXZ
+)
+
+
+class StripedUpload(object):
+    """
+        Implements the upload of an image into an existing page blob
+        by a pool of worker processes
+
+        The image is split into stripes, byte ranges of the blob which
+        are uploaded in parallel. Every worker process reads its stripe
+        through a file descriptor of its own and writes it through a
+        blob service connection of its own, such that zero page
+        detection, decompression and TLS scale with the number of
+        cores. Stripes of xz images start at block boundaries, which
+        requires a multi block xz image. The progress of the workers
+        is collected in shared memory
+    """
+    PROGRESS_INTERVAL = 1
+    # current bytes, skipped bytes, retries, hedged writes and
+    # the milliseconds spent in each upload stage
+    PROGRESS_FIELDS = 4 + len(UploadTelemetry.STAGES)
+
+    # shared progress array, set in the worker processes
+    progress = None
+
+    def __init__(
+        self, account_name, account_key, blob_service_host_base,
+        container, blob_name, image, image_size, xz=False
+    ):
+        self.account_name = account_name
+        self.account_key = account_key
+        self.blob_service_host_base = blob_service_host_base
+        self.container = container
+        self.blob_name = blob_name
+        self.image = image
+        self.image_size = image_size
+        self.xz_streams = None
+        if xz:
+            with open(image, 'rb') as xz_file:
+                self.xz_streams = XZ.stream_indexes(xz_file)
+        self.max_chunk_size = None
+        self.max_attempts = 5
+        self.max_threads = 1
+        self.decompress_threads = 1
+        self.read_ahead_size = 0
+        self.auto_tune = False
+        self.retry_budget = None
+        self.hedge = False
+        self.max_bandwidth = None
+        self.shared_bandwidth = False
+
+    def stripes(self, processes, chunk_size):
+        """
+            Split the image into up to the given number of stripes of
+            about the same size and return them as list of [start, end)
+            byte ranges
+        """
+        if self.xz_streams is None:
+            boundaries = range(chunk_size, self.image_size, chunk_size)
+        elif ParallelXZ.supports(self.xz_streams):
+            boundaries = []
+            block_start = 0
+            for stream in self.xz_streams:
+                for unpadded_size, block_size in stream['records']:
+                    if block_start:
+                        boundaries.append(block_start)
+                    block_start += block_size
+        else:
+            boundaries = []
+        split_points = []
+        for index in range(1, processes):
+            position = bisect.bisect_left(
+                boundaries, self.image_size * index // processes
+            )
+            if position < len(boundaries) and \
+                    boundaries[position] not in split_points:
+                split_points.append(boundaries[position])
+        edges = [0] + split_points + [self.image_size]
+        return [
+            [start, end] for start, end in zip(edges[:-1], edges[1:])
+        ]
+
+    def upload(
+        self, stripes, progress_callback, max_chunk_size=None,
+        max_attempts=5, max_threads=1, decompress_threads=1,
+        read_ahead_size=0, auto_tune=False, retry_budget=None, hedge=False,
+        max_bandwidth=None, shared_bandwidth=False
+    ):
+        """
+            Upload the stripes by one worker process per stripe. The
+            progress_callback is called with the sum of the bytes
+            uploaded, of the zero bytes skipped, of the page write
+            retries and of the hedged page writes of all workers, and
+            with the seconds all workers spent in each upload stage.
+            The retry budget and the bandwidth limit apply to every
+            worker on its own, with a shared bandwidth every worker
+            takes part in the bandwidth share of the host
+        """
+        self.max_chunk_size = max_chunk_size
+        self.max_attempts = max_attempts
+        self.max_threads = max_threads
+        self.decompress_threads = decompress_threads
+        self.read_ahead_size = read_ahead_size
+        self.auto_tune = auto_tune
+        self.retry_budget = retry_budget
+        self.hedge = hedge
+        self.max_bandwidth = max_bandwidth
+        self.shared_bandwidth = shared_bandwidth
+        progress = multiprocessing.Array(
+            'q', self.PROGRESS_FIELDS * len(stripes)
+        )
+        pool = multiprocessing.Pool(
+            len(stripes), StripedUpload.init_worker, (progress,)
+        )
+        try:
+            uploads = [
+                pool.apply_async(self.upload_stripe, (index, stripe))
+                for index, stripe in enumerate(stripes)
+            ]
+            pool.close()
+            while uploads:
+                uploads[0].wait(self.PROGRESS_INTERVAL)
+                pending_uploads = []
+                for upload in uploads:
+                    if upload.ready():
+                        # get() re-raises the exception of a failed stripe
+                        upload.get()
+                    else:
+                        pending_uploads.append(upload)
+                uploads = pending_uploads
+                totals = [
+                    sum(progress[field::self.PROGRESS_FIELDS])
+                    for field in range(self.PROGRESS_FIELDS)
+                ]
+                progress_callback(
+                    totals[0], totals[1], totals[2], totals[3], dict(
+                        zip(
+                            UploadTelemetry.STAGES,
+                            [ms / 1000.0 for ms in totals[4:]]
+                        )
+                    )
+                )
+            pool.join()
+        finally:
+            pool.terminate()
+
+    @classmethod
+    def init_worker(self, progress):
+        StripedUpload.progress = progress
+
+    def upload_stripe(self, index, stripe):
+        """
+            Upload one stripe, runs in the worker process
+        """
+        blob_service = PageBlobService(
+            self.account_name,
+            self.account_key,
+            endpoint_suffix=self.blob_service_host_base
+        )
+        controller = None
+        if self.auto_tune:
+            controller = UploadController(
+                self.max_chunk_size, self.max_threads
+            )
+        retry_policy = RetryPolicy(self.retry_budget)
+        telemetry = UploadTelemetry()
+        hedge_policy = None
+        if self.hedge:
+            hedge_policy = HedgePolicy(
+                PageBlobService(
+                    self.account_name,
+                    self.account_key,
+                    endpoint_suffix=self.blob_service_host_base
+                )
+            )
+        rate_limiter = None
+        if self.max_bandwidth:
+            rate_limiter = RateLimiter(
+                self.max_bandwidth,
+                BandwidthShare() if self.shared_bandwidth else None
+            )
+        stream = self.__open_stripe(stripe)
+        page_blob = None
+        try:
+            page_blob = PageBlob(
+                blob_service, self.blob_name, self.container,
+                self.image_size, self.max_threads, stripe=stripe,
+                controller=controller, retry_policy=retry_policy,
+                hedge_policy=hedge_policy, telemetry=telemetry,
+                rate_limiter=rate_limiter
+            )
+            source = stream
+            if self.read_ahead_size:
+                stream = ReadAhead(
+                    stream, page_blob.chunk_size(self.max_chunk_size),
+                    self.read_ahead_size, offset=stripe[0]
+                )
+            while True:
+                try:
+                    bytes_transfered = page_blob.next(
+                        stream, self.max_chunk_size, self.max_attempts
+                    )
+                except StopIteration:
+                    break
+                self.__report(
+                    index, bytes_transfered - stripe[0], page_blob,
+                    retry_policy, hedge_policy, telemetry, source
+                )
+            self.__report(
+                index, stripe[1] - stripe[0], page_blob, retry_policy,
+                hedge_policy, telemetry, source
+            )
+        finally:
+            stream.close()
+            if page_blob:
+                page_blob.close()
+            if rate_limiter:
+                rate_limiter.close()
+
+    def __open_stripe(self, stripe):
+        start, end = stripe
+        if self.xz_streams is not None:
+            return ParallelXZ(
+                self.image, self.xz_streams, self.decompress_threads,
+                start, end
+            )
+        stream = SparseFile.open(self.image)
+        stream.seek(start)
+        return stream
+
+    def __report(
+        self, index, current_bytes, page_blob, retry_policy, hedge_policy,
+        telemetry, source
+    ):
+        offset = self.PROGRESS_FIELDS * index
+        self.progress[offset] = current_bytes
+        self.progress[offset + 1] = page_blob.zero_bytes_skipped
+        self.progress[offset + 2] = retry_policy.retries
+        self.progress[offset + 3] = \
+            hedge_policy.hedged if hedge_policy else 0
+        if hasattr(source, 'decompress_time'):
+            telemetry.update({'decompress': source.decompress_time})
+        stage_seconds = telemetry.stages()
+        for stage_index, stage in enumerate(UploadTelemetry.STAGES):
+            self.progress[offset + 4 + stage_index] = \
+                int(stage_seconds[stage] * 1000)
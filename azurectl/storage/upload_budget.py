@@ -0,0 +1,52 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+
+
+class UploadBudget(object):
+    """
+        Implements a limit on the page writes and the bytes in flight
+        shared by the page blobs of several uploads
+
+        A page write waits until it fits into the budget. A write
+        larger than the byte limit is let through once no other write
+        is in flight, such that it can not wait forever
+    """
+    def __init__(self, max_requests, max_bytes=None):
+        self.max_requests = int(max_requests)
+        self.max_bytes = int(max_bytes) if max_bytes else None
+        self.requests = 0
+        self.bytes = 0
+        self.budget_changed = threading.Condition()
+
+    def acquire(self, length):
+        with self.budget_changed:
+            while not self.__fits(length):
+                self.budget_changed.wait()
+            self.requests += 1
+            self.bytes += length
+
+    def release(self, length):
+        with self.budget_changed:
+            self.requests -= 1
+            self.bytes -= length
+            self.budget_changed.notify_all()
+
+    def __fits(self, length):
+        if self.requests >= self.max_requests:
+            return False
+        if self.max_bytes and self.requests and \
+                self.bytes + length > self.max_bytes:
+            return False
+        return True
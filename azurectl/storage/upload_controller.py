@@ -0,0 +1,115 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+import time
+
+
+class UploadController(object):
+    """
+        Implements AIMD tuning of the chunk size and of the number of
+        page writes in flight of an upload
+
+        Every page write reports its size, latency and failed attempts.
+        After a window of writes the controller looks at the mean write
+        latency and at the throughput while writes were in flight:
+
+        * failed attempts halve the chunk size and the writes in flight
+        * a mean latency beyond TARGET_LATENCY halves the chunk size
+        * a throughput below THROUGHPUT_DROP of the best recent
+          throughput halves the writes in flight
+        * otherwise the chunk size grows by CHUNK_SIZE_STEP up to
+          max_chunk_size, then the writes in flight grow by one up to
+          max_in_flight
+    """
+    # max size of one page write request
+    PAGE_WRITE_SIZE_LIMIT = 4 * 1024 * 1024
+    MIN_CHUNK_SIZE = 512 * 1024
+    CHUNK_SIZE_STEP = 512 * 1024
+    # seconds
+    TARGET_LATENCY = 10
+    THROUGHPUT_DROP = 0.75
+    # the best throughput decays per window to follow a changing link
+    THROUGHPUT_DECAY = 0.9
+    MIN_WINDOW_PAGES = 4
+
+    def __init__(self, max_chunk_size=None, max_in_flight=1):
+        self.max_chunk_size = min(
+            int(max_chunk_size or self.PAGE_WRITE_SIZE_LIMIT),
+            self.PAGE_WRITE_SIZE_LIMIT
+        )
+        self.max_in_flight = max(int(max_in_flight), 1)
+        self.min_chunk_size = min(self.MIN_CHUNK_SIZE, self.max_chunk_size)
+        self.chunk_size = min(2 * self.MIN_CHUNK_SIZE, self.max_chunk_size)
+        self.in_flight = 1
+        self.best_throughput = 0
+        self.active_pages = 0
+        self.busy_since = None
+        self.lock = threading.Lock()
+        self.__reset_window()
+
+    def page_started(self):
+        with self.lock:
+            if not self.active_pages:
+                self.busy_since = time.time()
+            self.active_pages += 1
+
+    def page_done(self, byte_size, latency, failed_attempts=0):
+        """
+            Record a finished page write of byte_size bytes, 0 if the
+            write failed, and adjust the settings at the end of a window
+        """
+        with self.lock:
+            now = time.time()
+            # throughput is measured over the time writes are in flight
+            self.window_busy_time += now - self.busy_since
+            self.busy_since = now
+            self.active_pages -= 1
+            self.window_pages += 1
+            self.window_bytes += byte_size
+            self.window_latency += latency
+            self.window_failed_attempts += failed_attempts
+            if self.window_pages >= max(
+                self.in_flight, self.MIN_WINDOW_PAGES
+            ):
+                self.__adjust()
+                self.__reset_window()
+
+    def __adjust(self):
+        latency = self.window_latency / self.window_pages
+        throughput = 0
+        if self.window_busy_time:
+            throughput = self.window_bytes / self.window_busy_time
+        if self.window_failed_attempts:
+            self.chunk_size = max(self.chunk_size // 2, self.min_chunk_size)
+            self.in_flight = max(self.in_flight // 2, 1)
+        elif latency > self.TARGET_LATENCY:
+            self.chunk_size = max(self.chunk_size // 2, self.min_chunk_size)
+        elif throughput < self.best_throughput * self.THROUGHPUT_DROP:
+            self.in_flight = max(self.in_flight // 2, 1)
+        elif self.chunk_size < self.max_chunk_size:
+            self.chunk_size = min(
+                self.chunk_size + self.CHUNK_SIZE_STEP, self.max_chunk_size
+            )
+        else:
+            self.in_flight = min(self.in_flight + 1, self.max_in_flight)
+        self.best_throughput = max(
+            throughput, self.best_throughput * self.THROUGHPUT_DECAY
+        )
+
+    def __reset_window(self):
+        self.window_pages = 0
+        self.window_bytes = 0
+        self.window_latency = 0
+        self.window_failed_attempts = 0
+        self.window_busy_time = 0
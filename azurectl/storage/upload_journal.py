@@ -0,0 +1,128 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import hashlib
+import json
+import os
+import threading
+
+# project
+from azurectl.defaults import Defaults
+from azurectl.utils.ranges import ByteRanges
+from azurectl.azurectl_exceptions import AzureUploadJournalError
+
+
+class UploadJournal(object):
+    """
+        Checkpoint journal of the page ranges committed to a page blob
+        by an upload. The journal is keyed by the source path, size
+        and mtime and the target blob, such that a changed source
+        never resumes from the journal of a previous version
+
+        The journal file consists of a json header line followed by
+        one 'start end' line per committed [start, end) range. Lines
+        are appended and flushed as pages get committed, a partially
+        written last line is ignored on load
+    """
+    def __init__(
+        self, source, account_name, container, blob_name,
+        journal_dir=None
+    ):
+        source_stat = os.stat(source)
+        self.key = {
+            'source': os.path.abspath(source),
+            'size': source_stat.st_size,
+            'mtime': source_stat.st_mtime,
+            'account': account_name,
+            'container': container,
+            'blob': blob_name
+        }
+        journal_id = hashlib.sha1(
+            json.dumps(self.key, sort_keys=True).encode()
+        ).hexdigest()
+        self.journal_dir = journal_dir or os.path.join(
+            Defaults.cache_directory(), 'upload-journal'
+        )
+        self.filename = os.path.join(self.journal_dir, journal_id)
+        self.lock = threading.Lock()
+        self.journal = None
+        self.ranges = self.__load()
+
+    def reset(self):
+        """
+            Start a new journal, forgetting all committed ranges
+        """
+        self.close()
+        self.ranges = []
+        try:
+            if not os.path.isdir(self.journal_dir):
+                os.makedirs(self.journal_dir)
+            self.journal = open(self.filename, 'w')
+            self.journal.write(json.dumps(self.key, sort_keys=True) + '\n')
+            self.journal.flush()
+        except Exception as e:
+            raise AzureUploadJournalError(
+                '%s: %s' % (type(e).__name__, format(e))
+            )
+
+    def resume(self, ranges):
+        """
+            Continue the journal, keeping only the given ranges
+            which were verified to be committed
+        """
+        self.reset()
+        for start, end in ranges:
+            self.record(start, end)
+
+    def record(self, start, end):
+        """
+            Record the [start, end) range as committed, thread safe
+        """
+        with self.lock:
+            self.ranges.append([start, end])
+            self.journal.write('%d %d\n' % (start, end))
+            self.journal.flush()
+
+    def close(self):
+        with self.lock:
+            if self.journal:
+                self.journal.close()
+                self.journal = None
+
+    def delete(self):
+        """
+            Remove the journal once the upload has completed
+        """
+        self.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def __load(self):
+        ranges = []
+        if not os.path.exists(self.filename):
+            return ranges
+        with open(self.filename) as journal:
+            try:
+                if json.loads(journal.readline()) != self.key:
+                    return ranges
+            except ValueError:
+                return ranges
+            for line in journal:
+                if not line.endswith('\n'):
+                    break
+                try:
+                    start, end = [int(value) for value in line.split()]
+                except ValueError:
+                    break
+                ranges.append([start, end])
+        return ByteRanges.merge(ranges)
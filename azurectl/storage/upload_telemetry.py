@@ -0,0 +1,74 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+import time
+
+
+class UploadTelemetry(object):
+    """
+        Implements the accounting of the time an upload spends in
+        its stages
+
+        * read: waiting for the next chunk of image data
+        * decompress: decompressing the image, summed over the
+          decompression threads
+        * zero_check: looking for zero pages and changed blocks
+        * network: writing pages, summed over the page writes in
+          flight and including the delay between retries
+
+        Stages running in other threads overlap, the stage with the
+        largest share of the elapsed time is the bottleneck
+    """
+    STAGES = ('read', 'decompress', 'zero_check', 'network')
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.stage_seconds = dict.fromkeys(self.STAGES, 0.0)
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.stage_seconds[stage] += seconds
+
+    def update(self, stage_seconds):
+        """
+            Replace the time of the given stages, for stage times
+            accounted elsewhere
+        """
+        with self.lock:
+            self.stage_seconds.update(stage_seconds)
+
+    def stages(self):
+        with self.lock:
+            return dict(self.stage_seconds)
+
+    def summary(self, current_bytes, total_bytes):
+        """
+            Elapsed time, throughput in MB/s, the estimated time to
+            finish the upload and the stage times
+        """
+        elapsed = time.time() - self.start_time
+        throughput = current_bytes / elapsed if elapsed > 0 else 0
+        eta = None
+        if throughput:
+            eta = round((total_bytes - current_bytes) / throughput, 1)
+        return {
+            'elapsed_seconds': round(elapsed, 1),
+            'mb_per_second': round(throughput / 1048576, 2),
+            'eta_seconds': eta,
+            'stage_seconds': {
+                stage: round(seconds, 3)
+                for stage, seconds in self.stages().items()
+            }
+        }
@@ -0,0 +1,384 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import bz2
+import os
+import struct
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# project
+from azurectl.azurectl_exceptions import AzureCodecNotAvailable
+from azurectl.utils.datastream import DataStream
+from azurectl.utils.filetype import FileType
+from azurectl.utils.qcow2 import QCow2
+from azurectl.utils.vhd import DynamicVHD
+from azurectl.utils.xz import XZ
+
+
+class StreamDecompressor(DataStream):
+    """
+        Implements streaming decompression of a compressed file which
+        consists of one or more concatenated members
+
+        The members are decompressed by decompressor objects providing
+        decompress with a max_length, eof and unused_data. The output
+        of every call is bounded by OUTPUT_SIZE, such that a chunk of
+        highly compressed zero pages does not expand in one piece
+    """
+    BUFFER_SIZE = 64 * 1024
+    OUTPUT_SIZE = 4 * 1024 * 1024
+
+    def __init__(
+        self, compressed_stream, decompressor_class, buffer_size=BUFFER_SIZE
+    ):
+        self.compressed_stream = compressed_stream
+        self.decompressor_class = decompressor_class
+        self.decompressor = decompressor_class()
+        self.buffer_size = int(buffer_size)
+        self.buffered_bytes = memoryview(b'')
+        # seconds spent decompressing
+        self.decompress_time = 0
+
+    def readinto(self, buffer):
+        """
+            Decompress into the given writable buffer until it is full
+            or the end of the file is reached. Returns the number of
+            bytes written to the buffer, 0 at the end of the file
+        """
+        view = memoryview(buffer).cast('B')
+        size = len(view)
+        bytes_uncompressed = 0
+        while bytes_uncompressed < size:
+            if not self.buffered_bytes:
+                uncompressed = self.__decompress()
+                if uncompressed is None:
+                    break
+                self.buffered_bytes = memoryview(uncompressed)
+            count = min(size - bytes_uncompressed, len(self.buffered_bytes))
+            view[bytes_uncompressed:bytes_uncompressed + count] = \
+                self.buffered_bytes[:count]
+            self.buffered_bytes = self.buffered_bytes[count:]
+            bytes_uncompressed += count
+        return bytes_uncompressed
+
+    def close(self):
+        self.compressed_stream.close()
+
+    def __decompress(self):
+        while True:
+            if self.decompressor.eof:
+                compressed = self.__next_member()
+                if compressed is None:
+                    return None
+            elif self.decompressor.needs_input:
+                compressed = self.compressed_stream.read(self.buffer_size)
+                if not compressed:
+                    raise EOFError(
+                        'Compressed file ended before the '
+                        'end-of-stream marker was reached'
+                    )
+            else:
+                compressed = b''
+            start_time = time.time()
+            uncompressed = self.decompressor.decompress(
+                compressed, self.OUTPUT_SIZE
+            )
+            self.decompress_time += time.time() - start_time
+            if uncompressed:
+                return uncompressed
+
+    def __next_member(self):
+        # concatenated members start right after the previous one
+        unused_data = self.decompressor.unused_data
+        while not unused_data:
+            unused_data = self.compressed_stream.read(self.buffer_size)
+            if not unused_data:
+                return None
+        self.decompressor = self.decompressor_class()
+        return unused_data
+
+
+class GZipDecompressor(object):
+    """
+        Decompressor of one gzip member, with the interface of the
+        bz2 decompressor
+    """
+    def __init__(self):
+        self.zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.needs_input = True
+
+    @property
+    def eof(self):
+        return self.zlib.eof
+
+    @property
+    def unused_data(self):
+        return self.zlib.unused_data
+
+    def decompress(self, data, max_length):
+        uncompressed = self.zlib.decompress(
+            self.zlib.unconsumed_tail + data, max_length
+        )
+        # a full output buffer can leave output pending in zlib
+        self.needs_input = not self.zlib.unconsumed_tail and \
+            len(uncompressed) < max_length
+        return uncompressed
+
+
+class GZip(object):
+    """
+        Implements decompression of gzip compressed files
+
+        The size field of the gzip trailer holds the size of the last
+        member modulo 4GB only, thus the uncompressed size of a disk
+        image is not known without decompressing it
+    """
+    @classmethod
+    def open(self, file_name, threads=1):
+        return StreamDecompressor(open(file_name, 'rb'), GZipDecompressor)
+
+    @classmethod
+    def uncompressed_size(self, file_name):
+        return None
+
+
+class BZip2(object):
+    """
+        Implements decompression of bzip2 compressed files, including
+        the multi stream files written by parallel bzip2 compressors.
+        bzip2 does not record the uncompressed size
+    """
+    @classmethod
+    def open(self, file_name, threads=1):
+        return StreamDecompressor(
+            open(file_name, 'rb'), bz2.BZ2Decompressor
+        )
+
+    @classmethod
+    def uncompressed_size(self, file_name):
+        return None
+
+
+class ZStdReader(DataStream):
+    """
+        Implements reading of the decompressed frames of a zstd file
+        through a zstandard stream reader
+    """
+    def __init__(self, zstd_file):
+        self.zstd_file = zstd_file
+        self.reader = zstandard.ZstdDecompressor().stream_reader(
+            zstd_file, read_across_frames=True
+        )
+        # seconds spent reading and decompressing
+        self.decompress_time = 0
+
+    def readinto(self, buffer):
+        """
+            Decompress into the given writable buffer until it is full
+            or the end of the file is reached. Returns the number of
+            bytes written to the buffer, 0 at the end of the file
+        """
+        view = memoryview(buffer).cast('B')
+        bytes_uncompressed = 0
+        start_time = time.time()
+        while bytes_uncompressed < len(view):
+            count = self.reader.readinto(view[bytes_uncompressed:])
+            if not count:
+                break
+            bytes_uncompressed += count
+        self.decompress_time += time.time() - start_time
+        return bytes_uncompressed
+
+    def close(self):
+        self.reader.close()
+        self.zstd_file.close()
+
+
+class ZStd(object):
+    """
+        Implements decompression of zstd compressed files
+
+        The uncompressed size is taken from the seek table of files in
+        the seekable zstd format, otherwise from the content size in
+        the header of every frame. The frames are walked along their
+        block headers, no decompression is needed. Decompression
+        requires the zstandard python module
+    """
+    FRAME_MAGIC = 0xFD2FB528
+    SKIPPABLE_FRAME_MAGIC = 0x184D2A50
+    SKIPPABLE_FRAME_MASK = 0xFFFFFFF0
+    SEEK_TABLE_FRAME_MAGIC = 0x184D2A5E
+    SEEK_TABLE_FOOTER_MAGIC = 0x8F92EAB1
+    SEEK_TABLE_FOOTER_SIZE = 9
+    BLOCK_TYPE_RLE = 1
+    BLOCK_TYPE_RESERVED = 3
+
+    @classmethod
+    def open(self, file_name, threads=1):
+        if not zstandard:
+            raise AzureCodecNotAvailable(
+                'zstd decompression requires the zstandard python module'
+            )
+        return ZStdReader(open(file_name, 'rb'))
+
+    @classmethod
+    def uncompressed_size(self, file_name):
+        """
+            Uncompressed size from the seek table or the frame headers,
+            None if a frame does not record its content size
+        """
+        with open(file_name, 'rb') as zstd_file:
+            zstd_file.seek(0, os.SEEK_END)
+            file_size = zstd_file.tell()
+            seek_table_size = self.__seek_table_size(zstd_file, file_size)
+            if seek_table_size is not None:
+                return seek_table_size
+            return self.__frames_size(zstd_file, file_size)
+
+    @classmethod
+    def __seek_table_size(self, zstd_file, file_size):
+        if file_size < self.SEEK_TABLE_FOOTER_SIZE + 8:
+            return None
+        zstd_file.seek(file_size - self.SEEK_TABLE_FOOTER_SIZE)
+        frames, descriptor, magic = struct.unpack(
+            '<IBI', zstd_file.read(self.SEEK_TABLE_FOOTER_SIZE)
+        )
+        if magic != self.SEEK_TABLE_FOOTER_MAGIC:
+            return None
+        # entries of compressed size, decompressed size and optionally
+        # a checksum
+        entry_size = 12 if descriptor & 0x80 else 8
+        table_size = frames * entry_size + self.SEEK_TABLE_FOOTER_SIZE
+        table_offset = file_size - table_size
+        if table_offset < 8:
+            return None
+        zstd_file.seek(table_offset - 8)
+        frame_magic, frame_size = struct.unpack('<II', zstd_file.read(8))
+        if frame_magic != self.SEEK_TABLE_FRAME_MAGIC or \
+                frame_size != table_size:
+            return None
+        table = zstd_file.read(frames * entry_size)
+        return sum(
+            struct.unpack_from('<I', table, offset + 4)[0]
+            for offset in range(0, len(table), entry_size)
+        )
+
+    @classmethod
+    def __frames_size(self, zstd_file, file_size):
+        uncompressed_size = 0
+        position = 0
+        while position < file_size:
+            zstd_file.seek(position)
+            header = zstd_file.read(18)
+            if len(header) < 8:
+                return None
+            magic = struct.unpack_from('<I', header)[0]
+            if magic & self.SKIPPABLE_FRAME_MASK == \
+                    self.SKIPPABLE_FRAME_MAGIC:
+                position += 8 + struct.unpack_from('<I', header, 4)[0]
+                continue
+            if magic != self.FRAME_MAGIC:
+                return None
+            content_size, header_size, checksum = \
+                self.__parse_frame_header(header)
+            if content_size is None:
+                return None
+            uncompressed_size += content_size
+            position = self.__skip_blocks(
+                zstd_file, position + 4 + header_size
+            )
+            if position is None:
+                return None
+            position += checksum
+        return uncompressed_size
+
+    @classmethod
+    def __parse_frame_header(self, header):
+        descriptor = header[4]
+        content_size_flag = descriptor >> 6
+        single_segment = descriptor & 0x20
+        checksum = 4 if descriptor & 0x04 else 0
+        dictionary_id_size = (0, 1, 2, 4)[descriptor & 0x03]
+        content_size_size = (
+            1 if single_segment else 0, 2, 4, 8
+        )[content_size_flag]
+        offset = 5 + (0 if single_segment else 1) + dictionary_id_size
+        header_size = offset - 4 + content_size_size
+        if not content_size_size:
+            return None, header_size, checksum
+        content_size = int.from_bytes(
+            header[offset:offset + content_size_size], 'little'
+        )
+        if content_size_size == 2:
+            content_size += 256
+        return content_size, header_size, checksum
+
+    @classmethod
+    def __skip_blocks(self, zstd_file, position):
+        while True:
+            zstd_file.seek(position)
+            block_header = zstd_file.read(3)
+            if len(block_header) < 3:
+                return None
+            block_header = int.from_bytes(block_header, 'little')
+            block_type = (block_header >> 1) & 0x03
+            if block_type == self.BLOCK_TYPE_RESERVED:
+                return None
+            position += 3 + (
+                1 if block_type == self.BLOCK_TYPE_RLE else block_header >> 3
+            )
+            if block_header & 0x01:
+                return position
+
+
+class Codec(object):
+    """
+        Registry of the streaming codecs by file format, which
+        present the disk image held by a compressed file or by an
+        image format other than raw
+
+        A codec provides open(file_name, threads), which returns a
+        stream with read, readinto and close, and uncompressed_size
+        (file_name), which returns None if the uncompressed size is
+        not known without decompressing the file
+    """
+    codecs = {
+        FileType.XZ: XZ,
+        FileType.GZIP: GZip,
+        FileType.ZSTD: ZStd,
+        FileType.BZIP2: BZip2,
+        FileType.QCOW2: QCow2,
+        FileType.VHD_DYNAMIC: DynamicVHD
+    }
+
+    @classmethod
+    def register(self, file_format, codec):
+        self.codecs[file_format] = codec
+
+    @classmethod
+    def supports(self, file_format):
+        return file_format in self.codecs
+
+    @classmethod
+    def open(self, file_format, file_name, threads=1):
+        return self.codecs[file_format].open(file_name, threads=threads)
+
+    @classmethod
+    def uncompressed_size(self, file_format, file_name):
+        return self.codecs[file_format].uncompressed_size(file_name)
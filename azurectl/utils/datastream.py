@@ -0,0 +1,92 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# project
+from azurectl.azurectl_exceptions import AzureStorageStreamError
+
+
+class DataStream(object):
+    """
+        Base class of the data streams an image is uploaded from
+
+        Subclasses implement readinto and close. readinto returns 0
+        and read returns None at the end of the stream
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def read(self, size):
+        buffer = bytearray(size)
+        size = self.readinto(buffer)
+        if not size:
+            return None
+        return bytes(memoryview(buffer)[:size])
+
+
+class SequentialStream(DataStream):
+    """
+        Implements forward positioning in a data stream read sequentially
+
+        Data streams providing seek are moved forward directly, other
+        data streams are read up to the given offset. Reads fill the
+        buffer, a data stream ending before raises EOFError
+    """
+    SKIP_BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, data_stream):
+        self.data_stream = data_stream
+        self.position = 0
+
+    @property
+    def decompress_time(self):
+        return getattr(self.data_stream, 'decompress_time', 0)
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        size = 0
+        while size < len(view):
+            count = self.data_stream.readinto(view[size:])
+            if not count:
+                raise EOFError(
+                    'Data stream ended at offset %d' % (self.position + size)
+                )
+            size += count
+        self.position += size
+        return size
+
+    def seek(self, offset):
+        if offset < self.position:
+            raise AzureStorageStreamError(
+                'Data stream can not be read backwards from offset %d '
+                'to %d' % (self.position, offset)
+            )
+        if offset == self.position:
+            return self.position
+        if hasattr(self.data_stream, 'seek'):
+            self.data_stream.seek(offset)
+            self.position = offset
+            return self.position
+        skip_buffer = bytearray(
+            min(self.SKIP_BUFFER_SIZE, offset - self.position)
+        )
+        while self.position < offset:
+            self.readinto(
+                memoryview(skip_buffer)[:offset - self.position]
+            )
+        return self.position
+
+    def close(self):
+        self.data_stream.close()
@@ -0,0 +1,40 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# project
+from azurectl.utils.datastream import SequentialStream
+from azurectl.utils.mappedimage import (
+    ImageMap,
+    MappedImage
+)
+
+
+class ExtentStream(MappedImage):
+    """
+        Implements reading of a data stream along known data extents
+
+        The extents are the [start, end) byte ranges of the data
+        stream which hold data, everything else is known to be zero.
+        Like the holes of a sparse file, the zero ranges are skipped
+        by seek_data. Data streams providing seek are moved to the
+        next extent directly, other data streams are read up to it
+    """
+    def __init__(self, data_stream, extents, byte_size):
+        image_map = ImageMap()
+        for extent_start, extent_end in extents:
+            image_map.add(
+                extent_start, extent_end - extent_start, extent_start
+            )
+        super(ExtentStream, self).__init__(
+            SequentialStream(data_stream), byte_size, image_map
+        )
@@ -13,30 +13,99 @@
 #
 import os
 import re
-import subprocess
 
 
 class FileType(object):
     """
         map file magic information to type methods
+
+        The format is detected from the magic bytes at the start of
+        the file. Dynamic VHDs start with a copy of their footer,
+        fixed VHDs are detected from the cookie of the footer at the
+        end of the file, which they only have there. Files without a
+        known magic are raw
     """
+    XZ = 'xz'
+    GZIP = 'gzip'
+    ZSTD = 'zstd'
+    BZIP2 = 'bzip2'
+    QCOW2 = 'qcow2'
+    VHD = 'vhd'
+    VHD_DYNAMIC = 'vhd-dynamic'
+    RAW = 'raw'
+
+    COMPRESSED = (XZ, GZIP, ZSTD, BZIP2)
+
+    MAGIC_SIZE = 64
+    VHD_COOKIE = b'conectix'
+    VHD_DISK_TYPE_OFFSET = 60
+    VHD_FOOTER_SIZE = 512
+
+    # file name suffixes of the compressed formats, tar archive
+    # suffixes of the formats are replaced by .tar
+    SUFFIXES = {
+        XZ: ('xz|lzma', 'tgz|tlz'),
+        GZIP: ('gz', 'tgz'),
+        ZSTD: ('zst|zstd', 'tzst'),
+        BZIP2: ('bz2|bz', 'tbz2|tbz')
+    }
+
     def __init__(self, file_name):
         self.file_name = file_name
-        file_info = subprocess.Popen(
-            ['file', file_name],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        self.filetype = file_info.communicate()[0].decode()
+        self.format = self.__detect()
 
     def is_xz(self):
-        if re.match('.*: XZ compressed', self.filetype):
-            return True
-        return False
+        return self.format == self.XZ
+
+    def is_compressed(self):
+        return self.format in self.COMPRESSED
 
     def basename(self):
         name = os.path.basename(self.file_name)
-        if self.is_xz():
-            name = re.sub('\.(xz|lzma)$', '', name)
-            name = re.sub('\.(tgz|tlz)$', '.tar', name)
+        if self.is_compressed():
+            suffixes, tar_suffixes = self.SUFFIXES[self.format]
+            name = re.sub('\.(%s)$' % suffixes, '', name)
+            name = re.sub('\.(%s)$' % tar_suffixes, '.tar', name)
         return name
+
+    def __detect(self):
+        try:
+            with open(self.file_name, 'rb') as image:
+                magic = image.read(self.MAGIC_SIZE)
+                if magic.startswith(b'\xfd7zXZ\x00'):
+                    return self.XZ
+                if magic.startswith(b'\x1f\x8b'):
+                    return self.GZIP
+                if magic.startswith(b'\x28\xb5\x2f\xfd') or \
+                        self.__zstd_skippable_frame(magic):
+                    return self.ZSTD
+                if re.match(b'BZh[1-9]', magic):
+                    return self.BZIP2
+                if magic.startswith(b'QFI\xfb'):
+                    return self.QCOW2
+                if self.__vhd_dynamic(magic):
+                    return self.VHD_DYNAMIC
+                if magic.startswith(self.VHD_COOKIE) or \
+                        self.__vhd_footer(image):
+                    return self.VHD
+        except (IOError, OSError):
+            pass
+        return self.RAW
+
+    def __zstd_skippable_frame(self, magic):
+        # skippable frames have the magic numbers 0x184D2A50-0x184D2A5F
+        return magic[1:4] == b'\x2a\x4d\x18' and magic[0:1] >= b'\x50' and \
+            magic[0:1] <= b'\x5f'
+
+    def __vhd_dynamic(self, magic):
+        # dynamic and differencing disks, disk type 3 and 4
+        return magic.startswith(self.VHD_COOKIE) and magic[
+            self.VHD_DISK_TYPE_OFFSET:self.VHD_DISK_TYPE_OFFSET + 4
+        ] in (b'\x00\x00\x00\x03', b'\x00\x00\x00\x04')
+
+    def __vhd_footer(self, image):
+        image.seek(0, os.SEEK_END)
+        if image.tell() < self.VHD_FOOTER_SIZE:
+            return False
+        image.seek(-self.VHD_FOOTER_SIZE, os.SEEK_END)
+        return image.read(len(self.VHD_COOKIE)) == self.VHD_COOKIE
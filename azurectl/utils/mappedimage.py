@@ -0,0 +1,205 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import time
+from array import array
+from bisect import bisect_right
+
+# project
+from azurectl.utils.datastream import DataStream
+
+
+class ImageMap(object):
+    """
+        Map of the allocated guest ranges of a disk image to the
+        ranges of the image file which hold their data
+
+        Ranges are added in ascending guest order. A range continuing
+        the previous one in the guest and in the image file is merged
+        into it, compressed ranges are kept one per cluster. The map
+        is held in arrays, which keeps the map of large images small
+    """
+    def __init__(self):
+        self.guest_offsets = array('Q')
+        self.lengths = array('Q')
+        self.file_offsets = array('Q')
+        self.compressed_sizes = array('Q')
+
+    def __len__(self):
+        return len(self.guest_offsets)
+
+    def add(self, guest_offset, length, file_offset, compressed_size=0):
+        if not compressed_size and self.guest_offsets and \
+                not self.compressed_sizes[-1] and \
+                self.guest_end(-1) == guest_offset and \
+                self.file_offsets[-1] + self.lengths[-1] == file_offset:
+            self.lengths[-1] += length
+            return
+        self.guest_offsets.append(guest_offset)
+        self.lengths.append(length)
+        self.file_offsets.append(file_offset)
+        self.compressed_sizes.append(compressed_size)
+
+    def guest_end(self, index):
+        return self.guest_offsets[index] + self.lengths[index]
+
+    def find(self, guest_offset):
+        """
+            Index of the range holding the guest offset, or of the
+            first range after it
+        """
+        index = bisect_right(self.guest_offsets, guest_offset) - 1
+        if index < 0 or self.guest_end(index) <= guest_offset:
+            index += 1
+        return index
+
+
+class MappedImage(DataStream):
+    """
+        Implements reading of the guest data of a disk image along
+        the allocation map of its image format
+
+        Unallocated ranges read as zeros, like the holes of a sparse
+        file they are skipped by seek_data without reading them. The
+        guest data is followed by the given footer. Compressed ranges
+        are decompressed by the given decompress function, which is
+        called with the compressed data and the length of the range.
+        The image file is positioned by seek before every read of a
+        range
+    """
+    PAGE_SIZE = 512
+
+    def __init__(
+        self, image_file, virtual_size, image_map, footer=b'',
+        decompress=None
+    ):
+        self.image_file = image_file
+        self.virtual_size = virtual_size
+        self.image_map = image_map
+        self.footer = footer
+        self.decompress = decompress
+        self.byte_size = virtual_size + len(footer)
+        self.position = 0
+        self.data_end = None
+        self.cluster_index = None
+        self.cluster = b''
+        # seconds spent decompressing clusters
+        self.cluster_decompress_time = 0
+
+    @property
+    def decompress_time(self):
+        """
+            Seconds spent decompressing, the decompression of the
+            image file included
+        """
+        return self.cluster_decompress_time + getattr(
+            self.image_file, 'decompress_time', 0
+        )
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        data_end = self.byte_size
+        if self.data_end is not None:
+            data_end = min(self.data_end, data_end)
+        view = view[:max(data_end - self.position, 0)]
+        size = 0
+        while size < len(view):
+            size += self.__read(view[size:])
+        return size
+
+    def seek(self, offset):
+        self.position = offset
+        self.data_end = None
+        return self.position
+
+    def seek_data(self, alignment=PAGE_SIZE):
+        """
+            Move to the start of the next allocated range and return
+            its offset. Range boundaries are widened to the given
+            alignment
+        """
+        if self.data_end is not None and self.position < self.data_end:
+            return self.position
+        image_map = self.image_map
+        index = image_map.find(self.position)
+        if index < len(image_map):
+            data_start = image_map.guest_offsets[index]
+            data_end = image_map.guest_end(index)
+            index += 1
+            while index < len(image_map) and \
+                    image_map.guest_offsets[index] == data_end:
+                data_end = image_map.guest_end(index)
+                index += 1
+        else:
+            data_start = data_end = self.virtual_size
+        if data_end >= self.virtual_size:
+            # the footer continues the last range
+            data_end = self.byte_size
+        self.data_end = min(
+            data_end + (-data_end % alignment), self.byte_size
+        )
+        self.position = max(
+            data_start - data_start % alignment, self.position
+        )
+        return self.position
+
+    def close(self):
+        self.image_file.close()
+
+    def __read(self, view):
+        if self.position >= self.virtual_size:
+            offset = self.position - self.virtual_size
+            count = min(len(view), len(self.footer) - offset)
+            view[:count] = self.footer[offset:offset + count]
+        else:
+            image_map = self.image_map
+            index = image_map.find(self.position)
+            if index < len(image_map) and \
+                    image_map.guest_offsets[index] <= self.position:
+                count = self.__read_range(index, view)
+            else:
+                range_end = self.virtual_size
+                if index < len(image_map):
+                    range_end = min(image_map.guest_offsets[index], range_end)
+                count = min(len(view), range_end - self.position)
+                view[:count] = bytes(count)
+        self.position += count
+        return count
+
+    def __read_range(self, index, view):
+        image_map = self.image_map
+        offset = self.position - image_map.guest_offsets[index]
+        count = min(len(view), image_map.lengths[index] - offset)
+        if image_map.compressed_sizes[index]:
+            view[:count] = self.__cluster(index)[offset:offset + count]
+        else:
+            self.image_file.seek(image_map.file_offsets[index] + offset)
+            size = self.image_file.readinto(view[:count])
+            # data beyond the end of the image file reads as zeros
+            view[size:count] = bytes(count - size)
+        return count
+
+    def __cluster(self, index):
+        if self.cluster_index != index:
+            image_map = self.image_map
+            self.image_file.seek(image_map.file_offsets[index])
+            compressed = self.image_file.read(
+                image_map.compressed_sizes[index]
+            )
+            start_time = time.time()
+            self.cluster = memoryview(self.decompress(
+                compressed, image_map.lengths[index]
+            ))
+            self.cluster_decompress_time += time.time() - start_time
+            self.cluster_index = index
+        return self.cluster
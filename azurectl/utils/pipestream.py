@@ -0,0 +1,74 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import io
+import sys
+
+# project
+from azurectl.utils.datastream import DataStream
+from azurectl.azurectl_exceptions import AzureStorageStreamError
+
+
+class PipeStream(DataStream):
+    """
+        Implements reading of an image of a declared size from a pipe
+
+        Reads from a pipe return the data available, often much less
+        than requested. The stream fills every read up to the size
+        requested, such that the upload writes chunks of the chunk
+        size. An image ending before the declared size, or going on
+        beyond it, fails the read instead of uploading a truncated
+        image
+    """
+    def __init__(self, data_stream, byte_size):
+        self.data_stream = data_stream
+        self.byte_size = byte_size
+        self.position = 0
+
+    @classmethod
+    def open(self, byte_size):
+        """
+            Stream of the image read from stdin, closing the stream
+            leaves stdin open
+        """
+        return PipeStream(
+            io.open(sys.stdin.fileno(), 'rb', buffering=0, closefd=False),
+            byte_size
+        )
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        view = view[:self.byte_size - self.position]
+        size = 0
+        while size < len(view):
+            count = self.data_stream.readinto(view[size:])
+            if not count:
+                raise EOFError(
+                    'Image ended after %d of %d bytes' %
+                    (self.position + size, self.byte_size)
+                )
+            size += count
+        self.position += size
+        if size and self.position == self.byte_size:
+            self.__check_end()
+        return size
+
+    def close(self):
+        self.data_stream.close()
+
+    def __check_end(self):
+        if self.data_stream.read(1):
+            raise AzureStorageStreamError(
+                'Image exceeds the declared size of %d bytes' %
+                self.byte_size
+            )
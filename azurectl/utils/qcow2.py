@@ -0,0 +1,187 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import struct
+import sys
+import zlib
+from array import array
+
+# project
+from azurectl.azurectl_exceptions import AzureQCow2FormatError
+from azurectl.utils.mappedimage import (
+    ImageMap,
+    MappedImage
+)
+from azurectl.utils.vhd import VHDFooter
+
+
+class QCow2(object):
+    """
+        Implements reading of qcow2 images
+
+        The guest data is located through the L1 and L2 tables of the
+        image, unallocated and zero clusters read as zeros without
+        reading the image file. Compressed clusters are deflate
+        compressed and decompressed one at a time. The stream presents
+        the guest data followed by a fixed VHD footer. Images with a
+        backing file, encryption or an incompatible feature other than
+        the dirty bit are not supported
+    """
+    MAGIC = b'QFI\xfb'
+    HEADER_SIZE = 80
+    OFFSET_MASK = 0x00fffffffffffe00
+    COMPRESSED = 1 << 62
+    ZERO = 1
+    INCOMPATIBLE_DIRTY = 1
+    COMPRESSED_WINDOW_BITS = -12
+
+    @classmethod
+    def open(self, file_name, threads=1):
+        image_file = open(file_name, 'rb')
+        try:
+            header = self.__read_header(image_file)
+            image_map = self.__read_map(image_file, header)
+        except Exception:
+            image_file.close()
+            raise
+        virtual_size = VHDFooter.aligned_size(header['size'])
+        return MappedImage(
+            image_file, virtual_size, image_map,
+            VHDFooter.fixed(virtual_size), self.__decompress
+        )
+
+    @classmethod
+    def uncompressed_size(self, file_name):
+        """
+            Size of the fixed VHD image streamed from the image
+        """
+        with open(file_name, 'rb') as image_file:
+            header = self.__read_header(image_file)
+        return VHDFooter.aligned_size(header['size']) + VHDFooter.FOOTER_SIZE
+
+    @classmethod
+    def __read_header(self, image_file):
+        data = image_file.read(self.HEADER_SIZE)
+        if len(data) < 72 or not data.startswith(self.MAGIC):
+            raise AzureQCow2FormatError('No qcow2 header at start of image')
+        (
+            version, backing_file_offset, cluster_bits, size, crypt_method,
+            l1_size, l1_table_offset
+        ) = struct.unpack_from('>IQ4xIQIIQ', data, 4)
+        if version not in (2, 3):
+            raise AzureQCow2FormatError(
+                'qcow2 version %d is not supported' % version
+            )
+        if backing_file_offset:
+            raise AzureQCow2FormatError(
+                'qcow2 images with a backing file are not supported'
+            )
+        if crypt_method:
+            raise AzureQCow2FormatError(
+                'Encrypted qcow2 images are not supported'
+            )
+        if cluster_bits < 9 or cluster_bits > 21:
+            raise AzureQCow2FormatError(
+                'Invalid qcow2 cluster bits %d' % cluster_bits
+            )
+        if version == 3:
+            if len(data) < self.HEADER_SIZE:
+                raise AzureQCow2FormatError('Truncated qcow2 v3 header')
+            incompatible_features, = struct.unpack_from('>Q', data, 72)
+            if incompatible_features & ~self.INCOMPATIBLE_DIRTY:
+                raise AzureQCow2FormatError(
+                    'qcow2 incompatible features 0x%x are not supported' %
+                    incompatible_features
+                )
+        return {
+            'version': version,
+            'cluster_bits': cluster_bits,
+            'size': size,
+            'l1_size': l1_size,
+            'l1_table_offset': l1_table_offset
+        }
+
+    @classmethod
+    def __read_map(self, image_file, header):
+        cluster_bits = header['cluster_bits']
+        cluster_size = 1 << cluster_bits
+        size = header['size']
+        l2_entries = cluster_size // 8
+        # compressed cluster descriptors hold the host offset in the
+        # low bits and the number of additional sectors above
+        compressed_shift = 62 - (cluster_bits - 8)
+        compressed_offset_mask = (1 << compressed_shift) - 1
+        compressed_sectors_mask = (1 << (cluster_bits - 8)) - 1
+        image_map = ImageMap()
+        l1_table = self.__read_table(
+            image_file, header['l1_table_offset'], header['l1_size']
+        )
+        for l1_index, l1_entry in enumerate(l1_table):
+            l2_guest_offset = l1_index * l2_entries * cluster_size
+            if l2_guest_offset >= size:
+                break
+            l2_offset = l1_entry & self.OFFSET_MASK
+            if not l2_offset:
+                continue
+            l2_table = self.__read_table(image_file, l2_offset, l2_entries)
+            for l2_index, l2_entry in enumerate(l2_table):
+                guest_offset = l2_guest_offset + l2_index * cluster_size
+                if guest_offset >= size:
+                    break
+                length = min(cluster_size, size - guest_offset)
+                if l2_entry & self.COMPRESSED:
+                    offset = l2_entry & compressed_offset_mask
+                    sectors = \
+                        (l2_entry >> compressed_shift) & compressed_sectors_mask
+                    image_map.add(
+                        guest_offset, length, offset,
+                        (sectors + 1) * 512 - (offset & 511)
+                    )
+                    continue
+                if header['version'] == 3 and l2_entry & self.ZERO:
+                    continue
+                offset = l2_entry & self.OFFSET_MASK
+                if offset:
+                    image_map.add(guest_offset, length, offset)
+        return image_map
+
+    @classmethod
+    def __read_table(self, image_file, offset, entries):
+        image_file.seek(offset)
+        data = image_file.read(entries * 8)
+        if len(data) < entries * 8:
+            raise AzureQCow2FormatError(
+                'qcow2 table at offset %d exceeds the image' % offset
+            )
+        table = array('Q')
+        table.frombytes(data)
+        if sys.byteorder == 'little':
+            table.byteswap()
+        return table
+
+    @classmethod
+    def __decompress(self, compressed, length):
+        try:
+            data = zlib.decompressobj(self.COMPRESSED_WINDOW_BITS).decompress(
+                compressed, length
+            )
+        except zlib.error as e:
+            raise AzureQCow2FormatError(
+                'Compressed qcow2 cluster: %s' % format(e)
+            )
+        if len(data) < length:
+            raise AzureQCow2FormatError(
+                'Compressed qcow2 cluster holds %d of %d bytes' %
+                (len(data), length)
+            )
+        return data
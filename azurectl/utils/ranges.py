@@ -0,0 +1,77 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+class ByteRanges(object):
+    """
+        Operations on lists of [start, end) byte ranges
+    """
+    @classmethod
+    def merge(self, ranges):
+        """
+            Sort ranges and merge overlapping and adjacent ones
+        """
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+    @classmethod
+    def intersect(self, ranges, other_ranges):
+        """
+            Ranges covered by both merged range lists
+        """
+        result = []
+        index = 0
+        for start, end in ranges:
+            while index < len(other_ranges) and \
+                    other_ranges[index][1] <= start:
+                index += 1
+            other_index = index
+            while other_index < len(other_ranges) and \
+                    other_ranges[other_index][0] < end:
+                other_start, other_end = other_ranges[other_index]
+                result.append([max(start, other_start), min(end, other_end)])
+                other_index += 1
+        return result
+
+    @classmethod
+    def subtract(self, ranges, other_ranges):
+        """
+            Parts of the merged ranges not covered by other_ranges
+        """
+        result = []
+        index = 0
+        for start, end in ranges:
+            while index < len(other_ranges) and \
+                    other_ranges[index][1] <= start:
+                index += 1
+            other_index = index
+            while start < end and other_index < len(other_ranges) and \
+                    other_ranges[other_index][0] < end:
+                other_start, other_end = other_ranges[other_index]
+                if other_start > start:
+                    result.append([start, other_start])
+                start = max(start, other_end)
+                other_index += 1
+            if start < end:
+                result.append([start, end])
+        return result
+
+    @classmethod
+    def size(self, ranges):
+        return sum(end - start for start, end in ranges)
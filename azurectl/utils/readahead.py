@@ -0,0 +1,132 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import queue
+import threading
+
+# project
+from azurectl.utils.datastream import DataStream
+
+
+class ReadAhead(DataStream):
+    """
+        Implements read ahead of a data stream in a background thread
+
+        The data stream is read in chunks of chunk_size bytes, which
+        are queued up to max_size bytes. Reading and decompressing the
+        next chunks thus overlaps with the upload of the current one,
+        while a full queue blocks the reader. Data streams providing
+        seek_data are read along their data extents, the offset of
+        every chunk is queued with it. Other data streams are expected
+        to be positioned at the given offset
+    """
+    PAGE_SIZE = 512
+
+    def __init__(
+        self, data_stream, chunk_size, max_size, alignment=PAGE_SIZE,
+        offset=0
+    ):
+        self.data_stream = data_stream
+        self.chunk_size = int(chunk_size)
+        self.alignment = alignment
+        self.chunks = queue.Queue(
+            maxsize=max(int(max_size) // self.chunk_size, 1)
+        )
+        self.chunk = b''
+        self.chunk_offset = 0
+        self.position = offset
+        self.eof = False
+        self.stopped = threading.Event()
+        self.reader = threading.Thread(target=self.__read_ahead)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def read(self, size):
+        """
+            Return up to size bytes of the current chunk, None at the
+            end of the stream. Chunks read ahead as a whole are returned
+            as they are, without a copy
+        """
+        self.__next_chunk()
+        size = min(size, len(self.chunk) - self.chunk_offset)
+        if not size:
+            return None
+        if size == len(self.chunk):
+            data = self.chunk
+        else:
+            data = bytes(
+                memoryview(self.chunk)[
+                    self.chunk_offset:self.chunk_offset + size
+                ]
+            )
+        self.chunk_offset += size
+        self.position += size
+        return data
+
+    def seek_data(self, alignment=PAGE_SIZE):
+        """
+            Return the offset of the next data to read. The alignment
+            of data extents is the one the read ahead was created with
+        """
+        self.__next_chunk()
+        return self.position
+
+    def close(self):
+        """
+            Stop the reader thread and close the data stream
+        """
+        self.stopped.set()
+        # a reader blocked on the full queue gets unblocked by
+        # draining it and stops after queueing its current chunk
+        while self.reader.is_alive():
+            try:
+                while True:
+                    self.chunks.get_nowait()
+            except queue.Empty:
+                pass
+            self.reader.join(0.1)
+        self.data_stream.close()
+
+    def __next_chunk(self):
+        if self.eof or self.chunk_offset < len(self.chunk):
+            return
+        offset, chunk, error = self.chunks.get()
+        if error:
+            self.eof = True
+            raise error
+        if offset is not None:
+            self.position = offset
+        self.chunk = chunk
+        self.chunk_offset = 0
+        if not chunk:
+            self.eof = True
+
+    def __read_ahead(self):
+        try:
+            while not self.stopped.is_set():
+                offset = None
+                if hasattr(self.data_stream, 'seek_data'):
+                    offset = self.data_stream.seek_data(self.alignment)
+                chunk = self.__read_chunk()
+                self.chunks.put((offset, chunk, None))
+                if not chunk:
+                    break
+        except Exception as e:
+            self.chunks.put((None, None, e))
+
+    def __read_chunk(self):
+        if not hasattr(self.data_stream, 'readinto'):
+            return self.data_stream.read(self.chunk_size) or b''
+        chunk = bytearray(self.chunk_size)
+        del chunk[self.data_stream.readinto(chunk):]
+        return chunk
@@ -0,0 +1,86 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import errno
+import os
+
+# project
+from azurectl.utils.datastream import DataStream
+
+
+class SparseFile(DataStream):
+    """
+        Implements reading of sparse files along their data extents
+
+        The data extents are looked up via SEEK_DATA/SEEK_HOLE, holes
+        are skipped by seek_data without reading them. On systems or
+        filesystems without hole support the file is treated as one
+        data extent
+    """
+    PAGE_SIZE = 512
+
+    def __init__(self, file_stream):
+        self.file_stream = file_stream
+        self.position = 0
+        self.data_end = None
+        self.hole_support = hasattr(os, 'SEEK_DATA') and \
+            hasattr(os, 'SEEK_HOLE')
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        if self.data_end is not None:
+            view = view[:max(self.data_end - self.position, 0)]
+        size = self.file_stream.readinto(view)
+        self.position += size
+        return size
+
+    def seek(self, offset):
+        self.position = self.file_stream.seek(offset)
+        self.data_end = None
+        return self.position
+
+    def seek_data(self, alignment=PAGE_SIZE):
+        """
+            Move to the start of the next data extent and return its
+            offset. Extent boundaries are widened to the given alignment
+        """
+        if not self.hole_support:
+            return self.position
+        if self.data_end is not None and self.position < self.data_end:
+            return self.position
+        try:
+            data_start = self.file_stream.seek(self.position, os.SEEK_DATA)
+        except (IOError, OSError) as e:
+            if e.errno == errno.ENXIO:
+                # no data beyond the current position
+                self.position = self.data_end = self.file_stream.seek(
+                    0, os.SEEK_END
+                )
+            else:
+                # no hole support, read the file sequentially
+                self.hole_support = False
+                self.data_end = None
+                self.file_stream.seek(self.position)
+            return self.position
+        data_end = self.file_stream.seek(data_start, os.SEEK_HOLE)
+        self.data_end = data_end + (-data_end % alignment)
+        data_start = max(data_start - data_start % alignment, self.position)
+        self.position = self.file_stream.seek(data_start)
+        return self.position
+
+    def close(self):
+        self.file_stream.close()
+
+    @classmethod
+    def open(self, file_name):
+        return SparseFile(open(file_name, 'rb'))
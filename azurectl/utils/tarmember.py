@@ -0,0 +1,238 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# project
+from azurectl.utils.datastream import SequentialStream
+from azurectl.utils.mappedimage import (
+    ImageMap,
+    MappedImage
+)
+from azurectl.azurectl_exceptions import AzureTarArchiveError
+
+
+class TarMember(MappedImage):
+    """
+        Implements reading of one member of a tar archive from the
+        data stream of the archive
+
+        The archive is read sequentially, the headers are walked up to
+        the member and the data of the members before it is skipped.
+        ustar, GNU and pax headers are supported, long names included.
+        The holes of GNU sparse members, in the old GNU format as well
+        as the pax formats 0.0, 0.1 and 1.0, read as zeros and are
+        skipped by seek_data without reading them. The member is read
+        forward only
+    """
+    BLOCK_SIZE = 512
+    REGULAR_TYPES = (b'0', b'\x00', b'7', b'S')
+    OLD_GNU_SPARSE_OFFSET = 386
+    OLD_GNU_SPARSE_ENTRIES = 4
+    OLD_GNU_SPARSE_EXTENDED_ENTRIES = 21
+
+    def __init__(self, data_stream, member_name):
+        self.archive = SequentialStream(data_stream)
+        self.member_name = self.__normalized(member_name)
+        byte_size, image_map = self.__find_member()
+        super(TarMember, self).__init__(self.archive, byte_size, image_map)
+
+    def __find_member(self):
+        pax_records = []
+        long_name = None
+        while True:
+            header = self.__read_header()
+            type_flag = header[156:157]
+            size = self.__number(header[124:136])
+            if type_flag == b'L':
+                long_name = self.__read_data(size).split(b'\x00')[0]
+                continue
+            if type_flag in (b'x', b'X'):
+                pax_records = self.__pax_records(self.__read_data(size))
+                continue
+            if type_flag in (b'g', b'K'):
+                self.__read_data(size)
+                continue
+            pax = dict(pax_records)
+            if 'size' in pax:
+                size = int(pax['size'])
+            sparse_map = None
+            if type_flag == b'S':
+                # extension blocks of the sparse map follow the header
+                sparse_map = self.__old_gnu_sparse_map(header)
+            name = self.__member_name(header, long_name, pax)
+            if name == self.member_name:
+                if type_flag not in self.REGULAR_TYPES:
+                    raise AzureTarArchiveError(
+                        'Archive member %s is not a regular file' % name
+                    )
+                return self.__member_map(
+                    header, size, pax_records, sparse_map
+                )
+            self.archive.seek(
+                self.archive.position + size + (-size % self.BLOCK_SIZE)
+            )
+            pax_records = []
+            long_name = None
+
+    def __member_map(self, header, size, pax_records, sparse_map):
+        # the [offset, length] regions of the member holding data, the
+        # data of the regions is stored one after the other
+        pax = dict(pax_records)
+        if sparse_map is not None:
+            byte_size = self.__number(header[483:495])
+            regions = sparse_map
+        elif pax.get('GNU.sparse.major') == '1':
+            byte_size = int(pax['GNU.sparse.realsize'])
+            regions = self.__sparse_map_1_0()
+        elif 'GNU.sparse.map' in pax:
+            byte_size = int(pax['GNU.sparse.size'])
+            numbers = [int(n) for n in pax['GNU.sparse.map'].split(',')]
+            regions = list(zip(numbers[0::2], numbers[1::2]))
+        elif 'GNU.sparse.offset' in pax:
+            byte_size = int(pax['GNU.sparse.size'])
+            offsets = [
+                int(value) for key, value in pax_records
+                if key == 'GNU.sparse.offset'
+            ]
+            lengths = [
+                int(value) for key, value in pax_records
+                if key == 'GNU.sparse.numbytes'
+            ]
+            regions = list(zip(offsets, lengths))
+        else:
+            byte_size = size
+            regions = [(0, size)]
+        image_map = ImageMap()
+        stored_offset = self.archive.position
+        for offset, length in regions:
+            if not length:
+                continue
+            if image_map and offset < image_map.guest_end(-1) or \
+                    offset + length > byte_size:
+                raise AzureTarArchiveError(
+                    'Invalid sparse map of archive member %s' %
+                    self.member_name
+                )
+            image_map.add(offset, length, stored_offset)
+            stored_offset += length
+        return byte_size, image_map
+
+    def __old_gnu_sparse_map(self, header):
+        regions = self.__old_gnu_sparse_entries(
+            header, self.OLD_GNU_SPARSE_OFFSET, self.OLD_GNU_SPARSE_ENTRIES
+        )
+        extended = header[482]
+        while extended:
+            extension = self.__read_block()
+            regions += self.__old_gnu_sparse_entries(
+                extension, 0, self.OLD_GNU_SPARSE_EXTENDED_ENTRIES
+            )
+            extended = extension[504]
+        return regions
+
+    def __old_gnu_sparse_entries(self, block, offset, entries):
+        regions = []
+        for entry in range(entries):
+            entry_offset = offset + entry * 24
+            if not block[entry_offset]:
+                break
+            regions.append(
+                (
+                    self.__number(block[entry_offset:entry_offset + 12]),
+                    self.__number(block[entry_offset + 12:entry_offset + 24])
+                )
+            )
+        return regions
+
+    def __sparse_map_1_0(self):
+        # the map leads the data as newline terminated decimal numbers,
+        # the number of regions followed by their offsets and lengths
+        map_data = b''
+        numbers = []
+        count = None
+        while count is None or len(numbers) < 2 * count:
+            map_data += self.__read_block()
+            lines = map_data.split(b'\n')
+            numbers = [int(line) for line in lines[:-1]]
+            if numbers:
+                count = numbers.pop(0)
+        return list(zip(numbers[0::2], numbers[1::2]))
+
+    def __member_name(self, header, long_name, pax):
+        if 'GNU.sparse.name' in pax:
+            return self.__normalized(pax['GNU.sparse.name'])
+        if 'path' in pax:
+            return self.__normalized(pax['path'])
+        if long_name is None:
+            long_name = header[0:100].split(b'\x00')[0]
+            prefix = header[345:500].split(b'\x00')[0]
+            # only POSIX ustar headers carry a name prefix
+            if header[257:263] == b'ustar\x00' and prefix:
+                long_name = prefix + b'/' + long_name
+        return self.__normalized(long_name.decode('utf-8', 'replace'))
+
+    def __normalized(self, name):
+        while name.startswith('./'):
+            name = name[2:]
+        return name.strip('/')
+
+    def __pax_records(self, data):
+        records = []
+        while data:
+            length = data.split(b' ', 1)[0]
+            record = data[len(length) + 1:int(length)]
+            data = data[int(length):]
+            key, value = record.rstrip(b'\n').split(b'=', 1)
+            records.append((key.decode('utf-8'), value.decode('utf-8')))
+        return records
+
+    def __number(self, field):
+        if field[0] & 0x80:
+            # GNU base-256 encoding of large numbers
+            return int.from_bytes(field, 'big') & \
+                ~(0xff << (8 * (len(field) - 1)))
+        try:
+            return int(field.replace(b'\x00', b' ').strip() or b'0', 8)
+        except ValueError:
+            raise AzureTarArchiveError(
+                'Invalid number in tar header at offset %d' %
+                self.archive.position
+            )
+
+    def __read_header(self):
+        header = self.__read_block()
+        if header == bytes(self.BLOCK_SIZE):
+            raise AzureTarArchiveError(
+                'Member %s not found in archive' % self.member_name
+            )
+        checksum = self.__number(header[148:156])
+        if checksum != sum(header[:148]) + 8 * 32 + sum(header[156:]):
+            raise AzureTarArchiveError(
+                'Invalid tar header checksum at offset %d' %
+                (self.archive.position - self.BLOCK_SIZE)
+            )
+        return header
+
+    def __read_data(self, size):
+        data = bytearray(size + (-size % self.BLOCK_SIZE))
+        self.archive.readinto(data)
+        return bytes(data[:size])
+
+    def __read_block(self):
+        block = bytearray(self.BLOCK_SIZE)
+        try:
+            self.archive.readinto(block)
+        except EOFError:
+            raise AzureTarArchiveError(
+                'Member %s not found in archive' % self.member_name
+            )
+        return bytes(block)
@@ -58,6 +58,23 @@ class Validations(object):
             )
         return date
 
+    @classmethod
+    def validate_size(self, field_name, value, alignment=1):
+        try:
+            size = int(value)
+        except ValueError:
+            size = 0
+        if size <= 0:
+            raise AzureInvalidCommand(
+                '%s is not a valid size. It must be a positive number '
+                'of bytes.' % field_name
+            )
+        if size % alignment:
+            raise AzureInvalidCommand(
+                '%s is not %d byte aligned.' % (field_name, alignment)
+            )
+        return size
+
     @classmethod
     def validate_at_least_one_argument_is_set(self, command_args, keys=None):
         if keys is None:
@@ -0,0 +1,279 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import struct
+import sys
+import time
+from array import array
+from uuid import uuid4
+
+# project
+from azurectl.utils.datastream import DataStream
+from azurectl.azurectl_exceptions import AzureVHDFormatError
+from azurectl.utils.mappedimage import (
+    ImageMap,
+    MappedImage
+)
+
+
+class VHDFooter(object):
+    """
+        Implements the footer of fixed VHD images
+
+        The footer conforms to the VHD Footer Format Specification at
+        https://technet.microsoft.com/en-us/virtualization/bb676673.aspx#E3B
+        which specifies the data structure as follows:
+        * Field         Size (bytes)
+        * Cookie        8
+        * Features      4
+        * Version       4
+        * Data Offset   8
+        * TimeStamp     4
+        * Creator App   4
+        * Creator Ver   4
+        * CreatorHostOS 4
+        * Original Size 8
+        * Current Size  8
+        * Disk Geo      4
+        * Disk Type     4
+        * Checksum      4
+        * Unique ID     16
+        * Saved State   1
+        * Reserved      427
+
+        Azure requires the size of a fixed VHD to be a multiple of 1MB
+    """
+    FOOTER_SIZE = 512
+    ALIGNMENT = 1024 * 1024
+    COOKIE = b'conectix'
+    CHECKSUM_OFFSET = 64
+    DISK_TYPE_FIXED = 2
+    DISK_TYPE_DYNAMIC = 3
+    DISK_TYPE_DIFFERENCING = 4
+
+    @classmethod
+    def aligned_size(self, byte_size):
+        return byte_size + (-byte_size % self.ALIGNMENT)
+
+    @classmethod
+    def fixed(self, byte_size):
+        """
+            Footer of a fixed VHD holding byte_size bytes of data
+        """
+        footer = bytearray(self.FOOTER_SIZE)
+        struct.pack_into(
+            '>8sIIQI4sI4sQQII', footer, 0,
+            self.COOKIE,
+            # no features enabled
+            0x00000002,
+            # current file version
+            0x00010000,
+            # in the case of a fixed disk, this is set to -1
+            0xffffffffffffffff,
+            # seconds since january 1st 2000
+            int(time.time()) - 946684800,
+            # 'wa' = windowsazure
+            b'wa\x00\x00',
+            # version of creator application
+            0x00070000,
+            # creator host os
+            b'Wi2k',
+            byte_size,
+            byte_size,
+            # 0x820=2080 cylinders, 0x10=16 heads, 0x3f=63 sectors/track
+            0x0820103f,
+            self.DISK_TYPE_FIXED
+        )
+        footer[68:84] = uuid4().bytes
+        # ones complement of the sum of all bytes but the checksum
+        struct.pack_into(
+            '>I', footer, self.CHECKSUM_OFFSET, ~sum(footer) & 0xffffffff
+        )
+        return bytes(footer)
+
+
+class FixedVHD(DataStream):
+    """
+        Implements reading of a raw data stream as fixed VHD image
+
+        The data of data_size bytes is padded with zeros to the size
+        alignment Azure requires and followed by a fixed VHD footer,
+        such that a raw image uploads without an intermediate VHD
+        file. Holes of data streams providing seek_data are skipped
+        along with the padding
+    """
+    PAGE_SIZE = 512
+
+    def __init__(self, data_stream, data_size):
+        self.data_stream = data_stream
+        self.data_size = data_size
+        self.virtual_size = VHDFooter.aligned_size(data_size)
+        self.footer = VHDFooter.fixed(self.virtual_size)
+        self.byte_size = self.virtual_size + len(self.footer)
+        self.position = 0
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        size = 0
+        while size < len(view) and self.position < self.byte_size:
+            size += self.__read(view[size:])
+            if self.position < self.data_size:
+                # short read of the data stream, e.g. at the end of
+                # a data extent
+                break
+        return size
+
+    def seek_data(self, alignment=PAGE_SIZE):
+        """
+            Move to the start of the next data extent and return its
+            offset. The padding following the data is skipped
+        """
+        if self.position < self.data_size:
+            if hasattr(self.data_stream, 'seek_data'):
+                self.position = self.data_stream.seek_data(alignment)
+                if self.position >= self.data_size:
+                    # the data stream ends in a hole, which is
+                    # skipped along with the padding
+                    self.position = self.virtual_size
+            if self.position < self.data_size:
+                return self.position
+        padding_start = self.data_size + (-self.data_size % alignment)
+        if padding_start <= self.position < self.virtual_size:
+            self.position = self.virtual_size
+        return self.position
+
+    def close(self):
+        self.data_stream.close()
+
+    def __read(self, view):
+        if self.position < self.data_size:
+            count = self.data_stream.readinto(
+                view[:self.data_size - self.position]
+            )
+            if not count:
+                raise EOFError(
+                    'Image ended after %d of %d bytes' %
+                    (self.position, self.data_size)
+                )
+        elif self.position < self.virtual_size:
+            count = min(len(view), self.virtual_size - self.position)
+            view[:count] = bytes(count)
+        else:
+            offset = self.position - self.virtual_size
+            count = min(len(view), len(self.footer) - offset)
+            view[:count] = self.footer[offset:offset + count]
+        self.position += count
+        return count
+
+
+class DynamicVHD(object):
+    """
+        Implements reading of dynamic VHD images
+
+        The guest data is located through the block allocation table
+        of the image, unallocated blocks read as zeros without reading
+        the image file. The sector bitmaps of allocated blocks are not
+        evaluated, the data of an allocated block is read as a whole.
+        The stream presents the guest data followed by a fixed VHD
+        footer. Differencing images are not supported
+    """
+    DYNAMIC_HEADER_COOKIE = b'cxsparse'
+    DYNAMIC_HEADER_SIZE = 1024
+    UNALLOCATED = 0xffffffff
+    SECTOR_SIZE = 512
+
+    @classmethod
+    def open(self, file_name, threads=1):
+        image_file = open(file_name, 'rb')
+        try:
+            current_size, data_offset = self.__read_footer(image_file)
+            image_map = self.__read_map(image_file, current_size, data_offset)
+        except Exception:
+            image_file.close()
+            raise
+        virtual_size = VHDFooter.aligned_size(current_size)
+        return MappedImage(
+            image_file, virtual_size, image_map,
+            VHDFooter.fixed(virtual_size)
+        )
+
+    @classmethod
+    def uncompressed_size(self, file_name):
+        """
+            Size of the fixed VHD image streamed from the image
+        """
+        with open(file_name, 'rb') as image_file:
+            current_size, data_offset = self.__read_footer(image_file)
+        return VHDFooter.aligned_size(current_size) + VHDFooter.FOOTER_SIZE
+
+    @classmethod
+    def __read_footer(self, image_file):
+        # dynamic images start with a copy of the footer
+        footer = image_file.read(VHDFooter.FOOTER_SIZE)
+        if len(footer) < VHDFooter.FOOTER_SIZE or \
+                not footer.startswith(VHDFooter.COOKIE):
+            raise AzureVHDFormatError('No VHD footer at the start of image')
+        data_offset, = struct.unpack_from('>Q', footer, 16)
+        current_size, = struct.unpack_from('>Q', footer, 48)
+        disk_type, = struct.unpack_from('>I', footer, 60)
+        if disk_type == VHDFooter.DISK_TYPE_DIFFERENCING:
+            raise AzureVHDFormatError(
+                'Differencing VHD images are not supported'
+            )
+        if disk_type != VHDFooter.DISK_TYPE_DYNAMIC:
+            raise AzureVHDFormatError(
+                'VHD disk type %d is not a dynamic disk' % disk_type
+            )
+        return current_size, data_offset
+
+    @classmethod
+    def __read_map(self, image_file, current_size, data_offset):
+        image_file.seek(data_offset)
+        header = image_file.read(self.DYNAMIC_HEADER_SIZE)
+        if len(header) < self.DYNAMIC_HEADER_SIZE or \
+                not header.startswith(self.DYNAMIC_HEADER_COOKIE):
+            raise AzureVHDFormatError(
+                'No VHD dynamic disk header at offset %d' % data_offset
+            )
+        table_offset, = struct.unpack_from('>Q', header, 16)
+        max_table_entries, block_size = struct.unpack_from('>II', header, 28)
+        if not block_size or block_size % self.SECTOR_SIZE:
+            raise AzureVHDFormatError(
+                'Invalid VHD block size %d' % block_size
+            )
+        image_file.seek(table_offset)
+        table_data = image_file.read(max_table_entries * 4)
+        if len(table_data) < max_table_entries * 4:
+            raise AzureVHDFormatError(
+                'VHD block allocation table exceeds the image'
+            )
+        table = array('I')
+        table.frombytes(table_data)
+        if sys.byteorder == 'little':
+            table.byteswap()
+        # the data of a block follows its sector bitmap, which is
+        # padded to a sector boundary
+        bitmap_size = -(-block_size // self.SECTOR_SIZE // 8)
+        bitmap_size += -bitmap_size % self.SECTOR_SIZE
+        image_map = ImageMap()
+        for block, sector in enumerate(table):
+            guest_offset = block * block_size
+            if guest_offset >= current_size:
+                break
+            if sector == self.UNALLOCATED:
+                continue
+            image_map.add(
+                guest_offset, min(block_size, current_size - guest_offset),
+                sector * self.SECTOR_SIZE + bitmap_size
+            )
+        return image_map
@@ -13,53 +13,399 @@
 #
 import lzma
 import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+# project
+from azurectl.utils.datastream import DataStream
+from azurectl.azurectl_exceptions import AzureXZIndexError
 
-class XZ(object):
+
+class XZ(DataStream):
     """
         Implements decompression of lzma compressed files
     """
     LZMA_STREAM_BUFFER_SIZE = 8192
-
-    def __enter__(self):
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.lzma_stream.close()
+    XZ_STREAM_HEADER_MAGIC = b'\xfd7zXZ\x00'
+    XZ_STREAM_FOOTER_MAGIC = b'YZ'
+    XZ_STREAM_HEADER_SIZE = 12
+    XZ_STREAM_FOOTER_SIZE = 12
 
     def __init__(self, lzma_stream, buffer_size=LZMA_STREAM_BUFFER_SIZE):
         self.buffer_size = int(buffer_size)
         self.lzma = lzma.LZMADecompressor()
         self.lzma_stream = lzma_stream
-        self.buffered_bytes = b''
+        self.buffered_bytes = memoryview(b'')
+        # seconds spent decompressing
+        self.decompress_time = 0
+
+    def readinto(self, buffer):
+        """
+            Decompress into the given writable buffer until it is full
+            or the end of the file is reached. Returns the number of
+            bytes written to the buffer, 0 at the end of the file
+        """
+        view = memoryview(buffer).cast('B')
+        size = len(view)
+        bytes_uncompressed = 0
+        while bytes_uncompressed < size:
+            if not self.buffered_bytes:
+                uncompressed = self.__decompress()
+                if uncompressed is None:
+                    break
+                self.buffered_bytes = memoryview(uncompressed)
+            count = min(size - bytes_uncompressed, len(self.buffered_bytes))
+            view[bytes_uncompressed:bytes_uncompressed + count] = \
+                self.buffered_bytes[:count]
+            self.buffered_bytes = self.buffered_bytes[count:]
+            bytes_uncompressed += count
+        return bytes_uncompressed
+
+    def close(self):
+        self.lzma_stream.close()
+
+    @classmethod
+    def open(
+        self, file_name, buffer_size=LZMA_STREAM_BUFFER_SIZE, threads=1
+    ):
+        """
+            Open an xz file for reading. With threads > 1 and an index
+            consisting of several reasonably sized blocks the blocks are
+            decompressed in parallel by a ParallelXZ reader
+        """
+        if int(threads) > 1:
+            with open(file_name, 'rb') as xz_file:
+                streams = self.stream_indexes(xz_file)
+            if ParallelXZ.supports(streams):
+                return ParallelXZ(file_name, streams, threads)
+        return XZ(open(file_name, 'rb'), buffer_size)
 
-    def read(self, size):
-        if self.lzma.eof and not self.buffered_bytes:
-            return None
+    @classmethod
+    def uncompressed_size(self, file_name):
+        """
+            Sum up the uncompressed size of all blocks from the index
+            of each stream in the file. The index is located through
+            the stream footer, thus no decompression is needed
+        """
+        uncompressed_size = 0
+        with open(file_name, 'rb') as xz_file:
+            for stream in self.stream_indexes(xz_file):
+                for unpadded_size, block_size in stream['records']:
+                    uncompressed_size += block_size
+        return uncompressed_size
 
-        chunks = self.buffered_bytes
+    @classmethod
+    def stream_indexes(self, xz_file):
+        """
+            Walk the concatenated streams of an xz file from the end
+            and return the index records of each stream in file order.
+            Each stream is described by a dict with the stream offset
+            and the list of (unpadded_size, uncompressed_size) block
+            records from its index
+        """
+        xz_file.seek(0, os.SEEK_END)
+        position = xz_file.tell()
+        streams = []
+        while position > 0:
+            position = self.__skip_stream_padding(xz_file, position)
+            if position == 0:
+                break
+            footer = self.__read_at(
+                xz_file,
+                position - self.XZ_STREAM_FOOTER_SIZE,
+                self.XZ_STREAM_FOOTER_SIZE
+            )
+            backward_size, stream_flags = self.__parse_stream_footer(footer)
+            index_offset = \
+                position - self.XZ_STREAM_FOOTER_SIZE - backward_size
+            records = self.__parse_index(
+                self.__read_at(xz_file, index_offset, backward_size)
+            )
+            blocks_size = 0
+            for unpadded_size, block_size in records:
+                blocks_size += self.__padded(unpadded_size)
+            stream_offset = \
+                index_offset - blocks_size - self.XZ_STREAM_HEADER_SIZE
+            header = self.__read_at(
+                xz_file, stream_offset, self.XZ_STREAM_HEADER_SIZE
+            )
+            if header[:6] != self.XZ_STREAM_HEADER_MAGIC or \
+                    header[6:8] != stream_flags:
+                raise AzureXZIndexError(
+                    'No matching stream header at offset %d' % stream_offset
+                )
+            streams.insert(
+                0, {'offset': stream_offset, 'records': records}
+            )
+            position = stream_offset
+        return streams
 
-        bytes_uncompressed = len(chunks)
-        while not self.lzma.eof and bytes_uncompressed < size:
-            chunks += self.lzma.decompress(
-                self.lzma.unused_data + self.lzma_stream.read(self.buffer_size)
+    def __decompress(self):
+        if self.lzma.eof:
+            return self.__next_stream()
+        compressed = self.lzma_stream.read(self.buffer_size)
+        if not compressed:
+            raise EOFError(
+                'Compressed file ended before the '
+                'end-of-stream marker was reached'
             )
-            bytes_uncompressed = len(chunks)
+        return self.__timed_decompress(compressed)
+
+    def __next_stream(self):
+        # concatenated streams are separated by null byte stream padding,
+        # the next stream starts with its header magic
+        unused_data = self.lzma.unused_data.lstrip(b'\x00')
+        while not unused_data:
+            compressed = self.lzma_stream.read(self.buffer_size)
+            if not compressed:
+                return None
+            unused_data = compressed.lstrip(b'\x00')
+        self.lzma = lzma.LZMADecompressor()
+        return self.__timed_decompress(unused_data)
 
-        self.buffered_bytes = chunks[size:]
-        return chunks[:size]
+    def __timed_decompress(self, compressed):
+        start_time = time.time()
+        uncompressed = self.lzma.decompress(compressed)
+        self.decompress_time += time.time() - start_time
+        return uncompressed
 
     @classmethod
-    def close(self):
-        self.lzma_stream.close()
+    def __skip_stream_padding(self, xz_file, position):
+        if position % 4 != 0:
+            raise AzureXZIndexError(
+                'File size %d is not a multiple of four bytes' % position
+            )
+        while position > 0:
+            if self.__read_at(xz_file, position - 4, 4) != b'\x00' * 4:
+                break
+            position -= 4
+        return position
 
     @classmethod
-    def open(self, file_name, buffer_size=LZMA_STREAM_BUFFER_SIZE):
-        self.lzma_stream = open(file_name, 'rb')
-        return XZ(self.lzma_stream, buffer_size)
+    def __parse_stream_footer(self, footer):
+        if footer[10:] != self.XZ_STREAM_FOOTER_MAGIC:
+            raise AzureXZIndexError('Stream footer magic not found')
+        crc32, backward_size = struct.unpack('<II', footer[:8])
+        if crc32 != zlib.crc32(footer[4:10]) & 0xffffffff:
+            raise AzureXZIndexError('Stream footer CRC32 mismatch')
+        return (backward_size + 1) * 4, footer[8:10]
 
     @classmethod
-    def uncompressed_size(self, file_name):
-        with lzma.open(file_name) as lzma_stream:
-            lzma_stream.seek(0, os.SEEK_END)
-            return lzma_stream.tell()
+    def __parse_index(self, index):
+        if not index or index[0] != 0x00:
+            raise AzureXZIndexError('Index indicator not found')
+        crc32 = struct.unpack('<I', index[-4:])[0]
+        if crc32 != zlib.crc32(index[:-4]) & 0xffffffff:
+            raise AzureXZIndexError('Index CRC32 mismatch')
+        number_of_records, position = self.__decode_vli(index, 1)
+        records = []
+        for record in range(number_of_records):
+            unpadded_size, position = self.__decode_vli(index, position)
+            uncompressed_size, position = self.__decode_vli(index, position)
+            records.append((unpadded_size, uncompressed_size))
+        if self.__padded(position) != len(index) - 4:
+            raise AzureXZIndexError('Index size mismatch')
+        return records
+
+    @classmethod
+    def __decode_vli(self, data, position):
+        # variable length integer, up to nine bytes with seven bits
+        # each, the lowest bits first
+        value = 0
+        for shift in range(0, 63, 7):
+            if position >= len(data):
+                break
+            byte = data[position]
+            position += 1
+            value |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                return value, position
+        raise AzureXZIndexError('Invalid variable length integer in index')
+
+    @classmethod
+    def __read_at(self, xz_file, offset, size):
+        if offset < 0:
+            raise AzureXZIndexError('Offset %d out of file range' % offset)
+        xz_file.seek(offset)
+        data = xz_file.read(size)
+        if len(data) != size:
+            raise AzureXZIndexError('Unexpected end of file')
+        return data
+
+    @classmethod
+    def __padded(self, size):
+        return (size + 3) & ~3
+
+
+class ParallelXZ(DataStream):
+    """
+        Implements parallel decompression of multi block xz files
+
+        Every block listed in the stream indexes is wrapped into a
+        single block xz stream of its own and decompressed by a pool
+        of worker threads. liblzma releases the GIL while decoding,
+        thus blocks are decompressed on all cores. The compressed
+        data is read sequentially and the blocks are returned in
+        file order
+    """
+    XZ_MAX_BLOCK_SIZE = 256 * 1024 * 1024
+    XZ_MAX_BUFFER_SIZE = 1024 * 1024 * 1024
+
+    def __init__(self, file_name, streams, threads, start=0, end=None):
+        """
+            With start and end, only the blocks starting within the
+            [start, end) range of the uncompressed data are read.
+            Both are expected to be block boundaries
+        """
+        self.threads = int(threads)
+        self.xz_file = open(file_name, 'rb')
+        self.blocks = deque()
+        uncompressed_offset = 0
+        for stream in streams:
+            stream_header = self.__read_at(
+                stream['offset'], XZ.XZ_STREAM_HEADER_SIZE
+            )
+            block_offset = stream['offset'] + XZ.XZ_STREAM_HEADER_SIZE
+            for unpadded_size, uncompressed_size in stream['records']:
+                if uncompressed_offset >= start and \
+                        (end is None or uncompressed_offset < end):
+                    self.blocks.append(
+                        (stream_header, block_offset, unpadded_size,
+                            uncompressed_size)
+                    )
+                block_offset += (unpadded_size + 3) & ~3
+                uncompressed_offset += uncompressed_size
+        self.decompress_pool = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending_blocks = deque()
+        self.pending_bytes = 0
+        self.buffered_bytes = memoryview(b'')
+        self.position = start
+        # seconds spent decompressing, summed over the threads
+        self.decompress_time = 0
+        self.decompress_time_lock = threading.Lock()
+
+    @classmethod
+    def supports(self, streams):
+        """
+            Parallel decompression pays off for more than one block and
+            needs every block to fit into memory
+        """
+        block_sizes = [
+            uncompressed_size
+            for stream in streams
+            for unpadded_size, uncompressed_size in stream['records']
+        ]
+        return len(block_sizes) > 1 and \
+            max(block_sizes) <= self.XZ_MAX_BLOCK_SIZE
+
+    def readinto(self, buffer):
+        """
+            Fill the given writable buffer from the decompressed blocks
+            in file order. Returns the number of bytes written to the
+            buffer, 0 at the end of the file
+        """
+        view = memoryview(buffer).cast('B')
+        size = len(view)
+        bytes_uncompressed = 0
+        while bytes_uncompressed < size:
+            if not self.buffered_bytes:
+                self.__schedule_blocks()
+                if not self.pending_blocks:
+                    break
+                block, block_size = self.pending_blocks.popleft()
+                self.pending_bytes -= block_size
+                self.buffered_bytes = memoryview(block.result())
+            count = min(size - bytes_uncompressed, len(self.buffered_bytes))
+            view[bytes_uncompressed:bytes_uncompressed + count] = \
+                self.buffered_bytes[:count]
+            self.buffered_bytes = self.buffered_bytes[count:]
+            bytes_uncompressed += count
+        self.position += bytes_uncompressed
+        return bytes_uncompressed
+
+    def seek(self, offset):
+        """
+            Move forward to the given offset of the uncompressed data.
+            Blocks ending before the offset are not decompressed
+        """
+        skip = min(max(offset - self.position, 0), len(self.buffered_bytes))
+        self.buffered_bytes = self.buffered_bytes[skip:]
+        self.position += skip
+        while self.pending_blocks and \
+                self.position + self.pending_blocks[0][1] <= offset:
+            block, block_size = self.pending_blocks.popleft()
+            block.cancel()
+            self.pending_bytes -= block_size
+            self.position += block_size
+        while not self.pending_blocks and self.blocks and \
+                self.position + self.blocks[0][3] <= offset:
+            self.position += self.blocks.popleft()[3]
+        if self.position < offset:
+            # the offset is within the next block
+            self.readinto(bytearray(offset - self.position))
+        return self.position
+
+    def close(self):
+        for block, block_size in self.pending_blocks:
+            block.cancel()
+        self.decompress_pool.shutdown(wait=True)
+        self.pending_blocks.clear()
+        self.xz_file.close()
+
+    def __schedule_blocks(self):
+        # keep up to one block per thread in flight, as long as the
+        # uncompressed data stays within the buffer limit
+        while self.blocks and len(self.pending_blocks) < self.threads:
+            stream_header, offset, unpadded_size, uncompressed_size = \
+                self.blocks[0]
+            if self.pending_blocks and self.pending_bytes + \
+                    uncompressed_size > self.XZ_MAX_BUFFER_SIZE:
+                break
+            self.blocks.popleft()
+            block_data = self.__read_at(offset, (unpadded_size + 3) & ~3)
+            block = self.decompress_pool.submit(
+                self.__decompress_block, stream_header, block_data,
+                unpadded_size, uncompressed_size
+            )
+            self.pending_blocks.append((block, uncompressed_size))
+            self.pending_bytes += uncompressed_size
+
+    def __decompress_block(
+        self, stream_header, block_data, unpadded_size, uncompressed_size
+    ):
+        index = b'\x00' + self.__encode_vli(1) + \
+            self.__encode_vli(unpadded_size) + \
+            self.__encode_vli(uncompressed_size)
+        index += b'\x00' * (-len(index) % 4)
+        index += struct.pack('<I', zlib.crc32(index) & 0xffffffff)
+        footer = struct.pack('<I', len(index) // 4 - 1) + stream_header[6:8]
+        footer = struct.pack('<I', zlib.crc32(footer) & 0xffffffff) + \
+            footer + XZ.XZ_STREAM_FOOTER_MAGIC
+        start_time = time.time()
+        block = lzma.LZMADecompressor().decompress(
+            stream_header + block_data + index + footer
+        )
+        with self.decompress_time_lock:
+            self.decompress_time += time.time() - start_time
+        if len(block) != uncompressed_size:
+            raise lzma.LZMAError(
+                'Block size %d does not match index size %d' %
+                (len(block), uncompressed_size)
+            )
+        return block
+
+    def __encode_vli(self, value):
+        vli = bytearray()
+        while value >= 0x80:
+            vli.append((value & 0x7f) | 0x80)
+            value >>= 7
+        vli.append(value)
+        return bytes(vli)
+
+    def __read_at(self, offset, size):
+        self.xz_file.seek(offset)
+        return self.xz_file.read(size)
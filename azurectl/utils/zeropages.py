@@ -0,0 +1,60 @@
+# Copyright (c) 2015 SUSE Linux GmbH.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+class ZeroPages(object):
+    """
+        Implements the lookup of zero pages in a chunk of data. The
+        pages are compared in place against a zero buffer, without a
+        copy of the data
+    """
+    PAGE_SIZE = 512
+    ZERO_PAGE = bytes(PAGE_SIZE)
+    # zero gaps up to this size between non zero pages are uploaded
+    # as part of one page write instead of splitting the request
+    MAX_ZERO_GAP_SIZE = 64 * 1024
+
+    def __init__(self, max_zero_gap_size=MAX_ZERO_GAP_SIZE):
+        self.max_zero_gap_size = max_zero_gap_size
+        self.zero_chunk = b''
+
+    def is_zero(self, data, start, end):
+        """
+            Check if the [start, end) byte range of data is all zero
+        """
+        if len(self.zero_chunk) < end - start:
+            self.zero_chunk = bytes(end - start)
+        return data.startswith(
+            memoryview(self.zero_chunk)[:end - start], start
+        )
+
+    def non_zero_ranges(self, data, length):
+        """
+            Classify the first length bytes of data at page granularity
+            and return the list of [start, end) byte ranges containing
+            non zero pages, with nearby ranges coalesced to limit the
+            number of requests
+        """
+        if self.is_zero(data, 0, length):
+            return []
+        ranges = []
+        for offset in range(0, length, self.PAGE_SIZE):
+            page_end = min(offset + self.PAGE_SIZE, length)
+            if not data.startswith(self.ZERO_PAGE, offset, page_end):
+                if ranges and \
+                        offset - ranges[-1][1] <= self.max_zero_gap_size:
+                    ranges[-1][1] = page_end
+                else:
+                    ranges.append([offset, page_end])
+        return ranges
@@ -60,7 +60,7 @@ function _azurectl {
                 return 0
                 ;;
             "disk")
-                __comp_reply "sas delete help --help upload"
+                __comp_reply "sas scan delete help --help upload"
                 return 0
                 ;;
             "disassociate")
@@ -79,6 +79,10 @@ function _azurectl {
                 __comp_reply "--blob-name --start-datetime --expiry-datetime --permissions --name"
                 return 0
                 ;;
+            "scan")
+                __comp_reply "--source --decompress-threads"
+                return 0
+                ;;
             "replication-status")
                 __comp_reply "--name"
                 return 0
@@ -148,7 +152,7 @@ function _azurectl {
                 return 0
                 ;;
             "upload")
-                __comp_reply "--source --blob-name --max-chunk-size --quiet"
+                __comp_reply "--source --batch --parallel --max-in-flight --blob-name --max-chunk-size --auto-tune --hedge --max-bandwidth --shared-bandwidth --threads --processes --decompress-threads --read-ahead --resume --delta --base-blob --targets --to-vhd --member --size --progress-fd --quiet"
                 return 0
                 ;;
             "remove")
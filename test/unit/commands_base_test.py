@@ -57,6 +57,17 @@ class TestCliTask:
         task.validate_max_length('--name', 10)
         mock_validation.assert_called_once_with('--name', 'test-name0', 10)
 
+    @patch('azurectl.commands.base.Validations.validate_size')
+    def test_validate_size(self, mock_validation):
+        sys.argv = [
+            sys.argv[0],
+            'storage', 'disk', 'upload', '--source', '-', '--size', '1024',
+            '--blob-name', 'foo'
+        ]
+        task = CliTask()
+        task.validate_size('--size', 512)
+        mock_validation.assert_called_once_with('--size', '1024', 512)
+
     @patch('azurectl.commands.base.Cli.show_help')
     @patch('azurectl.commands.base.Config')
     @patch('azurectl.logger.log.setLevel')
@@ -2,14 +2,21 @@ from .test_helper import argv_kiwi_tests
 
 import datetime
 import dateutil.parser
+import os
 import sys
 import mock
 from mock import patch
+from mock import call
 from pytest import raises
+from tempfile import mkdtemp
+from shutil import rmtree
 import azurectl
 from azurectl.commands.storage_disk import StorageDiskTask
 
-from azurectl.azurectl_exceptions import AzureInvalidCommand
+from azurectl.azurectl_exceptions import (
+    AzureInvalidCommand,
+    AzureStorageFileNotFound
+)
 
 
 class TestStorageDiskTask:
@@ -26,6 +33,12 @@ class TestStorageDiskTask:
         )
         self.storage = mock.Mock()
         self.storage.upload = mock.Mock()
+        self.storage.upload_status = {
+            'current_bytes': 0, 'total_bytes': 0, 'skipped_bytes': 0,
+            'unchanged_bytes': 0, 'retries': 0, 'hedged_writes': 0
+        }
+        self.storage.upload_summary.return_value = self.storage.upload_status
+        self.storage.target_status = {}
         azurectl.commands.storage_disk.Storage = mock.Mock(
             return_value=self.storage
         )
@@ -44,9 +57,29 @@ class TestStorageDiskTask:
         self.task.command_args['delete'] = False
         self.task.command_args['upload'] = False
         self.task.command_args['sas'] = False
+        self.task.command_args['scan'] = False
         self.task.command_args['--color'] = False
         self.task.command_args['--source'] = 'some-file'
         self.task.command_args['--max-chunk-size'] = 1024
+        self.task.command_args['--threads'] = 4
+        self.task.command_args['--decompress-threads'] = None
+        self.task.command_args['--resume'] = False
+        self.task.command_args['--delta'] = False
+        self.task.command_args['--base-blob'] = None
+        self.task.command_args['--read-ahead'] = None
+        self.task.command_args['--processes'] = '1'
+        self.task.command_args['--auto-tune'] = False
+        self.task.command_args['--hedge'] = False
+        self.task.command_args['--max-bandwidth'] = None
+        self.task.command_args['--shared-bandwidth'] = False
+        self.task.command_args['--progress-fd'] = None
+        self.task.command_args['--targets'] = None
+        self.task.command_args['--to-vhd'] = False
+        self.task.command_args['--member'] = None
+        self.task.command_args['--size'] = None
+        self.task.command_args['--batch'] = None
+        self.task.command_args['--parallel'] = '4'
+        self.task.command_args['--max-in-flight'] = None
         self.task.command_args['--quiet'] = False
         self.task.command_args['--blob-name'] = 'some-name'
         self.task.command_args['--start-datetime'] = '2015-01-01'
@@ -61,9 +94,198 @@ class TestStorageDiskTask:
         self.task.command_args['upload'] = True
         self.task.process()
         self.task.storage.upload.assert_called_once_with(
-            'some-file', self.task.command_args['--blob-name'], 1024
+            'some-file', self.task.command_args['--blob-name'], 1024,
+            max_threads=4, decompress_threads=None, resume=False,
+            delta=False, base_blob=None, read_ahead_size=None,
+            max_processes='1', auto_tune=False, hedge=False, targets=None,
+            max_bandwidth=None, shared_bandwidth=False, to_vhd=False,
+            member=None, size=None
         )
 
+    @patch('azurectl.commands.storage_disk.BackgroundScheduler')
+    def test_process_storage_disk_upload_hedge(self, mock_job):
+        self.__init_command_args()
+        self.task.command_args['disk'] = True
+        self.task.command_args['upload'] = True
+        self.task.command_args['--hedge'] = True
+        self.task.process()
+        assert self.task.storage.upload.call_args[1]['hedge'] is True
+
+    @patch('azurectl.commands.storage_disk.BackgroundScheduler')
+    def test_process_storage_disk_upload_max_bandwidth(self, mock_job):
+        self.__init_command_args()
+        self.task.command_args['disk'] = True
+        self.task.command_args['upload'] = True
+        self.task.command_args['--max-bandwidth'] = '1048576'
+        self.task.command_args['--shared-bandwidth'] = True
+        self.task.process()
+        call_args = self.task.storage.upload.call_args
+        assert call_args[1]['max_bandwidth'] == '1048576'
+        assert call_args[1]['shared_bandwidth'] is True
+
+    @patch('azurectl.commands.storage_disk.BackgroundScheduler')
+    def test_process_storage_disk_upload_to_vhd(self, mock_job):
+        self.__init_command_args()
+        self.task.command_args['disk'] = True
+        self.task.command_args['upload'] = True
+        self.task.command_args['--to-vhd'] = True
+        self.task.process()
+        assert self.task.storage.upload.call_args[1]['to_vhd'] is True
+
+    @patch('azurectl.commands.storage_disk.BackgroundScheduler')
+    def test_process_storage_disk_upload_member(self, mock_job):
+        self.__init_command_args()
+        self.task.command_args['disk'] = True
+        self.task.command_args['upload'] = True
+        self.task.command_args['--member'] = 'disk.raw'
+        self.task.process()
+        assert self.task.storage.upload.call_args[1]['member'] == 'disk.raw'
+
+    @patch('azurectl.commands.storage_disk.BackgroundScheduler')
+    def test_process_storage_disk_upload_stdin(self, mock_job):
+        self.__init_command_args()
+        self.task.command_args['disk'] = True
+        self.task.command_args['upload'] = True
+        self.task.command_args['--source'] = '-'
+        self.task.command_args['--size'] = '1024'
+        self.task.process()
+        call_args = self.task.storage.upload.call_args
+        assert call_args[0][0] == '-'
+        assert call_args[1]['size'] == '1024'
+
+    def test_process_storage_disk_upload_stdin_invalid_size(self):
+        self.__init_command_args()
+        self.task.command_args['disk'] = True
+        self.task.command_args['upload'] = True
+        self.task.command_args['--source'] = '-'
+        for size in ('1G', '0', '-1024', '1000'):
+            self.task.command_args['--size'] = size
+            with raises(AzureInvalidCommand):
+                self.task.process()
+        assert not self.task.storage.upload.called
+
+    @patch('azurectl.commands.storage_disk.BackgroundScheduler')
+    def test_process_storage_disk_upload_stdin_to_vhd(self, mock_job):
+        self.__init_command_args()
+        self.task.command_args['disk'] = True
+        self.task.command_args['upload'] = True
+        self.task.command_args['--source'] = '-'
+        self.task.command_args['--size'] = '1000'
+        self.task.command_args['--to-vhd'] = True
+        self.task.process()
+        assert self.task.storage.upload.call_args[1]['size'] == '1000'
+
+    @patch('azurectl.commands.storage_disk.log.info')
+    @patch('azurectl.commands.storage_disk.BackgroundScheduler')
+    def test_process_storage_disk_upload_targets(self, mock_job, mock_info):
+        self.__init_command_args()
+        self.task.command_args['disk'] = True
+        self.task.command_args['upload'] = True
+        self.task.command_args['--targets'] = 'other/images,another'
+        self.storage.target_status = {
+            'other/images': {}, 'another/foo': {}
+        }
+        self.task.process()
+        assert self.task.storage.upload.call_args[1]['targets'] == [
+            ['other', 'images'], ['another', 'foo']
+        ]
+        assert mock_info.call_args_list[-2:] == [
+            call('Uploaded to %s', 'another/foo'),
+            call('Uploaded to %s', 'other/images')
+        ]
+
+    @patch('azurectl.commands.storage_disk.log.info')
+    @patch('azurectl.commands.storage_disk.DataOutput')
+    @patch('azurectl.commands.storage_disk.BackgroundScheduler')
+    def test_process_storage_disk_upload_batch(
+        self, mock_job, mock_out, mock_info
+    ):
+        batch_dir = mkdtemp()
+        batch_file = os.path.join(batch_dir, 'batch')
+        with open(batch_file, 'w') as batch:
+            batch.write(
+                '# release images\n'
+                'image-a.raw.xz blob-a  # the first one\n'
+                '\n'
+                'image-b.raw.xz\n'
+            )
+        self.__init_command_args()
+        self.task.command_args['disk'] = True
+        self.task.command_args['upload'] = True
+        self.task.command_args['--source'] = None
+        self.task.command_args['--batch'] = batch_file
+        self.task.command_args['--max-in-flight'] = '1048576'
+        self.task.command_args['--max-bandwidth'] = '1048576'
+        self.task.command_args['--shared-bandwidth'] = True
+        self.storage.batch_uploads = [
+            {'source': 'image-a.raw.xz', 'blob_name': 'blob-a'}
+        ]
+        try:
+            self.task.process()
+        finally:
+            rmtree(batch_dir)
+        self.task.storage.upload_batch.assert_called_once_with(
+            [['image-a.raw.xz', 'blob-a'], ['image-b.raw.xz', None]],
+            '4', '1048576', 1024, max_threads=4, decompress_threads=None,
+            read_ahead_size=None, auto_tune=False, hedge=False,
+            max_bandwidth='1048576', shared_bandwidth=True
+        )
+        assert not self.task.storage.upload.called
+        mock_info.assert_any_call(
+            'Uploaded %s to %s', 'image-a.raw.xz', 'blob-a'
+        )
+        assert list(mock_out.call_args[0][0].get()) == [
+            batch_file + ':upload'
+        ]
+
+    @patch('azurectl.commands.storage_disk.BackgroundScheduler')
+    def test_process_storage_disk_upload_batch_not_found(self, mock_job):
+        self.__init_command_args()
+        self.task.command_args['disk'] = True
+        self.task.command_args['upload'] = True
+        self.task.command_args['--batch'] = '/no/such/batch'
+        with raises(AzureStorageFileNotFound):
+            self.task.process()
+
+    @patch('azurectl.commands.storage_disk.BackgroundScheduler')
+    @patch('azurectl.commands.storage_disk.DataOutput')
+    def test_process_storage_disk_upload_summary(self, mock_out, mock_job):
+        self.__init_command_args()
+        self.task.command_args['disk'] = True
+        self.task.command_args['upload'] = True
+        self.task.process()
+        assert mock_out.call_args[0][0].get() == {
+            'some-file:upload': self.storage.upload_status
+        }
+        mock_out.return_value.display.assert_called_once_with()
+
+    @patch('azurectl.commands.storage_disk.BackgroundScheduler')
+    def test_process_storage_disk_upload_progress_fd(self, mock_job):
+        read_fd, write_fd = os.pipe()
+        self.__init_command_args()
+        self.task.command_args['disk'] = True
+        self.task.command_args['upload'] = True
+        self.task.command_args['--quiet'] = True
+        self.task.command_args['--progress-fd'] = str(write_fd)
+        self.task.process()
+        progress_stream = self.storage.write_upload_status.call_args[0][0]
+        assert progress_stream.closed
+        assert mock_job.return_value.add_job.call_args[1]['args'] == [
+            progress_stream
+        ]
+        with raises(OSError):
+            os.close(write_fd)
+        os.close(read_fd)
+
+    @patch('azurectl.commands.storage_disk.BackgroundScheduler')
+    def test_process_storage_disk_upload_delta(self, mock_job):
+        self.__init_command_args()
+        self.task.command_args['disk'] = True
+        self.task.command_args['upload'] = True
+        self.task.command_args['--delta'] = True
+        self.task.process()
+        assert self.task.storage.upload.call_args[1]['delta'] is True
+
     @patch('azurectl.commands.storage_disk.BackgroundScheduler')
     def test_process_storage_disk_upload_interrupted(self, mock_job):
         self.__init_command_args()
@@ -83,6 +305,15 @@ class TestStorageDiskTask:
         with raises(SystemExit):
             self.task.process()
 
+    @patch('azurectl.commands.storage_disk.DataOutput')
+    def test_process_storage_disk_scan(self, mock_out):
+        self.__init_command_args()
+        self.task.command_args['scan'] = True
+        self.task.command_args['--decompress-threads'] = '4'
+        self.task.process()
+        self.task.storage.scan.assert_called_once_with('some-file', '4')
+        mock_out.return_value.display.assert_called_once_with()
+
     def test_process_storage_disk_delete(self):
         self.__init_command_args()
         self.task.command_args['disk'] = True
@@ -97,3 +97,11 @@ class TestDefaults:
         host_caching_docopts = self.__host_caching_docopts()
         assert Defaults.host_caching_for_docopts(host_caching_docopts) == \
             'ReadOnly'
+
+    @patch.dict('os.environ', {'XDG_CACHE_HOME': '/var/cache/foo'})
+    def test_cache_directory(self):
+        assert Defaults.cache_directory() == '/var/cache/foo/azurectl'
+
+    @patch.dict('os.environ', {'XDG_CACHE_HOME': '', 'HOME': '/home/foo'})
+    def test_cache_directory_in_home(self):
+        assert Defaults.cache_directory() == '/home/foo/.cache/azurectl'
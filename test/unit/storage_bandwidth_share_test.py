@@ -0,0 +1,94 @@
+from .test_helper import argv_kiwi_tests
+
+import os
+import shutil
+import tempfile
+import time
+from mock import patch
+from pytest import raises
+
+from azurectl.storage.bandwidth_share import BandwidthShare
+
+from azurectl.azurectl_exceptions import AzureBandwidthShareError
+
+
+class TestBandwidthShare:
+    def setup(self):
+        self.share_dir = tempfile.mkdtemp()
+        self.share = BandwidthShare(self.share_dir)
+
+    def teardown(self):
+        shutil.rmtree(self.share_dir)
+
+    def test_register(self):
+        assert os.path.exists(self.share.filename)
+        assert os.path.basename(self.share.filename).startswith(
+            '%d-' % os.getpid()
+        )
+
+    @patch('azurectl.storage.bandwidth_share.Defaults.cache_directory')
+    def test_default_share_dir(self, mock_cache_directory):
+        mock_cache_directory.return_value = self.share_dir
+        share = BandwidthShare()
+        assert share.share_dir == os.path.join(
+            self.share_dir, 'bandwidth-share'
+        )
+        assert os.path.exists(share.filename)
+        share.close()
+
+    @patch('os.makedirs')
+    def test_register_raises(self, mock_makedirs):
+        mock_makedirs.side_effect = OSError('read-only')
+        with raises(AzureBandwidthShareError):
+            BandwidthShare(os.path.join(self.share_dir, 'share'))
+
+    def test_participants(self):
+        other = BandwidthShare(self.share_dir)
+        assert self.share.participants() == 2
+        other.close()
+        assert self.share.participants() == 1
+
+    def test_participants_removes_dead_and_stale(self):
+        dead = os.path.join(self.share_dir, '%d-0' % self.__dead_pid())
+        stale = os.path.join(self.share_dir, '%d-1' % os.getpid())
+        invalid = os.path.join(self.share_dir, 'invalid')
+        for filename in (dead, stale, invalid):
+            open(filename, 'w').close()
+        stale_time = time.time() - BandwidthShare.STALE_TIME - 1
+        os.utime(stale, (stale_time, stale_time))
+        assert self.share.participants() == 1
+        assert os.listdir(self.share_dir) == [
+            os.path.basename(self.share.filename)
+        ]
+
+    @patch('os.kill')
+    def test_participants_process_of_other_user(self, mock_kill):
+        mock_kill.side_effect = PermissionError
+        open(os.path.join(self.share_dir, '1-0'), 'w').close()
+        assert self.share.participants() == 2
+
+    def test_participants_recreates_file(self):
+        os.remove(self.share.filename)
+        assert self.share.participants() == 1
+        assert os.path.exists(self.share.filename)
+
+    def test_participants_share_dir_removed(self):
+        shutil.rmtree(self.share_dir)
+        assert self.share.participants() == 1
+        os.makedirs(self.share_dir)
+
+    def test_close(self):
+        self.share.close()
+        assert not os.path.exists(self.share.filename)
+        self.share.close()
+
+    def __dead_pid(self):
+        pid = 99999
+        while True:
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return pid
+            except PermissionError:
+                pass
+            pid += 1
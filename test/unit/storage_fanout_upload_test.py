@@ -0,0 +1,177 @@
+from .test_helper import argv_kiwi_tests
+
+import io
+import mock
+from mock import patch
+
+from azurectl.storage.fanout_upload import (
+    FanoutTarget,
+    FanoutUpload
+)
+from azurectl.storage.page_index import PageIndex
+from azurectl.utils.extentstream import ExtentStream
+
+
+class FakeBlobService(object):
+    MAX_CHUNK_GET_SIZE = 4096
+
+    def __init__(self, account_name, account_key, endpoint_suffix=None):
+        self.account_name = account_name
+        self.blob = None
+
+    def create_blob(self, container, blob_name, byte_size):
+        if self.account_name == 'broken-account':
+            raise Exception('no such account')
+        self.blob = bytearray(byte_size)
+
+    def update_page(self, container, blob_name, data, start, end):
+        if self.account_name == 'failing-account':
+            raise Exception('server busy')
+        self.blob[start:end + 1] = data
+
+
+class TestFanoutUpload:
+    def setup(self):
+        with patch(
+            'azurectl.storage.fanout_upload.PageBlobService', FakeBlobService
+        ):
+            self.targets = [
+                FanoutTarget('account', 'key', 'core.windows.net', 'images'),
+                FanoutTarget('other', 'key', 'core.windows.net', 'images')
+            ]
+        self.data = bytearray(10240)
+        self.data[0:512] = b'a' * 512
+        self.data[9216:9728] = b'b' * 512
+        self.fanout_upload = FanoutUpload(self.targets, 'blob', 10240)
+        self.progress_callback = mock.Mock()
+
+    def test_chunk_size(self):
+        assert self.fanout_upload.chunk_size(1024) == 1024
+        assert self.fanout_upload.chunk_size() == 4 * 1024 * 1024
+
+    def test_upload(self):
+        self.fanout_upload.upload(
+            io.BytesIO(self.data), self.progress_callback, 4096
+        )
+        for target in self.targets:
+            assert target.blob_service.blob == self.data
+        assert self.progress_callback.call_count == 4
+        assert self.progress_callback.call_args[0][0] == {
+            'account/images': {
+                'current_bytes': 10240, 'skipped_bytes': 9216,
+                'retries': 0, 'hedged_writes': 0, 'error': None
+            },
+            'other/images': {
+                'current_bytes': 10240, 'skipped_bytes': 9216,
+                'retries': 0, 'hedged_writes': 0, 'error': None
+            }
+        }
+        assert self.fanout_upload.failed_targets() == []
+
+    def test_upload_read(self):
+        data_stream = mock.Mock(spec=['read'])
+        data_stream.read.side_effect = [bytes(self.data), b'']
+        self.fanout_upload.upload(
+            data_stream, self.progress_callback, 10240
+        )
+        data_stream.read.assert_called_with(0)
+        for target in self.targets:
+            assert target.blob_service.blob == self.data
+
+    @patch('azurectl.storage.fanout_upload.log.warning')
+    @patch('azurectl.storage.page_blob.time.sleep')
+    def test_upload_target_fails(self, mock_sleep, mock_warning):
+        with patch(
+            'azurectl.storage.fanout_upload.PageBlobService', FakeBlobService
+        ):
+            self.targets.append(
+                FanoutTarget(
+                    'failing-account', 'key', 'core.windows.net', 'images'
+                )
+            )
+            self.targets.append(
+                FanoutTarget(
+                    'broken-account', 'key', 'core.windows.net', 'images'
+                )
+            )
+        self.fanout_upload.upload(
+            io.BytesIO(self.data), self.progress_callback, 4096,
+            max_attempts=2, max_threads=2
+        )
+        for target in self.targets[:2]:
+            assert target.blob_service.blob == self.data
+        assert self.fanout_upload.failed_targets() == self.targets[2:]
+        status = self.progress_callback.call_args[0][0]
+        assert status['account/images']['current_bytes'] == 10240
+        assert 'server busy' in status['failing-account/images']['error']
+        assert status['failing-account/images']['retries'] == 1
+        assert status['broken-account/images']['error'].startswith(
+            'AzurePageBlobSetupError'
+        )
+        assert status['broken-account/images']['skipped_bytes'] == 0
+        assert mock_warning.call_count == 2
+
+    @patch('azurectl.storage.fanout_upload.log.warning')
+    def test_upload_all_targets_fail(self, mock_warning):
+        for target in self.targets:
+            target.blob_service.account_name = 'broken-account'
+        data_stream = mock.Mock()
+        self.fanout_upload.upload(data_stream, self.progress_callback)
+        assert not data_stream.readinto.called
+        assert self.fanout_upload.active_targets() == []
+
+    def test_upload_extent_stream(self):
+        page_index = mock.Mock()
+        data_stream = ExtentStream(
+            io.BytesIO(self.data), [[0, 512], [9216, 9728]], 10240
+        )
+        self.fanout_upload.upload(
+            data_stream, self.progress_callback, 4096,
+            page_index=page_index
+        )
+        for target in self.targets:
+            assert target.blob_service.blob == self.data
+            assert target.status()['skipped_bytes'] == 9216
+        assert page_index.add.call_args_list == [
+            mock.call(0, 512), mock.call(9216, 9728)
+        ]
+
+    @patch('azurectl.storage.fanout_upload.HedgePolicy')
+    @patch('azurectl.storage.fanout_upload.UploadController')
+    @patch('azurectl.storage.fanout_upload.PageBlob')
+    def test_upload_auto_tune_hedge(
+        self, mock_page_blob, mock_controller, mock_hedge_policy
+    ):
+        page_blob = mock_page_blob.return_value
+        page_blob.write.return_value = 10240
+        page_blob.page_start = 10240
+        mock_hedge_policy.return_value.hedged = 2
+        telemetry = mock.Mock()
+        self.fanout_upload.upload(
+            io.BytesIO(self.data), self.progress_callback, 10240,
+            max_attempts=3, max_threads=4, auto_tune=True, retry_budget=10,
+            hedge=True, telemetry=telemetry
+        )
+        mock_controller.assert_called_with(10240, 4)
+        call_args = mock_page_blob.call_args
+        assert call_args[0][4] == 4
+        assert call_args[1]['controller'] == mock_controller.return_value
+        assert call_args[1]['hedge_policy'] == mock_hedge_policy.return_value
+        assert call_args[1]['retry_policy'].retry_budget == 10
+        assert call_args[1]['telemetry'] == telemetry
+        assert page_blob.write.call_args[0][1:] == (10240, 3, [[0, 9728]])
+        assert self.progress_callback.call_args[0][0][
+            'other/images'
+        ]['hedged_writes'] == 2
+
+    @patch('azurectl.storage.fanout_upload.PageBlob')
+    def test_upload_rate_limiter(self, mock_page_blob):
+        mock_page_blob.return_value.write.return_value = 10240
+        mock_page_blob.return_value.page_start = 10240
+        rate_limiter = mock.Mock()
+        self.fanout_upload.upload(
+            io.BytesIO(self.data), self.progress_callback,
+            rate_limiter=rate_limiter
+        )
+        for call_args in mock_page_blob.call_args_list:
+            assert call_args[1]['rate_limiter'] == rate_limiter
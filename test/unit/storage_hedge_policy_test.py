@@ -0,0 +1,41 @@
+from .test_helper import argv_kiwi_tests
+
+import mock
+from azurectl.storage.hedge_policy import HedgePolicy
+
+
+class TestHedgePolicy:
+    def setup(self):
+        self.blob_service = mock.Mock()
+        self.hedge_policy = HedgePolicy(self.blob_service)
+
+    def test_threshold_not_enough_samples(self):
+        for latency in range(HedgePolicy.MIN_SAMPLES - 1):
+            self.hedge_policy.record(latency)
+        assert self.hedge_policy.threshold() is None
+
+    def test_threshold(self):
+        for latency in range(100):
+            self.hedge_policy.record(latency)
+        assert self.hedge_policy.threshold() == 95
+
+    def test_threshold_window(self):
+        for latency in range(HedgePolicy.WINDOW_SIZE):
+            self.hedge_policy.record(1000)
+        for latency in range(HedgePolicy.WINDOW_SIZE):
+            self.hedge_policy.record(1)
+        assert self.hedge_policy.threshold() == 1
+
+    def test_threshold_max_percentile(self):
+        hedge_policy = HedgePolicy(self.blob_service, percentile=100)
+        for latency in range(HedgePolicy.MIN_SAMPLES):
+            hedge_policy.record(latency)
+        assert hedge_policy.threshold() == HedgePolicy.MIN_SAMPLES - 1
+
+    def test_counters(self):
+        self.hedge_policy.hedge_started()
+        self.hedge_policy.hedge_started()
+        self.hedge_policy.hedge_won()
+        assert self.hedge_policy.hedged == 2
+        assert self.hedge_policy.hedges_won == 1
+        assert self.hedge_policy.blob_service == self.blob_service
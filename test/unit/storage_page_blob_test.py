@@ -1,35 +1,34 @@
 from .test_helper import argv_kiwi_tests
 
+import hashlib
+import itertools
 import sys
+import threading
 import mock
+from azure.common import AzureMissingResourceHttpError
+from azure.storage._http import HTTPResponse
+from azure.storage.blob.pageblobservice import PageBlobService
 from mock import patch
 from mock import call
 from pytest import raises
 from azurectl.storage.page_blob import PageBlob
+from azurectl.storage.page_manifest import PageManifest
+from azurectl.storage.retry_policy import RetryPolicy
 import azurectl
 
 from azurectl.azurectl_exceptions import (
     AzurePageBlobAlignmentViolation,
     AzurePageBlobSetupError,
-    AzurePageBlobUpdateError,
-    AzurePageBlobZeroPageError
+    AzurePageBlobUpdateError
 )
 
 
 class TestPageBlob:
     def setup(self):
-        self.data_stream = mock.MagicMock()
+        self.data_stream = mock.MagicMock(spec=['read'])
         self.blob_service = mock.Mock()
         self.blob_service.MAX_CHUNK_GET_SIZE = 4096
 
-        self.context_manager_mock = mock.Mock()
-        self.file_mock = mock.Mock()
-        self.enter_mock = mock.Mock()
-        self.exit_mock = mock.Mock()
-        self.enter_mock.return_value = self.file_mock
-        setattr(self.context_manager_mock, '__enter__', self.enter_mock)
-        setattr(self.context_manager_mock, '__exit__', self.exit_mock)
-
         self.page_blob = PageBlob(
             self.blob_service, 'blob-name', 'container-name', 1024
         )
@@ -50,41 +49,136 @@ class TestPageBlob:
         with raises(AzurePageBlobAlignmentViolation):
             PageBlob(self.blob_service, 'blob-name', 'container-name', 12)
 
-    @patch('builtins.open')
-    def test_zero_page_read_failed(self, mock_open):
-        mock_open.side_effect = Exception
-        with raises(AzurePageBlobZeroPageError):
-            self.page_blob.next(self.data_stream)
-
-    @patch('builtins.open')
-    def test_zero_page_for_max_chunk_size(self, mock_open):
-        self.page_blob.rest_bytes = self.blob_service.MAX_CHUNK_GET_SIZE
-        mock_open.return_value = self.context_manager_mock
+    def test_read_chunk_size(self):
+        self.data_stream.read.return_value = bytes(512)
+        self.page_blob.rest_bytes = 42
         self.page_blob.next(self.data_stream)
-        self.file_mock.read.assert_called_once_with(
+        self.data_stream.read.assert_called_once_with(42)
+        self.page_blob.rest_bytes = 8192
+        self.page_blob.next(self.data_stream)
+        self.data_stream.read.assert_called_with(
             self.blob_service.MAX_CHUNK_GET_SIZE
         )
 
-    @patch('builtins.open')
-    def test_zero_page_for_chunk(self, mock_open):
-        self.page_blob.rest_bytes = 42
-        mock_open.return_value = self.context_manager_mock
+    def test_readinto_data_stream(self):
+        data = [bytes(512) + b'x' * 512, b'y' * 512]
+
+        def readinto(buffer):
+            chunk = data.pop(0)
+            buffer[:len(chunk)] = chunk
+            return len(chunk)
+
+        data_stream = mock.Mock(spec=['readinto'])
+        data_stream.readinto.side_effect = readinto
+        self.page_blob.rest_bytes = 4096
+        assert self.page_blob.next(data_stream) == 1024
+        read_buffer = self.page_blob.read_buffer
+        assert len(read_buffer) == 4096
+        assert self.page_blob.next(data_stream) == 1536
+        assert self.page_blob.read_buffer is read_buffer
+        assert self.blob_service.update_page.call_args_list == [
+            call('container-name', 'blob-name', b'x' * 512, 512, 1023),
+            call('container-name', 'blob-name', b'y' * 512, 1024, 1535)
+        ]
+        assert self.page_blob.zero_bytes_skipped == 512
+
+    def test_zero_chunk_skipped(self):
+        self.data_stream.read.return_value = bytes(1024)
+        assert self.page_blob.next(self.data_stream) == 1024
+        assert not self.blob_service.update_page.called
+        assert self.page_blob.zero_bytes_skipped == 1024
+
+    def test_zero_pages_skipped(self):
+        self.page_blob.zero_pages.max_zero_gap_size = 512
+        data = bytearray(4096)
+        data[0] = 1
+        data[1024] = 2
+        data[3584] = 3
+        data = bytes(data)
+        self.data_stream.read.return_value = data
+        self.page_blob.rest_bytes = 4096
         self.page_blob.next(self.data_stream)
-        self.file_mock.read.assert_called_once_with(42)
+        assert self.blob_service.update_page.call_args_list == [
+            call('container-name', 'blob-name', data[0:1536], 0, 1535),
+            call('container-name', 'blob-name', data[3584:], 3584, 4095)
+        ]
+        assert self.page_blob.zero_bytes_skipped == 2048
+
+    def test_budget(self):
+        budget = mock.Mock()
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 1024,
+            budget=budget
+        )
+        self.data_stream.read.return_value = b'a' * 1024
+        page_blob.next(self.data_stream)
+        budget.acquire.assert_called_once_with(1024)
+        budget.release.assert_called_once_with(1024)
 
-    def test_update_page(self):
-        self.data_stream.read.return_value = 'some-data'
+    def test_budget_threaded(self):
+        budget = mock.Mock()
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 1024,
+            max_in_flight=2, budget=budget
+        )
+        self.data_stream.read.return_value = b'a' * 1024
+        page_blob.next(self.data_stream)
+        page_blob.flush()
+        page_blob.close()
+        budget.acquire.assert_called_once_with(1024)
+        budget.release.assert_called_once_with(1024)
+
+    def test_rate_limiter(self):
+        rate_limiter = mock.Mock()
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 1024,
+            rate_limiter=rate_limiter
+        )
+        self.data_stream.read.return_value = b'a' * 1024
+        page_blob.next(self.data_stream)
+        rate_limiter.consume.assert_called_once_with(1024)
+
+    def test_page_index(self):
+        page_index = mock.Mock()
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 4096,
+            page_index=page_index
+        )
+        page_blob.zero_pages.max_zero_gap_size = 512
+        data = bytearray(2048)
+        data[0] = 1
+        data[1536] = 2
+        self.data_stream.read.return_value = bytes(data)
+        page_blob.next(self.data_stream)
+        page_blob.next(self.data_stream)
+        assert page_index.add.call_args_list == [
+            call(0, 512), call(1536, 2048), call(2048, 2560), call(3584, 4096)
+        ]
+
+    @patch('azurectl.storage.page_blob.time.time')
+    def test_update_page(self, mock_time):
+        mock_time.side_effect = itertools.count()
+        self.data_stream.read.return_value = b'some-data'
         self.page_blob.next(self.data_stream)
         self.blob_service.update_page.assert_called_once_with(
-            'container-name', 'blob-name', 'some-data', 0, 8
+            'container-name', 'blob-name', b'some-data', 0, 8
         )
+        stages = self.page_blob.telemetry.stages()
+        assert stages['read'] == 1
+        assert stages['zero_check'] == 1
+        assert stages['network'] == 1
 
-    def test_update_page_max_retries_reached(self):
+    @patch('azurectl.storage.page_blob.time.sleep')
+    def test_update_page_max_retries_reached(self, mock_sleep):
+        self.data_stream.read.return_value = b'some-data'
         self.blob_service.update_page.side_effect = Exception
         with raises(AzurePageBlobUpdateError):
             self.page_blob.next(self.data_stream)
 
-    def test_update_page_retried_two_times(self):
+    @patch('azurectl.storage.page_blob.time.sleep')
+    def test_update_page_retried_two_times(self, mock_sleep):
+        self.page_blob.retry_policy = mock.Mock()
+        self.page_blob.retry_policy.delay.return_value = 2
         retries = [True, False, False]
 
         def side_effect(container, blob, data, start, end):
@@ -92,10 +186,500 @@ class TestPageBlob:
                 raise Exception
 
         self.blob_service.update_page.side_effect = side_effect
+        self.data_stream.read.return_value = b'some-data'
         self.page_blob.next(self.data_stream)
         assert len(self.blob_service.update_page.call_args_list) == 3
+        assert self.page_blob.retry_policy.delay.call_args_list[1][0][1:] \
+            == (2, 5)
+        assert mock_sleep.call_args_list == [call(2), call(2)]
+
+    @patch('azurectl.storage.page_blob.time.sleep')
+    def test_update_page_retry_policy_gives_up(self, mock_sleep):
+        self.page_blob.retry_policy = RetryPolicy(retry_budget=0)
+        self.blob_service.update_page.side_effect = Exception
+        self.data_stream.read.return_value = b'some-data'
+        with raises(AzurePageBlobUpdateError):
+            self.page_blob.next(self.data_stream)
+        assert len(self.blob_service.update_page.call_args_list) == 1
+        assert not mock_sleep.called
+
+    def test_retry_replaces_blob_service_retry(self):
+        assert self.blob_service.retry == self.page_blob.retry_policy.retry
+
+    @patch('azurectl.storage.page_blob.time.sleep')
+    @patch('azurectl.storage.retry_policy.random.uniform')
+    def test_update_page_retry_after(self, mock_uniform, mock_sleep):
+        mock_uniform.return_value = 0.5
+        created = {
+            'etag': '"0x1"', 'last-modified': 'Thu, 01 Jan 2015 00:00:00 GMT'
+        }
+        blob_service = PageBlobService('account', 'a2V5')
+        blob_service._httpclient.perform_request = mock.Mock(
+            side_effect=[
+                HTTPResponse(201, 'Created', created, b''),
+                HTTPResponse(503, 'Server Busy', {'retry-after': '30'}, b''),
+                HTTPResponse(201, 'Created', created, b'')
+            ]
+        )
+        page_blob = PageBlob(blob_service, 'blob-name', 'container-name', 512)
+        self.data_stream.read.return_value = b'a' * 512
+        page_blob.next(self.data_stream)
+        assert len(blob_service._httpclient.perform_request.call_args_list) \
+            == 3
+        mock_sleep.assert_called_once_with(30)
+        assert page_blob.retry_policy.throttled == 1
 
     def test_next_page_update_no_data(self):
         self.data_stream.read.return_value = None
         with raises(StopIteration):
             self.page_blob.next(self.data_stream)
+
+    def test_update_page_threaded(self):
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 1024, 2
+        )
+        self.data_stream.read.side_effect = [
+            b'a' * 512, b'b' * 512, None
+        ]
+        with raises(StopIteration):
+            while True:
+                page_blob.next(self.data_stream, 512)
+        page_blob.close()
+        assert sorted(self.blob_service.update_page.call_args_list) == [
+            call('container-name', 'blob-name', b'a' * 512, 0, 511),
+            call('container-name', 'blob-name', b'b' * 512, 512, 1023)
+        ]
+        assert page_blob.bytes_in_flight == 0
+
+    def test_update_page_threaded_pending(self):
+        page_written = threading.Event()
+        self.blob_service.update_page.side_effect = \
+            lambda *args: page_written.wait()
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 1024, 2
+        )
+        self.data_stream.read.side_effect = [b'a' * 512, b'b' * 512]
+        assert page_blob.next(self.data_stream, 512) == 0
+        page_blob.next(self.data_stream, 512)
+        assert len(page_blob.pending_pages) == 2
+        page_written.set()
+        page_blob.close()
+
+    @patch('azurectl.storage.page_blob.time.sleep')
+    def test_controller(self, mock_sleep):
+        controller = mock.Mock()
+        controller.chunk_size = 512
+        controller.in_flight = 1
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 1024, 4,
+            controller=controller
+        )
+        assert page_blob._PageBlob__max_pages_in_flight() == 1
+        controller.in_flight = 8
+        assert page_blob._PageBlob__max_pages_in_flight() == 4
+        self.blob_service.update_page.side_effect = [Exception, None, None]
+        self.data_stream.read.side_effect = [b'a' * 512, b'b' * 512, b'']
+        with raises(StopIteration):
+            while True:
+                page_blob.next(self.data_stream, 4096)
+        page_blob.close()
+        assert self.data_stream.read.call_args_list == [
+            call(512), call(512), call(0)
+        ]
+        assert controller.page_started.call_count == 2
+        done = sorted(
+            (args[0], args[2]) for args, kwargs in
+            controller.page_done.call_args_list
+        )
+        assert done == [(512, 0), (512, 1)]
+
+    def test_controller_limits_pages_in_flight(self):
+        controller = mock.Mock()
+        controller.chunk_size = 512
+        controller.in_flight = 1
+        page_written = threading.Event()
+        self.blob_service.update_page.side_effect = \
+            lambda *args: page_written.wait()
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 1024, 2,
+            controller=controller
+        )
+        self.data_stream.read.side_effect = [b'a' * 512, b'b' * 512]
+        page_blob.next(self.data_stream)
+        threading.Timer(0.1, page_written.set).start()
+        page_blob.next(self.data_stream)
+        assert page_written.is_set()
+        page_blob.close()
+
+    @patch('azurectl.storage.page_blob.time.sleep')
+    def test_controller_failed_write(self, mock_sleep):
+        controller = mock.Mock()
+        controller.chunk_size = 512
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 1024,
+            controller=controller
+        )
+        self.blob_service.update_page.side_effect = Exception
+        self.data_stream.read.return_value = b'a' * 512
+        with raises(AzurePageBlobUpdateError):
+            page_blob.next(self.data_stream, max_attempts=2)
+        assert controller.page_done.call_args[0][0] == 0
+        assert controller.page_done.call_args[0][2] == 2
+
+    @patch('azurectl.storage.page_blob.time.sleep')
+    def test_update_page_threaded_raises(self, mock_sleep):
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 1024, 2
+        )
+        self.blob_service.update_page.side_effect = Exception
+        self.data_stream.read.side_effect = [
+            b'a' * 512, b'b' * 512, None
+        ]
+        with raises(AzurePageBlobUpdateError):
+            while True:
+                page_blob.next(self.data_stream, 512)
+        page_blob.close()
+
+    def test_hedge_no_threshold(self):
+        hedge_policy = mock.Mock()
+        hedge_policy.threshold.return_value = None
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 1024,
+            hedge_policy=hedge_policy
+        )
+        self.data_stream.read.return_value = b'a' * 512
+        page_blob.next(self.data_stream)
+        page_blob.close()
+        assert self.blob_service.update_page.call_count == 1
+        assert not hedge_policy.hedge_started.called
+        assert hedge_policy.record.call_count == 1
+
+    def test_hedge_slow_write(self):
+        write_released = threading.Event()
+        self.blob_service.update_page.side_effect = \
+            lambda *args: write_released.wait()
+        hedge_policy = mock.Mock()
+        hedge_policy.threshold.return_value = 0.01
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 1024,
+            hedge_policy=hedge_policy
+        )
+        self.data_stream.read.return_value = b'a' * 512
+        page_blob.next(self.data_stream)
+        hedge_policy.blob_service.update_page.assert_called_once_with(
+            'container-name', 'blob-name', b'a' * 512, 0, 511
+        )
+        hedge_policy.hedge_started.assert_called_once_with()
+        hedge_policy.hedge_won.assert_called_once_with()
+        write_released.set()
+        page_blob.close()
+        assert self.blob_service.update_page.call_count == 1
+
+    def test_hedge_failed_write_wins(self):
+        write_released = threading.Event()
+
+        def update_page(*args):
+            write_released.wait()
+
+        self.blob_service.update_page.side_effect = update_page
+        hedge_policy = mock.Mock()
+        hedge_policy.threshold.return_value = 0.01
+
+        def hedge_update_page(*args):
+            write_released.set()
+            raise Exception
+
+        hedge_policy.blob_service.update_page.side_effect = hedge_update_page
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 1024,
+            hedge_policy=hedge_policy
+        )
+        self.data_stream.read.return_value = b'a' * 512
+        page_blob.next(self.data_stream)
+        page_blob.close()
+        hedge_policy.hedge_started.assert_called_once_with()
+        assert not hedge_policy.hedge_won.called
+
+    @patch('azurectl.storage.page_blob.time.sleep')
+    def test_hedge_all_writes_fail(self, mock_sleep):
+        write_released = threading.Event()
+
+        def update_page(*args):
+            write_released.wait()
+            raise Exception('write failed')
+
+        self.blob_service.update_page.side_effect = update_page
+        hedge_policy = mock.Mock()
+        hedge_policy.threshold.return_value = 0.01
+
+        def hedge_update_page(*args):
+            write_released.set()
+            raise Exception('hedge failed')
+
+        hedge_policy.blob_service.update_page.side_effect = hedge_update_page
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 1024,
+            hedge_policy=hedge_policy
+        )
+        self.data_stream.read.return_value = b'a' * 512
+        with raises(AzurePageBlobUpdateError) as error:
+            page_blob.next(self.data_stream, max_attempts=1)
+        page_blob.close()
+        assert 'write failed' in str(error.value)
+        assert not hedge_policy.record.called
+
+    def test_sparse_data_stream(self):
+        self.data_stream = mock.Mock(spec=['read', 'seek_data'])
+        self.data_stream.seek_data.return_value = 512
+        self.data_stream.read.return_value = b'some-data'
+        assert self.page_blob.next(self.data_stream) == 521
+        self.data_stream.read.assert_called_once_with(512)
+        self.blob_service.update_page.assert_called_once_with(
+            'container-name', 'blob-name', b'some-data', 512, 520
+        )
+        assert self.page_blob.zero_bytes_skipped == 512
+
+    def test_sparse_data_stream_trailing_hole(self):
+        self.data_stream = mock.Mock(spec=['read', 'seek_data'])
+        self.data_stream.seek_data.return_value = 4096
+        self.data_stream.read.return_value = b''
+        with raises(StopIteration):
+            self.page_blob.next(self.data_stream)
+        self.data_stream.read.assert_called_once_with(0)
+        assert self.page_blob.zero_bytes_skipped == 1024
+
+    def test_stripe(self):
+        self.blob_service.create_blob.reset_mock()
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 4096,
+            stripe=[1024, 3072]
+        )
+        assert not self.blob_service.create_blob.called
+        self.data_stream.read.return_value = b'x' * 2048
+        assert page_blob.next(self.data_stream) == 3072
+        self.data_stream.read.assert_called_once_with(2048)
+        self.blob_service.update_page.assert_called_once_with(
+            'container-name', 'blob-name', b'x' * 2048, 1024, 3071
+        )
+        self.data_stream.read.return_value = b''
+        with raises(StopIteration):
+            page_blob.next(self.data_stream)
+        self.data_stream.read.assert_called_with(0)
+
+    def test_journal_new_upload(self):
+        journal = mock.Mock()
+        journal.ranges = []
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 1024,
+            journal=journal
+        )
+        journal.reset.assert_called_once_with()
+        self.data_stream.read.return_value = b'some-data'
+        page_blob.next(self.data_stream)
+        journal.record.assert_called_once_with(0, 9)
+
+    def test_journal_resume(self):
+        journal = mock.Mock()
+        journal.ranges = [[0, 1024], [2048, 3072]]
+        self.blob_service.create_blob.reset_mock()
+        self.blob_service.get_blob_properties.return_value.properties. \
+            content_length = 4096
+        self.blob_service.get_page_ranges.return_value = [
+            mock.Mock(start=0, end=1023)
+        ]
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 4096,
+            journal=journal
+        )
+        assert not self.blob_service.create_blob.called
+        journal.resume.assert_called_once_with([[0, 1024]])
+        data = b'x' * 2048
+        self.data_stream.read.return_value = data
+        page_blob.next(self.data_stream, 2048)
+        self.blob_service.update_page.assert_called_once_with(
+            'container-name', 'blob-name', data[1024:], 1024, 2047
+        )
+        assert page_blob.resumed_bytes == 1024
+        assert page_blob.zero_bytes_skipped == 0
+
+    def test_journal_resume_across_chunks(self):
+        journal = mock.Mock()
+        journal.ranges = [[0, 1024], [2048, 3072]]
+        self.blob_service.get_blob_properties.return_value.properties. \
+            content_length = 4096
+        self.blob_service.get_page_ranges.return_value = [
+            mock.Mock(start=0, end=3071)
+        ]
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 4096,
+            journal=journal
+        )
+        self.data_stream.read.return_value = b'x' * 2048
+        page_blob.next(self.data_stream, 2048)
+        page_blob.next(self.data_stream, 2048)
+        assert page_blob.committed_ranges == [[2048, 3072]]
+        assert self.blob_service.update_page.call_args_list == [
+            call('container-name', 'blob-name', b'x' * 1024, 1024, 2047),
+            call('container-name', 'blob-name', b'x' * 1024, 3072, 4095)
+        ]
+
+    def test_journal_resume_blob_size_mismatch(self):
+        journal = mock.Mock()
+        journal.ranges = [[0, 1024]]
+        self.blob_service.create_blob.reset_mock()
+        self.blob_service.get_blob_properties.return_value.properties. \
+            content_length = 512
+        PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 1024,
+            journal=journal
+        )
+        self.blob_service.create_blob.assert_called_once_with(
+            'container-name', 'blob-name', 1024
+        )
+        journal.reset.assert_called_once_with()
+
+    def test_journal_resume_blob_missing(self):
+        journal = mock.Mock()
+        journal.ranges = [[0, 1024]]
+        self.blob_service.get_blob_properties.side_effect = \
+            AzureMissingResourceHttpError('not found', 404)
+        PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 1024,
+            journal=journal
+        )
+        journal.reset.assert_called_once_with()
+
+    def test_journal_resume_raises(self):
+        journal = mock.Mock()
+        journal.ranges = [[0, 1024]]
+        self.blob_service.get_blob_properties.side_effect = Exception
+        with raises(AzurePageBlobSetupError):
+            PageBlob(
+                self.blob_service, 'blob-name', 'container-name', 1024,
+                journal=journal
+            )
+
+    def __manifest(self, previous_hashes=None, block_size=1024):
+        manifest = PageManifest(mock.Mock(), 'container-name', 'blob-name', 4096)
+        manifest.block_size = block_size
+        manifest.hashes = [''] * (4096 // block_size)
+        if previous_hashes is not None:
+            manifest.previous_hashes = previous_hashes
+            manifest.etag = 'etag'
+        return manifest
+
+    def __hash(self, data):
+        return hashlib.sha1(data).hexdigest()
+
+    def test_manifest_new_blob(self):
+        manifest = self.__manifest()
+        self.blob_service.create_blob.reset_mock()
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 4096,
+            manifest=manifest
+        )
+        self.blob_service.create_blob.assert_called_once_with(
+            'container-name', 'blob-name', 4096
+        )
+        data = b'x' * 512 + bytes(1536) + b'y' * 1024 + bytes(1024)
+        self.data_stream.read.side_effect = [data[:2048], data[2048:]]
+        page_blob.next(self.data_stream, 3000)
+        self.data_stream.read.assert_called_once_with(2048)
+        page_blob.next(self.data_stream, 3000)
+        assert manifest.hashes == [
+            self.__hash(data[:1024]), '', self.__hash(data[2048:3072]), ''
+        ]
+
+    def test_manifest_delta(self):
+        old = b'a' * 1024
+        new = b'b' * 1024
+        manifest = self.__manifest(
+            [self.__hash(old), self.__hash(old), self.__hash(old), '']
+        )
+        self.blob_service.get_blob_properties.return_value.properties. \
+            content_length = 4096
+        self.blob_service.get_blob_properties.return_value.properties. \
+            etag = 'etag'
+        self.blob_service.create_blob.reset_mock()
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 4096,
+            manifest=manifest
+        )
+        assert not self.blob_service.create_blob.called
+        data = old + bytes(1024) + new + new
+        self.data_stream.read.return_value = data
+        page_blob.next(self.data_stream, 4096)
+        self.blob_service.update_page.assert_called_once_with(
+            'container-name', 'blob-name', new + new, 2048, 4095
+        )
+        self.blob_service.clear_page.assert_called_once_with(
+            'container-name', 'blob-name', 1024, 2047
+        )
+        assert page_blob.unchanged_bytes == 1024
+
+    def test_manifest_delta_blob_changed(self):
+        manifest = self.__manifest(['', '', '', ''])
+        self.blob_service.get_blob_properties.return_value.properties. \
+            content_length = 4096
+        self.blob_service.get_blob_properties.return_value.properties. \
+            etag = 'other-etag'
+        self.blob_service.create_blob.reset_mock()
+        PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 4096,
+            manifest=manifest
+        )
+        assert manifest.previous_hashes is None
+        self.blob_service.create_blob.assert_called_once_with(
+            'container-name', 'blob-name', 4096
+        )
+
+    def test_manifest_delta_blob_missing(self):
+        manifest = self.__manifest(['', '', '', ''])
+        self.blob_service.get_blob_properties.side_effect = \
+            AzureMissingResourceHttpError('not found', 404)
+        PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 4096,
+            manifest=manifest
+        )
+        assert manifest.previous_hashes is None
+
+    def test_manifest_delta_blob_properties_raises(self):
+        manifest = self.__manifest(['', '', '', ''])
+        self.blob_service.get_blob_properties.side_effect = Exception
+        with raises(AzurePageBlobSetupError):
+            PageBlob(
+                self.blob_service, 'blob-name', 'container-name', 4096,
+                manifest=manifest
+            )
+
+    def test_manifest_delta_hole(self):
+        data = b'a' * 1024
+        manifest = self.__manifest(
+            [self.__hash(data), '', self.__hash(data), self.__hash(data)]
+        )
+        self.blob_service.get_blob_properties.return_value.properties. \
+            content_length = 4096
+        self.blob_service.get_blob_properties.return_value.properties. \
+            etag = 'etag'
+        page_blob = PageBlob(
+            self.blob_service, 'blob-name', 'container-name', 4096,
+            manifest=manifest
+        )
+        data_stream = mock.Mock(spec=['read', 'seek_data'])
+        data_stream.seek_data.return_value = 3072
+        data_stream.read.return_value = data
+        page_blob.next(data_stream, 4096)
+        data_stream.seek_data.assert_called_once_with(1024)
+        assert self.blob_service.clear_page.call_args_list == [
+            call('container-name', 'blob-name', 0, 1023),
+            call('container-name', 'blob-name', 2048, 3071)
+        ]
+        assert not self.blob_service.update_page.called
+        assert page_blob.unchanged_bytes == 2048
+
+    def test_chunk_size(self):
+        assert self.page_blob.chunk_size() == 4096
+        assert self.page_blob.chunk_size('1024') == 1024
+        self.page_blob.read_alignment = 2048
+        assert self.page_blob.chunk_size(5000) == 4096
+        assert self.page_blob.chunk_size(1024) == 2048
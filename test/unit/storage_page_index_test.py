@@ -0,0 +1,127 @@
+from .test_helper import argv_kiwi_tests
+
+import io
+import os
+import mock
+from mock import patch
+from pytest import raises
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from azurectl.storage.page_index import PageIndex
+
+from azurectl.azurectl_exceptions import AzurePageIndexError
+
+
+class TestPageIndex:
+    def setup(self):
+        self.index_dir = mkdtemp()
+        self.page_index = PageIndex('../data/blob.raw', self.index_dir)
+
+    def teardown(self):
+        rmtree(self.index_dir)
+
+    def test_new_index(self):
+        assert self.page_index.cached is False
+        assert self.page_index.image_size is None
+        assert self.page_index.ranges() == []
+        assert self.page_index.key['source'] == \
+            os.path.abspath('../data/blob.raw')
+        assert self.page_index.key['size'] == 1024
+
+    @patch('azurectl.storage.page_index.Defaults.cache_directory')
+    def test_default_index_dir(self, mock_cache_directory):
+        mock_cache_directory.return_value = '/var/cache/azurectl'
+        page_index = PageIndex('../data/blob.raw')
+        assert page_index.filename.startswith(
+            '/var/cache/azurectl/page-index/'
+        )
+
+    def test_add(self):
+        self.page_index.add(0, 512)
+        self.page_index.add(512, 1024)
+        self.page_index.add(4096, 8192)
+        self.page_index.add(6144, 7168)
+        assert self.page_index.ranges() == [[0, 1024], [4096, 8192]]
+        assert self.page_index.non_zero_bytes() == 5120
+
+    def test_save_and_load(self):
+        self.page_index.add(0, 512)
+        self.page_index.add(4096, 8192)
+        self.page_index.save(10240)
+        page_index = PageIndex('../data/blob.raw', self.index_dir)
+        assert page_index.cached is True
+        assert page_index.image_size == 10240
+        assert page_index.ranges() == [[0, 512], [4096, 8192]]
+
+    def test_save_cuts_off_ranges_beyond_image(self):
+        self.page_index.add(0, 512)
+        self.page_index.add(1024, 2048)
+        self.page_index.add(4096, 4608)
+        self.page_index.save(1536)
+        assert self.page_index.ranges() == [[0, 512], [1024, 1536]]
+        page_index = PageIndex('../data/blob.raw', self.index_dir)
+        assert page_index.ranges() == [[0, 512], [1024, 1536]]
+
+    def test_load_other_source(self):
+        self.page_index.save(1024)
+        page_index = PageIndex('../data/blob.xz', self.index_dir)
+        assert page_index.cached is False
+
+    def test_load_other_member(self):
+        self.page_index.save(1024)
+        page_index = PageIndex(
+            '../data/blob.raw', self.index_dir, member='disk.raw'
+        )
+        assert page_index.key['member'] == 'disk.raw'
+        assert page_index.cached is False
+
+    def test_load_key_mismatch(self):
+        self.page_index.save(1024)
+        with open(self.page_index.filename, 'rb') as index_file:
+            content = index_file.read()
+        with open(self.page_index.filename, 'wb') as index_file:
+            index_file.write(content.replace(b'"inode"', b'"other"'))
+        assert PageIndex('../data/blob.raw', self.index_dir).cached is False
+
+    def test_load_corrupted(self):
+        self.page_index.add(0, 512)
+        self.page_index.save(1024)
+        with open(self.page_index.filename, 'ab') as index_file:
+            index_file.write(b'\x00')
+        assert PageIndex('../data/blob.raw', self.index_dir).cached is False
+
+    def test_load_odd_extents(self):
+        self.page_index.add(0, 512)
+        self.page_index.extents.append(1024)
+        self.page_index.save(1024)
+        assert PageIndex('../data/blob.raw', self.index_dir).cached is False
+
+    def test_save_raises(self):
+        self.page_index.index_dir = '/proc/no-such-dir'
+        with raises(AzurePageIndexError):
+            self.page_index.save(1024)
+
+    def test_scan(self):
+        data = bytearray(PageIndex.SCAN_CHUNK_SIZE + 4096)
+        data[512:1024] = b'a' * 512
+        data[-512:] = b'b' * 512
+        self.page_index.add(0, 10)
+        self.page_index.scan(io.BytesIO(data), len(data))
+        assert self.page_index.ranges() == [
+            [512, 1024], [len(data) - 512, len(data)]
+        ]
+        assert self.page_index.image_size == len(data)
+
+    def test_scan_image_size_from_data(self):
+        self.page_index.scan(io.BytesIO(b'a' * 1536))
+        assert self.page_index.image_size == 1536
+        assert self.page_index.ranges() == [[0, 1536]]
+
+    def test_scan_sparse(self):
+        data_stream = mock.Mock()
+        data_stream.seek_data.side_effect = [4096, 8192]
+        data_stream.readinto.side_effect = [512, 0]
+        self.page_index.scan(data_stream, 8192)
+        data_stream.seek_data.assert_called_with(512)
+        assert self.page_index.ranges() == []
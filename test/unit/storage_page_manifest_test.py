@@ -0,0 +1,99 @@
+from .test_helper import argv_kiwi_tests
+
+import hashlib
+import json
+import mock
+from pytest import raises
+from azure.common import AzureMissingResourceHttpError
+
+from azurectl.storage.page_manifest import PageManifest
+
+from azurectl.azurectl_exceptions import AzurePageManifestError
+
+
+class TestPageManifest:
+    def setup(self):
+        self.blob_service = mock.Mock()
+        self.manifest = PageManifest(
+            self.blob_service, 'container', 'blob', 3 * 1024 * 1024 + 512
+        )
+
+    def __stored_manifest(self, **kwargs):
+        manifest = {
+            'block_size': 1024 * 1024,
+            'byte_size': 3 * 1024 * 1024 + 512,
+            'etag': 'etag',
+            'hashes': ['a', 'b', '', 'c']
+        }
+        manifest.update(kwargs)
+        blob = mock.Mock()
+        blob.content = json.dumps(manifest).encode()
+        self.blob_service.get_blob_to_bytes.return_value = blob
+
+    def test_init(self):
+        assert self.manifest.hashes == ['', '', '', '']
+        assert self.manifest.manifest_name == 'blob.manifest'
+
+    def test_load(self):
+        self.__stored_manifest()
+        assert self.manifest.load() is True
+        self.blob_service.get_blob_to_bytes.assert_called_once_with(
+            'container', 'blob.manifest'
+        )
+        assert self.manifest.previous_hashes == ['a', 'b', '', 'c']
+        assert self.manifest.etag == 'etag'
+
+    def test_load_other_blob(self):
+        self.__stored_manifest()
+        assert self.manifest.load('base') is True
+        self.blob_service.get_blob_to_bytes.assert_called_once_with(
+            'container', 'base.manifest'
+        )
+
+    def test_load_layout_mismatch(self):
+        self.__stored_manifest(byte_size=512)
+        assert self.manifest.load() is False
+        assert self.manifest.previous_hashes is None
+
+    def test_load_missing(self):
+        self.blob_service.get_blob_to_bytes.side_effect = \
+            AzureMissingResourceHttpError('not found', 404)
+        assert self.manifest.load() is False
+
+    def test_load_raises(self):
+        self.blob_service.get_blob_to_bytes.side_effect = Exception
+        with raises(AzurePageManifestError):
+            self.manifest.load()
+
+    def test_update(self):
+        assert self.manifest.update(0, b'foo') is True
+        assert self.manifest.hashes[0] == hashlib.sha1(b'foo').hexdigest()
+        self.__stored_manifest()
+        self.manifest.load()
+        assert self.manifest.update(2, None) is False
+        assert self.manifest.update(3, None) is True
+
+    def test_discard_previous(self):
+        self.__stored_manifest()
+        self.manifest.load()
+        self.manifest.discard_previous()
+        assert self.manifest.previous_hashes is None
+        assert self.manifest.etag is None
+
+    def test_save(self):
+        self.manifest.update(1, b'foo')
+        self.manifest.save('new-etag')
+        container, name, data = \
+            self.blob_service.create_blob_from_bytes.call_args[0]
+        assert (container, name) == ('container', 'blob.manifest')
+        assert json.loads(data.decode()) == {
+            'block_size': 1024 * 1024,
+            'byte_size': 3 * 1024 * 1024 + 512,
+            'etag': 'new-etag',
+            'hashes': ['', hashlib.sha1(b'foo').hexdigest(), '', '']
+        }
+
+    def test_save_raises(self):
+        self.blob_service.create_blob_from_bytes.side_effect = Exception
+        with raises(AzurePageManifestError):
+            self.manifest.save('etag')
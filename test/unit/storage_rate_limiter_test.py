@@ -0,0 +1,77 @@
+from .test_helper import argv_kiwi_tests
+
+import mock
+from mock import patch
+
+from azurectl.storage.rate_limiter import RateLimiter
+
+
+class TestRateLimiter:
+    def setup(self):
+        with patch('time.time', return_value=100.0):
+            self.rate_limiter = RateLimiter(1024)
+
+    @patch('time.sleep')
+    @patch('time.time')
+    def test_consume_within_rate(self, mock_time, mock_sleep):
+        mock_time.return_value = 100.0
+        self.rate_limiter.consume(1024)
+        assert not mock_sleep.called
+        assert self.rate_limiter.tokens == 0
+        assert self.rate_limiter.delay_time == 0
+
+    @patch('time.sleep')
+    @patch('time.time')
+    def test_consume_waits_for_tokens(self, mock_time, mock_sleep):
+        mock_time.return_value = 100.0
+        self.rate_limiter.consume(1024)
+        self.rate_limiter.consume(512)
+        mock_sleep.assert_called_once_with(0.5)
+        mock_time.return_value = 101.0
+        self.rate_limiter.consume(1024)
+        mock_sleep.assert_called_with(0.5)
+        assert self.rate_limiter.delay_time == 1.0
+
+    @patch('time.sleep')
+    @patch('time.time')
+    def test_consume_bucket_limited_to_one_second(
+        self, mock_time, mock_sleep
+    ):
+        mock_time.return_value = 110.0
+        self.rate_limiter.consume(2048)
+        mock_sleep.assert_called_once_with(1.0)
+
+    @patch('time.sleep')
+    @patch('time.time')
+    def test_consume_shared(self, mock_time, mock_sleep):
+        share = mock.Mock()
+        share.participants.return_value = 4
+        mock_time.return_value = 100.0
+        rate_limiter = RateLimiter(1024, share)
+        rate_limiter.consume(256)
+        assert rate_limiter.rate == 256
+        assert not mock_sleep.called
+        share.participants.return_value = 2
+        mock_time.return_value = 101.0
+        rate_limiter.consume(256)
+        assert rate_limiter.rate == 256
+        assert share.participants.call_count == 1
+        mock_time.return_value = 102.0
+        rate_limiter.consume(512)
+        assert rate_limiter.rate == 512
+        assert share.participants.call_count == 2
+
+    @patch('time.time')
+    def test_consume_shared_rate_at_least_one(self, mock_time):
+        share = mock.Mock()
+        share.participants.return_value = 2048
+        mock_time.return_value = 100.0
+        rate_limiter = RateLimiter(1024, share)
+        rate_limiter.consume(0)
+        assert rate_limiter.rate == 1
+
+    def test_close(self):
+        self.rate_limiter.close()
+        share = mock.Mock()
+        RateLimiter(1024, share).close()
+        share.close.assert_called_once_with()
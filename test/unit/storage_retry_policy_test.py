@@ -0,0 +1,110 @@
+from .test_helper import argv_kiwi_tests
+
+import threading
+from azure.storage._http import HTTPResponse
+from azure.storage.models import RetryContext
+from mock import patch
+from azurectl.storage.retry_policy import RetryPolicy
+
+
+class TestRetryPolicy:
+    def setup(self):
+        self.retry_policy = RetryPolicy(retry_budget=3)
+
+    def __failed_request(self, status, headers=None):
+        context = RetryContext()
+        context.response = HTTPResponse(
+            status, 'failed', headers or {}, b''
+        )
+        assert self.retry_policy.retry(context) is None
+        return self.retry_policy.failed_response()
+
+    def test_retry(self):
+        response = self.__failed_request(503)
+        assert response.status == 503
+        assert self.retry_policy.failed_response() is None
+
+    def test_retry_no_response(self):
+        assert self.retry_policy.retry(RetryContext()) is None
+        assert self.retry_policy.failed_response() is None
+
+    def test_failed_response_per_thread(self):
+        context = RetryContext()
+        context.response = HTTPResponse(500, 'failed', {}, b'')
+        self.retry_policy.retry(context)
+        responses = []
+        thread = threading.Thread(
+            target=lambda: responses.append(
+                self.retry_policy.failed_response()
+            )
+        )
+        thread.start()
+        thread.join()
+        assert responses == [None]
+        assert self.retry_policy.failed_response() is context.response
+
+    @patch('azurectl.storage.retry_policy.random.uniform')
+    def test_delay_backoff(self, mock_uniform):
+        mock_uniform.side_effect = lambda low, high: high
+        assert self.retry_policy.delay(None, 1, 5) == 1
+        assert self.retry_policy.delay(None, 3, 5) == 4
+        mock_uniform.assert_called_with(0, 4)
+        assert self.retry_policy.retries == 2
+        assert self.retry_policy.throttled == 0
+
+    @patch('azurectl.storage.retry_policy.random.uniform')
+    def test_delay_max_delay(self, mock_uniform):
+        mock_uniform.side_effect = lambda low, high: high
+        retry_policy = RetryPolicy(max_delay=10)
+        assert retry_policy.delay(None, 8, 10) == 10
+
+    def test_delay_max_attempts(self):
+        assert self.retry_policy.delay(None, 5, 5) is None
+        assert self.retry_policy.retries == 0
+
+    def test_delay_retry_budget(self):
+        for attempt in range(3):
+            assert self.retry_policy.delay(None, 1, 5) is not None
+        assert self.retry_policy.delay(None, 1, 5) is None
+        assert self.retry_policy.retries == 3
+
+    def test_delay_no_retry_budget(self):
+        retry_policy = RetryPolicy()
+        for attempt in range(10):
+            assert retry_policy.delay(None, 1, 5) is not None
+
+    @patch('azurectl.storage.retry_policy.random.uniform')
+    def test_delay_server_busy(self, mock_uniform):
+        mock_uniform.return_value = 0.5
+        assert self.retry_policy.delay(
+            self.__failed_request(503), 1, 5
+        ) == RetryPolicy.THROTTLED_DELAY
+        assert self.retry_policy.throttled == 1
+
+    def test_delay_client_error(self):
+        assert self.retry_policy.delay(
+            self.__failed_request(404), 1, 5
+        ) is None
+        assert self.retry_policy.delay(
+            self.__failed_request(408), 1, 5
+        ) is not None
+
+    @patch('azurectl.storage.retry_policy.random.uniform')
+    def test_delay_retry_after(self, mock_uniform):
+        mock_uniform.return_value = 0.5
+        assert self.retry_policy.delay(
+            self.__failed_request(429, {'retry-after': '30'}), 1, 5
+        ) == 30
+        assert self.retry_policy.delay(
+            self.__failed_request(503, {'retry-after': '120'}), 1, 5
+        ) == 60
+
+    @patch('azurectl.storage.retry_policy.random.uniform')
+    def test_delay_retry_after_invalid(self, mock_uniform):
+        mock_uniform.return_value = 0.5
+        assert self.retry_policy.delay(
+            self.__failed_request(500, {'retry-after': 'soon'}), 1, 5
+        ) == RetryPolicy.THROTTLED_DELAY
+        assert self.retry_policy.delay(
+            self.__failed_request(200), 1, 5
+        ) == 0.5
@@ -1,6 +1,9 @@
 from .test_helper import argv_kiwi_tests
 
 import datetime
+import io
+import json
+import multiprocessing
 import os
 import sys
 import mock
@@ -8,11 +11,16 @@ from mock import patch
 from mock import call
 from urllib.parse import urlparse
 from pytest import raises
+from tempfile import NamedTemporaryFile
 from azurectl.storage.storage import Storage
+from azurectl.storage.upload_telemetry import UploadTelemetry
+from azurectl.utils.tarmember import TarMember
+from azurectl.utils.vhd import FixedVHD
 import azurectl
 from collections import namedtuple
 
 from azurectl.azurectl_exceptions import (
+    AzurePageIndexError,
     AzureStorageDeleteError,
     AzureStorageFileNotFound,
     AzureStorageStreamError,
@@ -45,6 +53,8 @@ class TestStorage:
             )
         )
         self.storage = Storage(account, 'some-container')
+        self.storage.READ_AHEAD_SIZE = 0
+        self.storage.PAGE_INDEX = False
 
     @patch('os.path.exists')
     def test_upload_storage_file_not_found(self, mock_exists):
@@ -52,16 +62,16 @@ class TestStorage:
         with raises(AzureStorageFileNotFound):
             self.storage.upload('some-blob', None)
 
-    @patch('azurectl.storage.storage.XZ.open')
+    @patch('azurectl.utils.xz.XZ.open')
     def test_upload_error_put_blob(self, mock_xz_open):
         mock_xz_open.side_effect = Exception
         with raises(AzureStorageStreamError):
             self.storage.upload('../data/blob.xz')
 
     @patch('azurectl.storage.storage.PageBlob')
-    @patch('azurectl.storage.storage.XZ.open')
+    @patch('azurectl.utils.xz.XZ.open')
     def test_upload_raises(self, mock_xz_open, mock_page_blob):
-        stream = mock.Mock
+        stream = mock.Mock()
         stream.close = mock.Mock()
         mock_xz_open.return_value = stream
         mock_page_blob.side_effect = Exception
@@ -69,13 +79,17 @@ class TestStorage:
             self.storage.upload('../data/blob.xz')
 
     @patch('azurectl.storage.storage.PageBlob')
-    @patch('azurectl.storage.storage.XZ.uncompressed_size')
-    @patch('azurectl.storage.storage.XZ.open')
+    @patch('azurectl.utils.xz.XZ.uncompressed_size')
+    @patch('azurectl.utils.xz.XZ.open')
     def test_upload(self, mock_xz_open, mock_uncompressed_size, mock_page_blob):
-        stream = mock.Mock
+        stream = mock.Mock()
         stream.close = mock.Mock()
+        stream.decompress_time = 1.5
         mock_xz_open.return_value = stream
         page_blob = mock.Mock()
+        page_blob.zero_bytes_skipped = 512
+        page_blob.unchanged_bytes = 0
+        page_blob.committed_ranges = []
         next_results = [3, 2, 1]
 
         def side_effect(stream, max_chunk_size, max_attempts):
@@ -88,8 +102,15 @@ class TestStorage:
         mock_page_blob.return_value = page_blob
         mock_uncompressed_size.return_value = 1024
 
-        self.storage.upload('../data/blob.xz')
+        self.storage.upload(
+            '../data/blob.xz', max_threads=8, decompress_threads=2
+        )
 
+        mock_xz_open.assert_called_once_with('../data/blob.xz', threads=2)
+        assert mock_page_blob.call_args[0][4] == 8
+        assert mock_page_blob.call_args[1]['telemetry'] == \
+            self.storage.telemetry
+        assert self.storage.telemetry.stages()['decompress'] == 1.5
         assert page_blob.next.call_args_list == [
             call(stream, None, 5),
             call(stream, None, 5),
@@ -97,17 +118,926 @@ class TestStorage:
             call(stream, None, 5)
         ]
         stream.close.assert_called_once_with()
+        page_blob.close.assert_called_once_with()
+        assert self.storage.upload_status == {
+            'current_bytes': 1024, 'total_bytes': 1024, 'skipped_bytes': 512,
+            'unchanged_bytes': 0, 'retries': 0,
+            'hedged_writes': 0
+        }
+
+    @patch('azurectl.storage.storage.PageBlobService')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.StripedUpload')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_striped(
+        self, mock_xz_open, mock_striped_upload, mock_page_blob,
+        mock_page_blob_service
+    ):
+        striped_upload = mock_striped_upload.return_value
+        striped_upload.stripes.return_value = [[0, 2], [2, 4]]
+
+        def upload(stripes, progress_callback, *args):
+            progress_callback(2, 1, 3, 4, {'network': 2.0})
+            assert self.storage.upload_status['current_bytes'] == 2
+            assert self.storage.upload_status['skipped_bytes'] == 1
+            assert self.storage.upload_status['retries'] == 3
+            assert self.storage.telemetry.stages()['network'] == 2.0
+
+        striped_upload.upload.side_effect = upload
+
+        self.storage.upload(
+            '../data/blob.xz', max_chunk_size=1024, max_threads=4,
+            decompress_threads=4, read_ahead_size=1024, max_processes='2',
+            auto_tune=True, retry_budget=10, hedge=True
+        )
+
+        mock_striped_upload.assert_called_once_with(
+            'mock-storage-name', 'bW9jay1zdG9yYWdlLWtleQ==',
+            'core.windows.net', 'some-container', 'blob',
+            '../data/blob.xz', 4, True
+        )
+        striped_upload.stripes.assert_called_once_with(2, 1024)
+        mock_page_blob.assert_called_once_with(
+            mock_page_blob_service.return_value, 'blob', 'some-container', 4
+        )
+        assert striped_upload.upload.call_args[0][2:] == (
+            1024, 5, 4, 2, 512, True, 5, True, None, False
+        )
+        assert not mock_xz_open.called
+        assert self.storage.upload_status == {
+            'current_bytes': 4, 'total_bytes': 4, 'skipped_bytes': 1,
+            'unchanged_bytes': 0, 'retries': 3,
+            'hedged_writes': 4
+        }
+
+    @patch('azurectl.storage.storage.PageBlobService')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.StripedUpload')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_striped_max_bandwidth(
+        self, mock_xz_open, mock_striped_upload, mock_page_blob,
+        mock_page_blob_service
+    ):
+        striped_upload = mock_striped_upload.return_value
+        striped_upload.stripes.return_value = [[0, 2], [2, 4]]
+        self.storage.upload(
+            '../data/blob.xz', max_processes='2', max_bandwidth='1000'
+        )
+        assert striped_upload.upload.call_args[0][-2:] == (500, False)
+        self.storage.upload(
+            '../data/blob.xz', max_processes='2', max_bandwidth='1000',
+            shared_bandwidth=True
+        )
+        assert striped_upload.upload.call_args[0][-2:] == ('1000', True)
+
+    @patch('azurectl.storage.storage.PageBlobService')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.UploadController')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_auto_tune(
+        self, mock_xz_open, mock_controller, mock_page_blob,
+        mock_page_blob_service
+    ):
+        mock_page_blob.return_value.committed_ranges = []
+        mock_page_blob.return_value.next.side_effect = StopIteration
+        self.storage.upload(
+            '../data/blob.xz', max_chunk_size=1024, max_threads=8,
+            auto_tune=True
+        )
+        mock_controller.assert_called_once_with(1024, 8)
+        assert mock_page_blob.call_args[1]['controller'] == \
+            mock_controller.return_value
+
+    @patch('azurectl.storage.storage.PageBlobService')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.RateLimiter')
+    @patch('azurectl.storage.storage.BandwidthShare')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_max_bandwidth(
+        self, mock_xz_open, mock_bandwidth_share, mock_rate_limiter,
+        mock_page_blob, mock_page_blob_service
+    ):
+        mock_page_blob.return_value.committed_ranges = []
+        mock_page_blob.return_value.next.side_effect = StopIteration
+        self.storage.upload('../data/blob.xz', max_bandwidth='1048576')
+        mock_rate_limiter.assert_called_once_with('1048576', None)
+        assert mock_page_blob.call_args[1]['rate_limiter'] == \
+            mock_rate_limiter.return_value
+        mock_rate_limiter.return_value.close.assert_called_once_with()
+        self.storage.upload(
+            '../data/blob.xz', max_bandwidth='1048576', shared_bandwidth=True
+        )
+        mock_rate_limiter.assert_called_with(
+            '1048576', mock_bandwidth_share.return_value
+        )
+
+    @patch('azurectl.storage.storage.PageBlobService')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.RateLimiter')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_rate_limiter(
+        self, mock_xz_open, mock_rate_limiter, mock_page_blob,
+        mock_page_blob_service
+    ):
+        mock_page_blob.return_value.committed_ranges = []
+        mock_page_blob.return_value.next.side_effect = StopIteration
+        rate_limiter = mock.Mock()
+        self.storage.upload(
+            '../data/blob.xz', max_bandwidth='1048576',
+            rate_limiter=rate_limiter
+        )
+        assert not mock_rate_limiter.called
+        assert mock_page_blob.call_args[1]['rate_limiter'] == rate_limiter
+        assert not rate_limiter.close.called
+
+    @patch('azurectl.storage.storage.PageBlobService')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.HedgePolicy')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_hedge(
+        self, mock_xz_open, mock_hedge_policy, mock_page_blob,
+        mock_page_blob_service
+    ):
+        mock_page_blob.return_value.committed_ranges = []
+        mock_page_blob.return_value.zero_bytes_skipped = 0
+        mock_page_blob.return_value.unchanged_bytes = 0
+        mock_page_blob.return_value.next.side_effect = [512, StopIteration]
+        mock_hedge_policy.return_value.hedged = 2
+        self.storage.upload('../data/blob.xz', hedge=True)
+        assert mock_page_blob_service.call_count == 2
+        mock_hedge_policy.assert_called_once_with(
+            mock_page_blob_service.return_value
+        )
+        assert mock_page_blob.call_args[1]['hedge_policy'] == \
+            mock_hedge_policy.return_value
+        assert self.storage.upload_status['hedged_writes'] == 2
+
+    @patch('azurectl.storage.storage.PageBlobService')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.StripedUpload')
+    def test_upload_striped_raises(
+        self, mock_striped_upload, mock_page_blob, mock_page_blob_service
+    ):
+        striped_upload = mock_striped_upload.return_value
+        striped_upload.stripes.return_value = [[0, 2], [2, 4]]
+        striped_upload.upload.side_effect = Exception
+        with raises(AzureStorageUploadError):
+            self.storage.upload('../data/blob.xz', max_processes=2)
+
+    @patch('azurectl.storage.storage.PageBlobService')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.StripedUpload')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_striped_single_stripe(
+        self, mock_xz_open, mock_striped_upload, mock_page_blob,
+        mock_page_blob_service
+    ):
+        mock_striped_upload.return_value.stripes.return_value = [[0, 4]]
+        mock_page_blob.return_value.committed_ranges = []
+        mock_page_blob.return_value.next.side_effect = StopIteration
+        self.storage.upload('../data/blob.xz', max_processes=2)
+        assert not mock_striped_upload.return_value.upload.called
+        mock_page_blob.return_value.next.assert_called_once_with(
+            mock_xz_open.return_value, None, 5
+        )
+
+    @patch('azurectl.storage.storage.PageBlobService')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.StripedUpload')
+    @patch('azurectl.storage.storage.UploadJournal')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_striped_resume(
+        self, mock_xz_open, mock_journal, mock_striped_upload,
+        mock_page_blob, mock_page_blob_service
+    ):
+        mock_page_blob.return_value.committed_ranges = []
+        mock_page_blob.return_value.next.side_effect = StopIteration
+        self.storage.upload('../data/blob.xz', resume=True, max_processes=2)
+        assert not mock_striped_upload.called
+
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.ReadAhead')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_read_ahead(
+        self, mock_xz_open, mock_read_ahead, mock_page_blob
+    ):
+        page_blob = mock.Mock()
+        page_blob.committed_ranges = []
+        page_blob.next.side_effect = StopIteration
+        mock_page_blob.return_value = page_blob
+        read_ahead = mock_read_ahead.return_value
+
+        self.storage.upload(
+            '../data/blob.xz', max_chunk_size=1024, read_ahead_size='4096'
+        )
+
+        page_blob.chunk_size.assert_called_once_with(1024)
+        mock_read_ahead.assert_called_once_with(
+            mock_xz_open.return_value, page_blob.chunk_size.return_value,
+            '4096', page_blob.read_alignment
+        )
+        page_blob.next.assert_called_once_with(read_ahead, 1024, 5)
+        read_ahead.close.assert_called_once_with()
+
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.ExtentStream')
+    @patch('azurectl.storage.storage.PageIndex')
+    @patch('azurectl.utils.xz.XZ.uncompressed_size')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_cached_page_index(
+        self, mock_xz_open, mock_uncompressed_size, mock_page_index,
+        mock_extent_stream, mock_page_blob
+    ):
+        self.storage.PAGE_INDEX = True
+        mock_uncompressed_size.return_value = 1024
+        page_index = mock_page_index.return_value
+        page_index.cached = True
+        page_index.image_size = 1024
+        page_blob = mock.Mock()
+        page_blob.committed_ranges = []
+        page_blob.next.side_effect = StopIteration
+        mock_page_blob.return_value = page_blob
+
+        self.storage.upload('../data/blob.xz')
+
+        mock_page_index.assert_called_once_with(
+            '../data/blob.xz', member=None
+        )
+        mock_extent_stream.assert_called_once_with(
+            mock_xz_open.return_value, page_index.ranges.return_value, 1024
+        )
+        page_blob.next.assert_called_once_with(
+            mock_extent_stream.return_value, None, 5
+        )
+        assert mock_page_blob.call_args[1]['page_index'] is None
+        assert not page_index.save.called
+        mock_extent_stream.return_value.close.assert_called_once_with()
+
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.PageIndex')
+    @patch('azurectl.utils.xz.XZ.uncompressed_size')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_saves_page_index(
+        self, mock_xz_open, mock_uncompressed_size, mock_page_index,
+        mock_page_blob
+    ):
+        self.storage.PAGE_INDEX = True
+        mock_uncompressed_size.return_value = 1024
+        page_index = mock_page_index.return_value
+        page_index.cached = True
+        page_index.image_size = 2048
+        page_blob = mock.Mock()
+        page_blob.committed_ranges = []
+        page_blob.next.side_effect = StopIteration
+        mock_page_blob.return_value = page_blob
+
+        self.storage.upload('../data/blob.xz')
 
+        assert mock_page_blob.call_args[1]['page_index'] == page_index
+        page_blob.next.assert_called_once_with(
+            mock_xz_open.return_value, None, 5
+        )
+        page_index.save.assert_called_once_with(1024)
+
+    @patch('azurectl.storage.storage.log.warning')
     @patch('azurectl.storage.storage.PageBlob')
-    @patch('builtins.open')
+    @patch('azurectl.storage.storage.PageIndex')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_page_index_not_saved(
+        self, mock_xz_open, mock_page_index, mock_page_blob, mock_warning
+    ):
+        self.storage.PAGE_INDEX = True
+        page_index = mock_page_index.return_value
+        page_index.cached = False
+        page_index.save.side_effect = AzurePageIndexError('read only')
+        page_blob = mock.Mock()
+        page_blob.committed_ranges = []
+        page_blob.next.side_effect = StopIteration
+        mock_page_blob.return_value = page_blob
+
+        self.storage.upload('../data/blob.xz')
+
+        mock_warning.assert_called_once_with(
+            'Page index not saved: %s', page_index.save.side_effect
+        )
+        assert self.storage.upload_status['current_bytes'] == \
+            self.storage.upload_status['total_bytes']
+
+    @patch('azurectl.storage.storage.FanoutUpload')
+    @patch('azurectl.storage.storage.FanoutTarget')
+    @patch('azurectl.utils.xz.XZ.uncompressed_size')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_targets(
+        self, mock_xz_open, mock_uncompressed_size, mock_fanout_target,
+        mock_fanout_upload
+    ):
+        mock_uncompressed_size.return_value = 1024
+        stream = mock_xz_open.return_value
+        stream.decompress_time = 0.5
+        fanout_upload = mock_fanout_upload.return_value
+        fanout_upload.failed_targets.return_value = []
+        target_status = {
+            'mock-storage-name/some-container': {
+                'current_bytes': 1024, 'skipped_bytes': 512,
+                'retries': 1, 'hedged_writes': 0, 'error': None
+            },
+            'other/images': {
+                'current_bytes': 512, 'skipped_bytes': 512,
+                'retries': 2, 'hedged_writes': 1, 'error': None
+            },
+            'failed/images': {
+                'current_bytes': 0, 'skipped_bytes': 0,
+                'retries': 5, 'hedged_writes': 0, 'error': 'Exception: busy'
+            }
+        }
+
+        def upload(data_stream, progress_callback, *args):
+            progress_callback(target_status)
+
+        fanout_upload.upload.side_effect = upload
+
+        self.storage.upload(
+            '../data/blob.xz', 'blob', max_chunk_size=1024, max_threads=2,
+            targets=[['other', 'images'], ['failed', 'images']],
+            max_processes=2
+        )
+
+        assert mock_fanout_target.call_args_list == [
+            call(
+                'mock-storage-name', 'bW9jay1zdG9yYWdlLWtleQ==',
+                'core.windows.net', 'some-container'
+            ),
+            call(
+                'other', self.storage.account.storage_key.return_value,
+                'core.windows.net', 'images'
+            ),
+            call(
+                'failed', self.storage.account.storage_key.return_value,
+                'core.windows.net', 'images'
+            )
+        ]
+        self.storage.account.storage_key.assert_called_with('failed')
+        mock_fanout_upload.assert_called_once_with(
+            [mock_fanout_target.return_value] * 3, 'blob', 1024
+        )
+        assert fanout_upload.upload.call_args[0][0] == stream
+        assert fanout_upload.upload.call_args[0][2:] == (
+            1024, 5, 2, False, 1000, False, self.storage.telemetry, None,
+            None
+        )
+        stream.close.assert_called_once_with()
+        assert self.storage.upload_status == {
+            'current_bytes': 512, 'total_bytes': 1024, 'skipped_bytes': 512,
+            'unchanged_bytes': 0, 'retries': 8, 'hedged_writes': 1
+        }
+        assert self.storage.telemetry.stages()['decompress'] == 0.5
+        assert self.storage.upload_summary()['targets'] == target_status
+
+    @patch('azurectl.storage.storage.FanoutUpload')
+    @patch('azurectl.storage.storage.FanoutTarget')
+    @patch('azurectl.utils.xz.XZ.uncompressed_size')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_targets_all_failed(
+        self, mock_xz_open, mock_uncompressed_size, mock_fanout_target,
+        mock_fanout_upload
+    ):
+        mock_uncompressed_size.return_value = 1024
+        target_status = {
+            'mock-storage-name/some-container': {
+                'current_bytes': 512, 'skipped_bytes': 0,
+                'retries': 5, 'hedged_writes': 0, 'error': 'Exception: busy'
+            }
+        }
+        failed_target = mock.Mock()
+        failed_target.name = 'mock-storage-name/some-container'
+        failed_target.error = 'Exception: busy'
+        fanout_upload = mock_fanout_upload.return_value
+        fanout_upload.failed_targets.return_value = [failed_target]
+        fanout_upload.upload.side_effect = \
+            lambda data_stream, progress_callback, *args: \
+            progress_callback(target_status)
+        with raises(AzureStorageUploadError) as issue:
+            self.storage.upload(
+                '../data/blob.xz', targets=[['other', 'images']]
+            )
+        assert 'Upload to 1 of 2 targets failed: ' \
+            'mock-storage-name/some-container: Exception: busy' in \
+            format(issue.value)
+        assert self.storage.upload_status['current_bytes'] == 512
+
+    @patch('azurectl.storage.storage.ReadAhead')
+    @patch('azurectl.storage.storage.PageIndex')
+    @patch('azurectl.storage.storage.FanoutUpload')
+    @patch('azurectl.storage.storage.FanoutTarget')
+    @patch('azurectl.utils.xz.XZ.uncompressed_size')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_targets_page_index_read_ahead(
+        self, mock_xz_open, mock_uncompressed_size, mock_fanout_target,
+        mock_fanout_upload, mock_page_index, mock_read_ahead
+    ):
+        self.storage.PAGE_INDEX = True
+        mock_uncompressed_size.return_value = 1024
+        mock_page_index.return_value.cached = False
+        fanout_upload = mock_fanout_upload.return_value
+        fanout_upload.failed_targets.return_value = []
+        self.storage.upload(
+            '../data/blob.xz', targets=[['other', 'images']],
+            read_ahead_size=4096
+        )
+        mock_read_ahead.assert_called_once_with(
+            mock_xz_open.return_value,
+            fanout_upload.chunk_size.return_value, 4096,
+            mock_fanout_upload.PAGE_SIZE
+        )
+        assert fanout_upload.upload.call_args[0][0] == \
+            mock_read_ahead.return_value
+        assert fanout_upload.upload.call_args[0][-2] == \
+            mock_page_index.return_value
+        mock_page_index.return_value.save.assert_called_once_with(1024)
+        mock_read_ahead.return_value.close.assert_called_once_with()
+
+    @patch('azurectl.storage.storage.FanoutUpload')
+    @patch('azurectl.storage.storage.FanoutTarget')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_targets_raises(
+        self, mock_xz_open, mock_fanout_target, mock_fanout_upload
+    ):
+        mock_fanout_upload.return_value.upload.side_effect = Exception
+        with raises(AzureStorageUploadError):
+            self.storage.upload(
+                '../data/blob.xz', targets=[['other', 'images']]
+            )
+        mock_xz_open.return_value.close.assert_called_once_with()
+
+    @patch('azurectl.storage.storage.FanoutTarget')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_targets_stream_error(
+        self, mock_xz_open, mock_fanout_target
+    ):
+        mock_xz_open.side_effect = Exception
+        with raises(AzureStorageStreamError):
+            self.storage.upload(
+                '../data/blob.xz', targets=[['other', 'images']]
+            )
+
+    @patch('azurectl.storage.storage.RateLimiter')
+    @patch('azurectl.storage.storage.FanoutUpload')
+    @patch('azurectl.storage.storage.FanoutTarget')
+    @patch('azurectl.utils.xz.XZ.uncompressed_size')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_targets_max_bandwidth(
+        self, mock_xz_open, mock_uncompressed_size, mock_fanout_target,
+        mock_fanout_upload, mock_rate_limiter
+    ):
+        mock_uncompressed_size.return_value = 1024
+        mock_fanout_upload.return_value.failed_targets.return_value = []
+        self.storage.upload(
+            '../data/blob.xz', targets=[['other', 'images']],
+            max_bandwidth='1048576'
+        )
+        mock_rate_limiter.assert_called_once_with('1048576', None)
+        assert mock_fanout_upload.return_value.upload.call_args[0][-1] == \
+            mock_rate_limiter.return_value
+        mock_rate_limiter.return_value.close.assert_called_once_with()
+
+    def test_upload_targets_resume(self):
+        with raises(AzureStorageUploadError):
+            self.storage.upload(
+                '../data/blob.xz', targets=[['other', 'images']],
+                resume=True
+            )
+
+    @patch('azurectl.storage.storage.UploadBudget')
+    def test_upload_batch(self, mock_budget):
+        uploads = []
+
+        def upload(storage, image, name, *args, **kwargs):
+            uploads.append((storage, image, name, args, kwargs))
+            storage.upload_status['current_bytes'] = 1024
+            storage.upload_status['total_bytes'] = 1024
+            storage.upload_status['retries'] = 1
+            storage.telemetry.add('network', 2.0)
+
+        with patch.object(Storage, 'upload', autospec=True) as mock_upload:
+            mock_upload.side_effect = upload
+            self.storage.upload_batch(
+                [['../data/blob.raw', None], ['../data/blob.raw', 'copy']],
+                max_parallel=4, max_in_flight_bytes='1048576',
+                max_chunk_size=1024, max_threads=8, decompress_threads=4,
+                read_ahead_size=4096, retry_budget=10
+            )
+
+        mock_budget.assert_called_once_with(8, '1048576')
+        assert sorted(upload[2] for upload in uploads) == ['blob.raw', 'copy']
+        for storage, image, name, args, kwargs in uploads:
+            assert storage is not self.storage
+            assert image == '../data/blob.raw'
+            assert args == (1024, 5, 8, 2)
+            assert kwargs == {
+                'read_ahead_size': 2048, 'auto_tune': False,
+                'retry_budget': 10, 'hedge': False,
+                'budget': mock_budget.return_value, 'rate_limiter': None
+            }
+        assert uploads[0][0] is not uploads[1][0]
+        assert self.storage.upload_status == {
+            'current_bytes': 2048, 'total_bytes': 2048, 'skipped_bytes': 0,
+            'unchanged_bytes': 0, 'retries': 2, 'hedged_writes': 0
+        }
+        summary = self.storage.upload_summary()
+        assert summary['stage_seconds']['network'] == 4.0
+        assert summary['images']['copy']['source'] == '../data/blob.raw'
+        assert summary['images']['copy']['current_bytes'] == 1024
+        assert summary['images']['copy']['error'] is None
+
+    @patch('azurectl.storage.storage.RateLimiter')
+    @patch('azurectl.storage.storage.BandwidthShare')
+    def test_upload_batch_max_bandwidth(
+        self, mock_bandwidth_share, mock_rate_limiter
+    ):
+        with patch.object(Storage, 'upload', autospec=True) as mock_upload:
+            self.storage.upload_batch(
+                [['../data/blob.raw', None], ['../data/blob.raw', 'copy']],
+                max_bandwidth='1048576', shared_bandwidth=True
+            )
+        mock_rate_limiter.assert_called_once_with(
+            '1048576', mock_bandwidth_share.return_value
+        )
+        for call_args in mock_upload.call_args_list:
+            assert call_args[1]['rate_limiter'] == \
+                mock_rate_limiter.return_value
+        mock_rate_limiter.return_value.close.assert_called_once_with()
+
+    def test_upload_batch_failed_image(self):
+        def upload(storage, image, name, *args, **kwargs):
+            if name == 'broken':
+                raise AzureStorageUploadError('server busy')
+            storage.upload_status['current_bytes'] = 1024
+
+        with patch.object(Storage, 'upload', autospec=True) as mock_upload:
+            mock_upload.side_effect = upload
+            with raises(AzureStorageUploadError) as issue:
+                self.storage.upload_batch(
+                    [['../data/blob.raw', 'broken'], ['../data/blob.raw', None]]
+                )
+        assert mock_upload.call_count == 2
+        assert 'Upload of 1 of 2 images failed: ' \
+            '../data/blob.raw: AzureStorageUploadError: ' in \
+            format(issue.value)
+        summary = self.storage.upload_summary()
+        assert summary['images']['broken']['error'].startswith(
+            'AzureStorageUploadError: '
+        )
+        assert summary['images']['blob.raw']['current_bytes'] == 1024
+
+    def test_upload_batch_file_not_found(self):
+        with raises(AzureStorageFileNotFound):
+            self.storage.upload_batch([['../data/no-such-image', None]])
+
+    def test_upload_batch_duplicate_blob_name(self):
+        with raises(AzureStorageUploadError):
+            self.storage.upload_batch(
+                [['../data/blob.raw', 'blob'], ['../data/blob.xz', 'blob']]
+            )
+
+    @patch('os.path.exists')
+    def test_scan_file_not_found(self, mock_exists):
+        mock_exists.return_value = False
+        with raises(AzureStorageFileNotFound):
+            self.storage.scan('some-image')
+
+    @patch('azurectl.storage.storage.PageIndex')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_scan_cached(self, mock_xz_open, mock_page_index):
+        page_index = mock_page_index.return_value
+        page_index.cached = True
+        page_index.image_size = 1024
+        page_index.non_zero_bytes.return_value = 512
+        page_index.extents = [0, 256, 512, 768]
+        page_index.filename = 'index-file'
+        assert self.storage.scan('../data/blob.raw') == {
+            'image_size': 1024,
+            'non_zero_bytes': 512,
+            'zero_bytes': 512,
+            'extents': 2,
+            'cached': True,
+            'page_index': 'index-file'
+        }
+        assert not mock_xz_open.called
+        assert not page_index.scan.called
+
+    @patch('azurectl.storage.storage.PageIndex')
+    @patch('azurectl.utils.xz.XZ.uncompressed_size')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_scan(
+        self, mock_xz_open, mock_uncompressed_size, mock_page_index
+    ):
+        mock_uncompressed_size.return_value = 4096
+        page_index = mock_page_index.return_value
+        page_index.cached = False
+        page_index.non_zero_bytes.return_value = 1024
+        page_index.extents = [0, 1024]
+        result = self.storage.scan('../data/blob.xz', decompress_threads=2)
+        mock_xz_open.assert_called_once_with('../data/blob.xz', threads=2)
+        page_index.scan.assert_called_once_with(
+            mock_xz_open.return_value, 4096
+        )
+        mock_xz_open.return_value.close.assert_called_once_with()
+        page_index.save.assert_called_once_with(4096)
+        assert result['cached'] is False
+        assert result['zero_bytes'] == 3072
+
+    @patch('azurectl.storage.storage.PageIndex')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_scan_stream_error(self, mock_xz_open, mock_page_index):
+        mock_page_index.return_value.cached = False
+        mock_page_index.return_value.scan.side_effect = IOError('bad')
+        with raises(AzureStorageStreamError):
+            self.storage.scan('../data/blob.xz')
+        mock_xz_open.return_value.close.assert_called_once_with()
+        assert not mock_page_index.return_value.save.called
+
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.PageIndex')
+    @patch('azurectl.storage.storage.Codec.open')
+    def test_upload_size_unknown(
+        self, mock_codec_open, mock_page_index, mock_page_blob
+    ):
+        page_index = mock_page_index.return_value
+        page_index.cached = False
+
+        def scan(stream):
+            page_index.image_size = 1024
+
+        page_index.scan.side_effect = scan
+        mock_page_blob.return_value.committed_ranges = []
+        mock_page_blob.return_value.next.side_effect = StopIteration
+        self.storage.upload('../data/blob.gz', max_processes=2)
+        assert mock_codec_open.call_args_list[0] == call(
+            'gzip', '../data/blob.gz', threads=multiprocessing.cpu_count()
+        )
+        page_index.scan.assert_called_once_with(mock_codec_open.return_value)
+        assert not page_index.save.called
+        assert mock_page_blob.call_args[0][3] == 1024
+        assert mock_codec_open.return_value.close.call_count == 2
+
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.StripedUpload')
+    def test_upload_qcow2(self, mock_striped_upload, mock_page_blob):
+        mock_page_blob.return_value.committed_ranges = []
+        mock_page_blob.return_value.next.side_effect = StopIteration
+        self.storage.upload('../data/blob.qcow2', max_processes=2)
+        assert not mock_striped_upload.called
+        # the guest data of 1024 bytes as fixed VHD of 1MB
+        assert mock_page_blob.call_args[0][3] == 1048576 + 512
+
+    @patch('azurectl.storage.storage.PageIndex')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.StripedUpload')
+    @patch('azurectl.storage.storage.log.warning')
+    def test_upload_to_vhd(
+        self, mock_warning, mock_striped_upload, mock_page_blob,
+        mock_page_index
+    ):
+        self.storage.PAGE_INDEX = True
+        mock_page_index.return_value.cached = False
+        mock_page_blob.return_value.committed_ranges = []
+        mock_page_blob.return_value.next.side_effect = StopIteration
+        self.storage.upload('../data/blob.raw', max_processes=2, to_vhd=True)
+        assert not mock_striped_upload.called
+        assert 'converted to VHD' in mock_warning.call_args[0][0]
+        assert mock_page_blob.call_args[0][3] == 1048576 + 512
+        stream = mock_page_blob.return_value.next.call_args[0][0]
+        assert isinstance(stream, FixedVHD)
+        assert stream.data_size == 1024
+        # the page index is kept for the raw image
+        mock_page_index.return_value.save.assert_called_once_with(1024)
+
+    @patch('azurectl.storage.storage.PageBlobService')
+    def test_upload_to_vhd_sparse_unaligned(self, mock_page_blob_service):
+        blob_service = mock_page_blob_service.return_value
+        blob_service.MAX_CHUNK_GET_SIZE = 4 * 1048576
+        with NamedTemporaryFile() as image:
+            # 3MB + 1000 bytes, the data is followed by a hole
+            image.write(b'a' * 4096)
+            image.truncate(3146728)
+            image.flush()
+            self.storage.upload(image.name, 'blob', to_vhd=True)
+        blob_service.create_blob.assert_called_once_with(
+            'some-container', 'blob', 4 * 1048576 + 512
+        )
+        pages = [
+            (call_args[0][3], call_args[0][4], len(call_args[0][2]))
+            for call_args in blob_service.update_page.call_args_list
+        ]
+        assert pages[0] == (0, 4095, 4096)
+        assert pages[-1] == (4 * 1048576, 4 * 1048576 + 511, 512)
+        assert blob_service.update_page.call_args[0][2][:8] == b'conectix'
+        for page_start, page_end, length in pages:
+            assert page_start % 512 == 0
+            assert (page_end + 1) % 512 == 0
+
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.log.info')
+    def test_upload_to_vhd_qcow2(self, mock_info, mock_page_blob):
+        mock_page_blob.return_value.committed_ranges = []
+        mock_page_blob.return_value.next.side_effect = StopIteration
+        self.storage.upload('../data/blob.qcow2', to_vhd=True)
+        mock_info.assert_any_call(
+            'Uploading %s image as it is, no VHD conversion needed', 'qcow2'
+        )
+        assert mock_page_blob.call_args[0][3] == 1048576 + 512
+        stream = mock_page_blob.return_value.next.call_args[0][0]
+        assert not isinstance(stream, FixedVHD)
+
+    @patch('azurectl.storage.storage.FanoutUpload')
+    @patch('azurectl.storage.storage.FanoutTarget')
+    def test_upload_targets_to_vhd(
+        self, mock_fanout_target, mock_fanout_upload
+    ):
+        fanout_upload = mock_fanout_upload.return_value
+        fanout_upload.failed_targets.return_value = []
+        self.storage.upload(
+            '../data/blob.raw', 'blob', targets=[['other', 'images']],
+            to_vhd=True
+        )
+        mock_fanout_upload.assert_called_once_with(
+            [mock_fanout_target.return_value] * 2, 'blob', 1048576 + 512
+        )
+        stream = fanout_upload.upload.call_args[0][0]
+        assert isinstance(stream, FixedVHD)
+        assert stream.data_size == 1024
+
+    @patch('azurectl.storage.storage.PageIndex')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.StripedUpload')
+    @patch('azurectl.storage.storage.log.warning')
+    def test_upload_member(
+        self, mock_warning, mock_striped_upload, mock_page_blob,
+        mock_page_index
+    ):
+        self.storage.PAGE_INDEX = True
+        mock_page_index.return_value.cached = False
+        mock_page_blob.return_value.committed_ranges = []
+        mock_page_blob.return_value.next.side_effect = StopIteration
+        self.storage.upload(
+            '../data/blob.tar.xz', max_processes=2, member='images/disk.raw'
+        )
+        assert not mock_striped_upload.called
+        assert 'archive members' in mock_warning.call_args[0][0]
+        mock_page_index.assert_called_with(
+            '../data/blob.tar.xz', member='images/disk.raw'
+        )
+        assert mock_page_blob.call_args[0][1] == 'disk.raw'
+        assert mock_page_blob.call_args[0][3] == 1024
+        stream = mock_page_blob.return_value.next.call_args[0][0]
+        assert isinstance(stream, TarMember)
+        mock_page_index.return_value.save.assert_called_once_with(1024)
+
+    @patch('azurectl.storage.storage.PageIndex')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.TarMember')
+    def test_upload_member_size_cached(
+        self, mock_tar_member, mock_page_blob, mock_page_index
+    ):
+        mock_page_index.return_value.cached = True
+        mock_page_index.return_value.image_size = 1024
+        mock_page_blob.return_value.committed_ranges = []
+        mock_page_blob.return_value.next.side_effect = StopIteration
+        self.storage.upload(
+            '../data/blob.tar.xz', 'blob', member='images/disk.raw'
+        )
+        assert mock_page_blob.call_args[0][3] == 1024
+        # the archive is opened once, for the upload
+        mock_tar_member.assert_called_once_with(
+            mock.ANY, 'images/disk.raw'
+        )
+
+    @patch('azurectl.storage.storage.FanoutUpload')
+    @patch('azurectl.storage.storage.FanoutTarget')
+    def test_upload_targets_member_to_vhd(
+        self, mock_fanout_target, mock_fanout_upload
+    ):
+        fanout_upload = mock_fanout_upload.return_value
+        fanout_upload.failed_targets.return_value = []
+        self.storage.upload(
+            '../data/blob.tar.xz', 'blob', targets=[['other', 'images']],
+            to_vhd=True, member='images/disk.raw'
+        )
+        mock_fanout_upload.assert_called_once_with(
+            [mock_fanout_target.return_value] * 2, 'blob', 1048576 + 512
+        )
+        stream = fanout_upload.upload.call_args[0][0]
+        assert isinstance(stream, FixedVHD)
+        assert stream.read(1024) == b'a' * 512 + bytes(512)
+
+    @patch('azurectl.storage.storage.Codec.open')
+    def test_upload_member_not_found(self, mock_codec_open):
+        mock_codec_open.return_value = io.BytesIO(bytes(1024))
+        with raises(AzureStorageStreamError):
+            self.storage.upload('../data/blob.tar.xz', member='disk.raw')
+        assert mock_codec_open.return_value.closed
+
+    @patch('azurectl.storage.storage.PageIndex')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.StripedUpload')
+    @patch('azurectl.storage.storage.PipeStream.open')
+    @patch('azurectl.storage.storage.log.warning')
+    @patch('azurectl.storage.storage.FileType')
+    def test_upload_stdin(
+        self, mock_file_type, mock_warning, mock_pipe_stream_open,
+        mock_striped_upload, mock_page_blob, mock_page_index
+    ):
+        self.storage.PAGE_INDEX = True
+        mock_page_blob.return_value.committed_ranges = []
+        mock_page_blob.return_value.next.side_effect = StopIteration
+        self.storage.upload('-', 'blob', max_processes=2, size='1024')
+        assert not mock_file_type.called
+        assert not mock_striped_upload.called
+        assert 'from stdin' in mock_warning.call_args[0][0]
+        mock_pipe_stream_open.assert_called_once_with(1024)
+        assert mock_page_blob.call_args[0][3] == 1024
+        mock_page_blob.return_value.next.assert_called_once_with(
+            mock_pipe_stream_open.return_value, None, 5
+        )
+        assert mock_page_blob.call_args[1]['page_index'] is None
+        assert not mock_page_index.called
+        mock_pipe_stream_open.return_value.close.assert_called_once_with()
+
+    @patch('azurectl.storage.storage.FanoutUpload')
+    @patch('azurectl.storage.storage.FanoutTarget')
+    @patch('azurectl.storage.storage.PipeStream.open')
+    def test_upload_stdin_targets_to_vhd(
+        self, mock_pipe_stream_open, mock_fanout_target, mock_fanout_upload
+    ):
+        fanout_upload = mock_fanout_upload.return_value
+        fanout_upload.failed_targets.return_value = []
+        self.storage.upload(
+            '-', 'blob', targets=[['other', 'images']], to_vhd=True,
+            size='1000'
+        )
+        mock_pipe_stream_open.assert_called_once_with(1000)
+        mock_fanout_upload.assert_called_once_with(
+            [mock_fanout_target.return_value] * 2, 'blob', 1048576 + 512
+        )
+        stream = fanout_upload.upload.call_args[0][0]
+        assert isinstance(stream, FixedVHD)
+        assert stream.data_stream == mock_pipe_stream_open.return_value
+
+    def test_upload_stdin_unsupported(self):
+        for name, upload_args in [
+            (None, {'size': '1024'}),
+            ('blob', {}),
+            ('blob', {'size': '1024', 'resume': True}),
+            ('blob', {'size': '1024', 'member': 'disk.raw'})
+        ]:
+            with raises(AzureStorageUploadError):
+                self.storage.upload('-', name, **upload_args)
+
+    @patch('azurectl.storage.storage.PageIndex')
+    @patch('azurectl.storage.storage.Codec.open')
+    def test_scan_size_unknown(self, mock_codec_open, mock_page_index):
+        self.storage.PAGE_INDEX = True
+        page_index = mock_page_index.return_value
+        page_index.cached = False
+        page_index.image_size = 1024
+        page_index.non_zero_bytes.return_value = 512
+        page_index.extents = [0, 512]
+        page_index.save.side_effect = [AzurePageIndexError('full'), None]
+        assert self.storage.scan('../data/blob.gz')['image_size'] == 1024
+        assert page_index.save.call_args_list == [call(1024), call(1024)]
+
+    @patch('azurectl.storage.storage.PageIndex')
+    def test_scan_size_unknown_cached(self, mock_page_index):
+        page_index = mock_page_index.return_value
+        page_index.cached = True
+        page_index.image_size = 1024
+        page_index.non_zero_bytes.return_value = 512
+        page_index.extents = [0, 512]
+        assert self.storage.scan('../data/blob.gz')['image_size'] == 1024
+        assert not page_index.scan.called
+
+    @patch('azurectl.storage.storage.PageIndex')
+    @patch('azurectl.storage.storage.Codec.open')
+    def test_upload_size_unknown_stream_error(
+        self, mock_codec_open, mock_page_index
+    ):
+        mock_page_index.return_value.cached = False
+        mock_page_index.return_value.scan.side_effect = EOFError('truncated')
+        with raises(AzureStorageStreamError):
+            self.storage.upload('../data/blob.gz')
+        mock_codec_open.return_value.close.assert_called_once_with()
+
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.storage.storage.SparseFile.open')
     @patch('os.path.getsize')
     def test_upload_uncompressed(
-        self, mock_uncompressed_size, mock_open, mock_page_blob
+        self, mock_uncompressed_size, mock_sparse_open, mock_page_blob
     ):
-        stream = mock.Mock
+        stream = mock.Mock()
         stream.close = mock.Mock()
-        mock_open.return_value = stream
+        mock_sparse_open.return_value = stream
         page_blob = mock.Mock()
+        page_blob.committed_ranges = []
         next_results = [3, 2, 1]
 
         def side_effect(stream, max_chunk_size, max_attempts):
@@ -122,6 +1052,7 @@ class TestStorage:
 
         self.storage.upload('../data/blob.raw')
 
+        mock_sparse_open.assert_called_once_with('../data/blob.raw')
         assert page_blob.next.call_args_list == [
             call(stream, None, 5),
             call(stream, None, 5),
@@ -130,6 +1061,186 @@ class TestStorage:
         ]
         stream.close.assert_called_once_with()
 
+    @patch('azurectl.storage.storage.UploadJournal')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_resume(
+        self, mock_xz_open, mock_page_blob, mock_journal
+    ):
+        journal = mock.Mock()
+        mock_journal.return_value = journal
+        page_blob = mock.Mock()
+        page_blob.committed_ranges = [[0, 512]]
+        page_blob.next.side_effect = StopIteration
+        mock_page_blob.return_value = page_blob
+
+        self.storage.upload('../data/blob.xz', resume=True)
+
+        mock_journal.assert_called_once_with(
+            '../data/blob.xz', 'mock-storage-name', 'some-container', 'blob'
+        )
+        assert mock_page_blob.call_args[0][5] == journal
+        journal.delete.assert_called_once_with()
+        journal.close.assert_called_once_with()
+
+    @patch('azurectl.storage.storage.UploadJournal')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_resume_keeps_journal_on_error(
+        self, mock_xz_open, mock_page_blob, mock_journal
+    ):
+        journal = mock.Mock()
+        mock_journal.return_value = journal
+        page_blob = mock.Mock()
+        page_blob.committed_ranges = []
+        page_blob.next.side_effect = Exception
+        mock_page_blob.return_value = page_blob
+
+        with raises(AzureStorageUploadError):
+            self.storage.upload('../data/blob.xz', resume=True)
+
+        assert not journal.delete.called
+        journal.close.assert_called_once_with()
+
+    @patch('azurectl.storage.storage.PageBlobService')
+    @patch('azurectl.storage.storage.BlockBlobService')
+    @patch('azurectl.storage.storage.PageManifest')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_delta(
+        self, mock_xz_open, mock_page_blob, mock_manifest,
+        mock_block_blob_service, mock_page_blob_service
+    ):
+        manifest = mock.Mock()
+        mock_manifest.return_value = manifest
+        page_blob = mock.Mock()
+        page_blob.committed_ranges = []
+        page_blob.next.side_effect = StopIteration
+        mock_page_blob.return_value = page_blob
+        mock_page_blob_service.return_value.get_blob_properties. \
+            return_value.properties.etag = 'etag'
+
+        self.storage.upload('../data/blob.xz', delta=True)
+
+        mock_manifest.assert_called_once_with(
+            mock_block_blob_service.return_value, 'some-container', 'blob', 4
+        )
+        manifest.load.assert_called_once_with()
+        assert mock_page_blob.call_args[0][6] == manifest
+        manifest.save.assert_called_once_with('etag')
+
+    def __base_blob_properties(self, copy_status='success'):
+        base = mock.Mock()
+        base.properties.etag = 'base-etag'
+        blob = mock.Mock()
+        blob.properties.etag = 'etag'
+        blob.properties.copy.status = copy_status
+        blob.properties.copy.status_description = 'description'
+        return [base, blob, blob]
+
+    @patch('azurectl.storage.storage.PageBlobService')
+    @patch('azurectl.storage.storage.BlockBlobService')
+    @patch('azurectl.storage.storage.PageManifest')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.utils.xz.XZ.open')
+    @patch('azurectl.storage.storage.time.sleep')
+    def test_upload_base_blob(
+        self, mock_sleep, mock_xz_open, mock_page_blob, mock_manifest,
+        mock_block_blob_service, mock_page_blob_service
+    ):
+        blob_service = mock_page_blob_service.return_value
+        manifest = mock.Mock()
+        manifest.load.return_value = True
+        manifest.etag = 'base-etag'
+        mock_manifest.return_value = manifest
+        page_blob = mock.Mock()
+        page_blob.committed_ranges = []
+        page_blob.next.side_effect = StopIteration
+        mock_page_blob.return_value = page_blob
+        blob_service.make_blob_url.return_value = 'base-url'
+        blob_service.copy_blob.return_value.status = 'pending'
+        blob_service.get_blob_properties.side_effect = \
+            self.__base_blob_properties() + [mock.Mock()]
+
+        self.storage.upload('../data/blob.xz', base_blob='base')
+
+        manifest.load.assert_called_once_with('base')
+        blob_service.copy_blob.assert_called_once_with(
+            'some-container', 'blob', 'base-url', source_if_match='base-etag'
+        )
+        blob_service.make_blob_url.assert_called_once_with(
+            'some-container', 'base'
+        )
+        assert mock_sleep.call_count == 1
+        assert manifest.etag == 'etag'
+        assert mock_page_blob.call_args[0][6] == manifest
+
+    @patch('azurectl.storage.storage.PageBlobService')
+    @patch('azurectl.storage.storage.BlockBlobService')
+    @patch('azurectl.storage.storage.PageManifest')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.utils.xz.XZ.open')
+    @patch('azurectl.storage.storage.time.sleep')
+    def test_upload_base_blob_copy_failed(
+        self, mock_sleep, mock_xz_open, mock_page_blob, mock_manifest,
+        mock_block_blob_service, mock_page_blob_service
+    ):
+        blob_service = mock_page_blob_service.return_value
+        manifest = mock.Mock()
+        manifest.load.return_value = True
+        manifest.etag = 'base-etag'
+        mock_manifest.return_value = manifest
+        blob_service.copy_blob.return_value.status = 'pending'
+        blob_service.get_blob_properties.side_effect = \
+            self.__base_blob_properties('failed')
+        with raises(AzureStorageUploadError):
+            self.storage.upload('../data/blob.xz', base_blob='base')
+        assert not mock_page_blob.called
+
+    @patch('azurectl.storage.storage.PageBlobService')
+    @patch('azurectl.storage.storage.BlockBlobService')
+    @patch('azurectl.storage.storage.PageManifest')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_base_blob_changed(
+        self, mock_xz_open, mock_page_blob, mock_manifest,
+        mock_block_blob_service, mock_page_blob_service
+    ):
+        blob_service = mock_page_blob_service.return_value
+        manifest = mock.Mock()
+        manifest.load.return_value = True
+        manifest.etag = 'old-etag'
+        mock_manifest.return_value = manifest
+        page_blob = mock.Mock()
+        page_blob.committed_ranges = []
+        page_blob.next.side_effect = StopIteration
+        mock_page_blob.return_value = page_blob
+        blob_service.get_blob_properties.side_effect = \
+            self.__base_blob_properties()
+        self.storage.upload('../data/blob.xz', base_blob='base')
+        manifest.discard_previous.assert_called_once_with()
+        assert not blob_service.copy_blob.called
+
+    @patch('azurectl.storage.storage.PageBlobService')
+    @patch('azurectl.storage.storage.BlockBlobService')
+    @patch('azurectl.storage.storage.PageManifest')
+    @patch('azurectl.storage.storage.PageBlob')
+    @patch('azurectl.utils.xz.XZ.open')
+    def test_upload_base_blob_without_manifest(
+        self, mock_xz_open, mock_page_blob, mock_manifest,
+        mock_block_blob_service, mock_page_blob_service
+    ):
+        blob_service = mock_page_blob_service.return_value
+        manifest = mock.Mock()
+        manifest.load.return_value = False
+        mock_manifest.return_value = manifest
+        page_blob = mock.Mock()
+        page_blob.committed_ranges = []
+        page_blob.next.side_effect = StopIteration
+        mock_page_blob.return_value = page_blob
+        self.storage.upload('../data/blob.xz', base_blob='base')
+        assert not blob_service.copy_blob.called
+
     @patch('azurectl.storage.storage.PageBlobService')
     @patch('azurectl.storage.storage.PageBlob')
     def test_upload_empty_raises(self, mock_page_blob_class, mock_blob_service):
@@ -170,10 +1281,35 @@ class TestStorage:
         with raises(AzureStorageDeleteError):
             self.storage.delete('some-blob')
 
+    @patch('azurectl.storage.upload_telemetry.time.time')
+    def test_upload_summary(self, mock_time):
+        mock_time.return_value = 100
+        self.storage.telemetry = UploadTelemetry()
+        self.storage.telemetry.add('network', 10)
+        self.storage.upload_status['current_bytes'] = 1048576
+        self.storage.upload_status['total_bytes'] = 4 * 1048576
+        mock_time.return_value = 102
+        summary = self.storage.upload_summary()
+        assert summary['current_bytes'] == 1048576
+        assert summary['mb_per_second'] == 0.5
+        assert summary['eta_seconds'] == 6
+        assert summary['stage_seconds']['network'] == 10
+
+    def test_write_upload_status(self):
+        progress_stream = io.StringIO()
+        self.storage.write_upload_status(progress_stream)
+        progress_stream.seek(0)
+        status = json.loads(progress_stream.readline())
+        assert status['total_bytes'] == 0
+        assert status['eta_seconds'] is None
+
     def test_print_upload_status(self):
         self.storage.print_upload_status()
-        assert self.storage.upload_status == \
-            {'current_bytes': 0, 'total_bytes': 0}
+        assert self.storage.upload_status == {
+            'current_bytes': 0, 'total_bytes': 0, 'skipped_bytes': 0,
+            'unchanged_bytes': 0, 'retries': 0,
+            'hedged_writes': 0
+        }
 
     def test_disk_image_sas(self):
         container = 'mock-container'
@@ -0,0 +1,232 @@
+from .test_helper import argv_kiwi_tests
+
+import lzma
+import mock
+from mock import patch
+from mock import call
+from pytest import raises
+
+from azurectl.storage.striped_upload import StripedUpload
+from azurectl.storage.upload_telemetry import UploadTelemetry
+
+
+class TestStripedUpload:
+    def setup(self):
+        self.striped_upload = StripedUpload(
+            'account', 'key', 'core.windows.net', 'container', 'blob',
+            '../data/blob.raw', 10240
+        )
+
+    def test_stripes(self):
+        assert self.striped_upload.stripes(1, 1024) == [[0, 10240]]
+        assert self.striped_upload.stripes(3, 1024) == [
+            [0, 4096], [4096, 7168], [7168, 10240]
+        ]
+        assert self.striped_upload.stripes(4, 8192) == [
+            [0, 8192], [8192, 10240]
+        ]
+
+    def test_stripes_xz(self):
+        striped_upload = StripedUpload(
+            'account', 'key', 'core.windows.net', 'container', 'blob',
+            '../data/blob.blocks.xz', 20000, xz=True
+        )
+        block_sizes = [
+            block_size
+            for stream in striped_upload.xz_streams
+            for unpadded_size, block_size in stream['records']
+        ]
+        stripes = striped_upload.stripes(2, 512)
+        assert len(stripes) == 2
+        assert stripes[0][1] in [
+            sum(block_sizes[:index]) for index in range(1, len(block_sizes))
+        ]
+        assert stripes[-1][1] == 20000
+
+    def test_stripes_xz_single_block(self):
+        striped_upload = StripedUpload(
+            'account', 'key', 'core.windows.net', 'container', 'blob',
+            '../data/blob.xz', 4, xz=True
+        )
+        assert striped_upload.stripes(4, 512) == [[0, 4]]
+
+    @patch('azurectl.storage.striped_upload.multiprocessing.Pool')
+    def test_upload(self, mock_pool):
+        pool = mock_pool.return_value
+        upload = mock.Mock()
+        upload.ready.side_effect = [False, True, True]
+        pool.apply_async.return_value = upload
+        progress_callback = mock.Mock()
+
+        self.striped_upload.upload(
+            [[0, 4096], [4096, 10240]], progress_callback, 1024, 3, 4, 2,
+            2048, True, 100, True, 1024, True
+        )
+
+        assert mock_pool.call_args[0][:2] == (
+            2, StripedUpload.init_worker
+        )
+        assert pool.apply_async.call_args_list == [
+            call(self.striped_upload.upload_stripe, (0, [0, 4096])),
+            call(self.striped_upload.upload_stripe, (1, [4096, 10240]))
+        ]
+        assert upload.get.call_count == 2
+        progress_callback.assert_called_with(
+            0, 0, 0, 0, {
+                'read': 0.0, 'decompress': 0.0, 'zero_check': 0.0,
+                'network': 0.0
+            }
+        )
+        pool.join.assert_called_once_with()
+        pool.terminate.assert_called_once_with()
+        assert self.striped_upload.read_ahead_size == 2048
+        assert self.striped_upload.auto_tune is True
+        assert self.striped_upload.retry_budget == 100
+        assert self.striped_upload.hedge is True
+        assert self.striped_upload.max_bandwidth == 1024
+        assert self.striped_upload.shared_bandwidth is True
+
+    @patch('azurectl.storage.striped_upload.multiprocessing.Pool')
+    def test_upload_stripe_failed(self, mock_pool):
+        pool = mock_pool.return_value
+        pool.apply_async.return_value.get.side_effect = Exception
+        with raises(Exception):
+            self.striped_upload.upload([[0, 4096]], mock.Mock())
+        assert not pool.join.called
+        pool.terminate.assert_called_once_with()
+
+    @patch('azurectl.storage.striped_upload.PageBlobService')
+    @patch('azurectl.storage.striped_upload.PageBlob')
+    @patch('azurectl.storage.striped_upload.RetryPolicy')
+    @patch('azurectl.storage.striped_upload.SparseFile.open')
+    def test_upload_stripe(
+        self, mock_sparse_open, mock_retry_policy, mock_page_blob,
+        mock_page_blob_service
+    ):
+        mock_retry_policy.return_value.retries = 2
+        StripedUpload.init_worker([0] * 16)
+        del mock_sparse_open.return_value.decompress_time
+        page_blob = mock_page_blob.return_value
+        page_blob.zero_bytes_skipped = 512
+        page_blob.next.side_effect = [6144, StopIteration]
+        self.striped_upload.max_threads = 4
+        self.striped_upload.retry_budget = 10
+
+        self.striped_upload.upload_stripe(1, [4096, 10240])
+
+        mock_retry_policy.assert_called_once_with(10)
+        mock_sparse_open.return_value.seek.assert_called_once_with(4096)
+        mock_page_blob.assert_called_once_with(
+            mock_page_blob_service.return_value, 'blob', 'container', 10240,
+            4, stripe=[4096, 10240], controller=None,
+            retry_policy=mock_retry_policy.return_value, hedge_policy=None,
+            telemetry=mock.ANY, rate_limiter=None
+        )
+        assert isinstance(
+            mock_page_blob.call_args[1]['telemetry'], UploadTelemetry
+        )
+        page_blob.next.assert_called_with(
+            mock_sparse_open.return_value, None, 5
+        )
+        assert StripedUpload.progress == [0] * 8 + [
+            6144, 512, 2, 0, 0, 0, 0, 0
+        ]
+        mock_sparse_open.return_value.close.assert_called_once_with()
+        page_blob.close.assert_called_once_with()
+
+    @patch('azurectl.storage.striped_upload.PageBlobService')
+    @patch('azurectl.storage.striped_upload.PageBlob')
+    @patch('azurectl.storage.striped_upload.UploadController')
+    @patch('azurectl.storage.striped_upload.SparseFile.open')
+    def test_upload_stripe_auto_tune(
+        self, mock_sparse_open, mock_controller, mock_page_blob,
+        mock_page_blob_service
+    ):
+        StripedUpload.init_worker([0] * 8)
+        del mock_sparse_open.return_value.decompress_time
+        mock_page_blob.return_value.zero_bytes_skipped = 0
+        mock_page_blob.return_value.next.side_effect = StopIteration
+        self.striped_upload.auto_tune = True
+        self.striped_upload.max_chunk_size = 1024
+        self.striped_upload.max_threads = 4
+        self.striped_upload.upload_stripe(0, [0, 10240])
+        mock_controller.assert_called_once_with(1024, 4)
+        assert mock_page_blob.call_args[1]['controller'] == \
+            mock_controller.return_value
+
+    @patch('azurectl.storage.striped_upload.PageBlobService')
+    @patch('azurectl.storage.striped_upload.PageBlob')
+    @patch('azurectl.storage.striped_upload.HedgePolicy')
+    @patch('azurectl.storage.striped_upload.SparseFile.open')
+    def test_upload_stripe_hedge(
+        self, mock_sparse_open, mock_hedge_policy, mock_page_blob,
+        mock_page_blob_service
+    ):
+        StripedUpload.init_worker([0] * 8)
+        del mock_sparse_open.return_value.decompress_time
+        mock_page_blob.return_value.zero_bytes_skipped = 0
+        mock_page_blob.return_value.next.side_effect = StopIteration
+        mock_hedge_policy.return_value.hedged = 3
+        self.striped_upload.hedge = True
+        self.striped_upload.upload_stripe(0, [0, 10240])
+        assert mock_page_blob_service.call_count == 2
+        assert mock_page_blob.call_args[1]['hedge_policy'] == \
+            mock_hedge_policy.return_value
+        assert StripedUpload.progress == [10240, 0, 0, 3, 0, 0, 0, 0]
+
+    @patch('azurectl.storage.striped_upload.PageBlobService')
+    @patch('azurectl.storage.striped_upload.PageBlob')
+    @patch('azurectl.storage.striped_upload.RateLimiter')
+    @patch('azurectl.storage.striped_upload.BandwidthShare')
+    @patch('azurectl.storage.striped_upload.SparseFile.open')
+    def test_upload_stripe_max_bandwidth(
+        self, mock_sparse_open, mock_bandwidth_share, mock_rate_limiter,
+        mock_page_blob, mock_page_blob_service
+    ):
+        StripedUpload.init_worker([0] * 8)
+        del mock_sparse_open.return_value.decompress_time
+        mock_page_blob.return_value.zero_bytes_skipped = 0
+        mock_page_blob.return_value.next.side_effect = StopIteration
+        self.striped_upload.max_bandwidth = 1024
+        self.striped_upload.upload_stripe(0, [0, 10240])
+        mock_rate_limiter.assert_called_once_with(1024, None)
+        assert mock_page_blob.call_args[1]['rate_limiter'] == \
+            mock_rate_limiter.return_value
+        mock_rate_limiter.return_value.close.assert_called_once_with()
+        self.striped_upload.shared_bandwidth = True
+        self.striped_upload.upload_stripe(0, [0, 10240])
+        mock_rate_limiter.assert_called_with(
+            1024, mock_bandwidth_share.return_value
+        )
+
+    @patch('azurectl.storage.striped_upload.PageBlobService')
+    @patch('azurectl.storage.striped_upload.PageBlob')
+    @patch('azurectl.storage.striped_upload.ReadAhead')
+    @patch('azurectl.storage.striped_upload.ParallelXZ')
+    def test_upload_stripe_xz(
+        self, mock_parallel_xz, mock_read_ahead, mock_page_blob,
+        mock_page_blob_service
+    ):
+        StripedUpload.init_worker([0] * 8)
+        striped_upload = StripedUpload(
+            'account', 'key', 'core.windows.net', 'container', 'blob',
+            '../data/blob.blocks.xz', 20000, xz=True
+        )
+        striped_upload.read_ahead_size = 4096
+        striped_upload.decompress_threads = 2
+        page_blob = mock_page_blob.return_value
+        page_blob.zero_bytes_skipped = 0
+        page_blob.next.side_effect = StopIteration
+        mock_parallel_xz.return_value.decompress_time = 1.5
+
+        striped_upload.upload_stripe(0, [0, 10000])
+
+        mock_parallel_xz.assert_called_once_with(
+            '../data/blob.blocks.xz', striped_upload.xz_streams, 2, 0, 10000
+        )
+        mock_read_ahead.assert_called_once_with(
+            mock_parallel_xz.return_value, page_blob.chunk_size.return_value,
+            4096, offset=0
+        )
+        assert StripedUpload.progress == [10000, 0, 0, 0, 0, 1500, 0, 0]
+        mock_read_ahead.return_value.close.assert_called_once_with()
@@ -0,0 +1,59 @@
+from .test_helper import argv_kiwi_tests
+
+import threading
+import time
+
+from azurectl.storage.upload_budget import UploadBudget
+
+
+class TestUploadBudget:
+    def setup(self):
+        self.budget = UploadBudget(2, 1024)
+
+    def test_acquire_release(self):
+        self.budget.acquire(512)
+        self.budget.acquire(512)
+        assert self.budget.requests == 2
+        assert self.budget.bytes == 1024
+        self.budget.release(512)
+        self.budget.release(512)
+        assert self.budget.requests == 0
+        assert self.budget.bytes == 0
+
+    def test_acquire_waits_for_requests(self):
+        budget = UploadBudget(1)
+        budget.acquire(4096)
+        acquired = threading.Event()
+
+        def acquire():
+            budget.acquire(4096)
+            acquired.set()
+
+        waiter = threading.Thread(target=acquire)
+        waiter.start()
+        time.sleep(0.05)
+        assert not acquired.is_set()
+        budget.release(4096)
+        waiter.join()
+        assert acquired.is_set()
+        assert budget.requests == 1
+
+    def test_acquire_waits_for_bytes(self):
+        self.budget.acquire(768)
+        acquired = threading.Event()
+
+        def acquire():
+            self.budget.acquire(512)
+            acquired.set()
+
+        waiter = threading.Thread(target=acquire)
+        waiter.start()
+        time.sleep(0.05)
+        assert not acquired.is_set()
+        self.budget.release(768)
+        waiter.join()
+        assert self.budget.bytes == 512
+
+    def test_acquire_larger_than_max_bytes(self):
+        self.budget.acquire(4096)
+        assert self.budget.bytes == 4096
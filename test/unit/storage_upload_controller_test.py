@@ -0,0 +1,88 @@
+from .test_helper import argv_kiwi_tests
+
+import mock
+from mock import patch
+
+from azurectl.storage.upload_controller import UploadController
+
+MB = 1024 * 1024
+
+
+class TestUploadController:
+    def setup(self):
+        self.controller = UploadController(4 * MB, 4)
+        self.now = 0
+
+    def __window(self, byte_size, latency, failed_attempts=0, pages=None):
+        # pages written one after the other, each taking latency seconds
+        with patch('azurectl.storage.upload_controller.time.time') as time:
+            for page in range(pages or self.controller.MIN_WINDOW_PAGES):
+                time.return_value = self.now
+                self.controller.page_started()
+                self.now += latency
+                time.return_value = self.now
+                self.controller.page_done(byte_size, latency, failed_attempts)
+
+    def test_init(self):
+        assert self.controller.chunk_size == MB
+        assert self.controller.in_flight == 1
+        controller = UploadController(8 * MB)
+        assert controller.max_chunk_size == 4 * MB
+        assert controller.max_in_flight == 1
+        controller = UploadController(256 * 1024, 0)
+        assert controller.chunk_size == 256 * 1024
+        assert controller.min_chunk_size == 256 * 1024
+
+    def test_additive_increase(self):
+        for window in range(6):
+            self.__window(MB, 1)
+        assert self.controller.chunk_size == 4 * MB
+        assert self.controller.in_flight == 1
+        for window in range(4):
+            self.__window(MB, 1)
+        assert self.controller.in_flight == 4
+        assert self.controller.best_throughput == MB
+
+    def test_failed_attempts(self):
+        self.controller.chunk_size = 4 * MB
+        self.controller.in_flight = 4
+        self.__window(MB, 1, failed_attempts=1)
+        assert self.controller.chunk_size == 2 * MB
+        assert self.controller.in_flight == 2
+
+    def test_latency_beyond_target(self):
+        self.controller.in_flight = 2
+        self.__window(MB, 20)
+        assert self.controller.chunk_size == 512 * 1024
+        assert self.controller.in_flight == 2
+
+    def test_throughput_drop(self):
+        self.controller.best_throughput = 4 * MB
+        self.controller.in_flight = 4
+        self.__window(MB, 1)
+        assert self.controller.in_flight == 2
+        assert self.controller.chunk_size == MB
+        assert self.controller.best_throughput == 0.9 * 4 * MB
+
+    def test_window_of_writes_in_flight(self):
+        self.controller.in_flight = 6
+        self.__window(MB, 1, pages=5)
+        assert self.controller.window_pages == 5
+        self.__window(MB, 1, pages=1)
+        assert self.controller.window_pages == 0
+
+    def test_busy_time(self):
+        with patch('azurectl.storage.upload_controller.time.time') as time:
+            time.return_value = 0
+            self.controller.page_started()
+            self.controller.page_started()
+            time.return_value = 2
+            self.controller.page_done(MB, 2)
+            time.return_value = 3
+            self.controller.page_done(MB, 3)
+            time.return_value = 10
+            self.controller.page_started()
+            time.return_value = 11
+            self.controller.page_done(MB, 1)
+        assert self.controller.window_busy_time == 4
+        assert self.controller.active_pages == 0
@@ -0,0 +1,101 @@
+from .test_helper import argv_kiwi_tests
+
+import os
+import mock
+from mock import patch
+from pytest import raises
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from azurectl.storage.upload_journal import UploadJournal
+
+from azurectl.azurectl_exceptions import AzureUploadJournalError
+
+
+class TestUploadJournal:
+    def setup(self):
+        self.journal_dir = mkdtemp()
+        self.journal = UploadJournal(
+            '../data/blob.raw', 'account', 'container', 'blob',
+            self.journal_dir
+        )
+
+    def teardown(self):
+        rmtree(self.journal_dir)
+
+    def __reopen(self):
+        return UploadJournal(
+            '../data/blob.raw', 'account', 'container', 'blob',
+            self.journal_dir
+        )
+
+    def test_new_journal(self):
+        assert self.journal.ranges == []
+        assert self.journal.key['blob'] == 'blob'
+        assert self.journal.key['source'] == \
+            os.path.abspath('../data/blob.raw')
+
+    @patch('azurectl.storage.upload_journal.Defaults.cache_directory')
+    def test_default_journal_dir(self, mock_cache_directory):
+        mock_cache_directory.return_value = '/var/cache/azurectl'
+        journal = UploadJournal(
+            '../data/blob.raw', 'account', 'container', 'blob'
+        )
+        assert journal.filename.startswith(
+            '/var/cache/azurectl/upload-journal/'
+        )
+
+    def test_record_and_load(self):
+        self.journal.reset()
+        self.journal.record(512, 1024)
+        self.journal.record(0, 512)
+        self.journal.record(2048, 4096)
+        self.journal.close()
+        assert self.__reopen().ranges == [[0, 1024], [2048, 4096]]
+
+    def test_load_ignores_partial_line(self):
+        self.journal.reset()
+        self.journal.record(0, 512)
+        self.journal.close()
+        with open(self.journal.filename, 'a') as journal:
+            journal.write('512 10')
+        assert self.__reopen().ranges == [[0, 512]]
+
+    def test_load_ignores_garbage(self):
+        self.journal.reset()
+        self.journal.record(0, 512)
+        self.journal.close()
+        with open(self.journal.filename, 'a') as journal:
+            journal.write('foo\n1024 2048\n')
+        assert self.__reopen().ranges == [[0, 512]]
+
+    def test_load_key_mismatch(self):
+        with open(self.journal.filename, 'w') as journal_file:
+            journal_file.write('{"foo": "bar"}\n0 512\n')
+        assert self.__reopen().ranges == []
+        with open(self.journal.filename, 'w') as journal_file:
+            journal_file.write('no json\n0 512\n')
+        assert self.__reopen().ranges == []
+
+    def test_resume(self):
+        self.journal.reset()
+        self.journal.record(0, 512)
+        self.journal.record(1024, 2048)
+        self.journal.close()
+        journal = self.__reopen()
+        journal.resume([[1024, 2048]])
+        journal.close()
+        assert self.__reopen().ranges == [[1024, 2048]]
+
+    def test_delete(self):
+        self.journal.reset()
+        self.journal.delete()
+        assert not os.path.exists(self.journal.filename)
+        self.journal.delete()
+
+    @patch('azurectl.storage.upload_journal.os.makedirs')
+    def test_reset_raises(self, mock_makedirs):
+        mock_makedirs.side_effect = Exception
+        self.journal.journal_dir = self.journal_dir + '/sub'
+        with raises(AzureUploadJournalError):
+            self.journal.reset()
@@ -0,0 +1,46 @@
+from .test_helper import argv_kiwi_tests
+
+from mock import patch
+from azurectl.storage.upload_telemetry import UploadTelemetry
+
+
+class TestUploadTelemetry:
+    def setup(self):
+        with patch('azurectl.storage.upload_telemetry.time.time') as mock_time:
+            mock_time.return_value = 100
+            self.telemetry = UploadTelemetry()
+
+    def test_add(self):
+        self.telemetry.add('read', 1.5)
+        self.telemetry.add('read', 0.5)
+        assert self.telemetry.stages() == {
+            'read': 2.0, 'decompress': 0.0, 'zero_check': 0.0,
+            'network': 0.0
+        }
+
+    def test_update(self):
+        self.telemetry.add('network', 1)
+        self.telemetry.update({'network': 5, 'decompress': 2})
+        assert self.telemetry.stages()['network'] == 5
+        assert self.telemetry.stages()['decompress'] == 2
+
+    @patch('azurectl.storage.upload_telemetry.time.time')
+    def test_summary(self, mock_time):
+        mock_time.return_value = 104
+        self.telemetry.add('zero_check', 0.1234)
+        assert self.telemetry.summary(4 * 1048576, 6 * 1048576) == {
+            'elapsed_seconds': 4,
+            'mb_per_second': 1,
+            'eta_seconds': 2,
+            'stage_seconds': {
+                'read': 0, 'decompress': 0, 'zero_check': 0.123,
+                'network': 0
+            }
+        }
+
+    @patch('azurectl.storage.upload_telemetry.time.time')
+    def test_summary_not_started(self, mock_time):
+        mock_time.return_value = 100
+        summary = self.telemetry.summary(0, 1024)
+        assert summary['mb_per_second'] == 0
+        assert summary['eta_seconds'] is None
@@ -0,0 +1,244 @@
+from .test_helper import argv_kiwi_tests
+
+import bz2
+import gzip
+import io
+import mock
+import os
+import struct
+from mock import patch
+from pytest import raises
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from azurectl.utils.codec import (
+    BZip2,
+    Codec,
+    GZip,
+    StreamDecompressor,
+    ZStd,
+    ZStdReader
+)
+from azurectl.utils.filetype import FileType
+from azurectl.utils.qcow2 import QCow2
+from azurectl.utils.vhd import DynamicVHD
+from azurectl.utils.xz import XZ
+
+from azurectl.azurectl_exceptions import AzureCodecNotAvailable
+
+
+class TestCodec:
+    def setup(self):
+        self.image_dir = mkdtemp()
+        self.data = b'a' * 1024 + bytes(4096) + b'b' * 512
+
+    def teardown(self):
+        rmtree(self.image_dir)
+
+    def __write(self, name, data):
+        file_name = os.path.join(self.image_dir, name)
+        with open(file_name, 'wb') as image:
+            image.write(data)
+        return file_name
+
+    def __read_all(self, stream, size):
+        data = b''
+        while True:
+            chunk = stream.read(size)
+            if not chunk:
+                return data
+            data += chunk
+
+    def __zstd_frame(self, data, descriptor=0x20, header=b''):
+        # frame with one raw block, content size in one byte
+        block_header = struct.pack('<I', (len(data) << 3) | 0x01)[:3]
+        return struct.pack('<IB', ZStd.FRAME_MAGIC, descriptor) + header + \
+            block_header + data
+
+    def __seek_table(self, entries, checksum=False):
+        entry_format = '<III' if checksum else '<II'
+        table = b''.join(
+            struct.pack(entry_format, *entry) for entry in entries
+        )
+        table += struct.pack(
+            '<IBI', len(entries), 0x80 if checksum else 0x00,
+            ZStd.SEEK_TABLE_FOOTER_MAGIC
+        )
+        return struct.pack(
+            '<II', ZStd.SEEK_TABLE_FRAME_MAGIC, len(table)
+        ) + table
+
+    def test_gzip(self):
+        file_name = self.__write(
+            'image.raw.gz',
+            gzip.compress(self.data[:2048]) + gzip.compress(self.data[2048:])
+        )
+        with GZip.open(file_name) as stream:
+            assert self.__read_all(stream, 1000) == self.data
+            assert stream.decompress_time >= 0
+        assert GZip.uncompressed_size(file_name) is None
+
+    @patch.object(StreamDecompressor, 'OUTPUT_SIZE', 512)
+    def test_gzip_output_size(self):
+        file_name = self.__write('image.raw.gz', gzip.compress(self.data))
+        with GZip.open(file_name) as stream:
+            stream.buffer_size = 16
+            buffer = bytearray(len(self.data))
+            assert stream.readinto(buffer) == len(self.data)
+            assert bytes(buffer) == self.data
+            assert stream.readinto(buffer) == 0
+
+    def test_gzip_truncated(self):
+        file_name = self.__write(
+            'image.raw.gz', gzip.compress(self.data)[:-16]
+        )
+        with GZip.open(file_name) as stream:
+            with raises(EOFError):
+                stream.read(len(self.data))
+
+    def test_bzip2(self):
+        file_name = self.__write(
+            'image.raw.bz2',
+            bz2.compress(self.data[:2048]) + bz2.compress(self.data[2048:])
+        )
+        with BZip2.open(file_name) as stream:
+            assert self.__read_all(stream, 4096) == self.data
+        assert BZip2.uncompressed_size(file_name) is None
+
+    @patch('azurectl.utils.codec.zstandard', None)
+    def test_zstd_not_available(self):
+        with raises(AzureCodecNotAvailable):
+            ZStd.open('image.raw.zst')
+
+    @patch('azurectl.utils.codec.zstandard')
+    def test_zstd(self, mock_zstandard):
+        file_name = self.__write('image.raw.zst', b'zstd')
+        data = [b'abc', b'de', b'', b'']
+
+        def readinto(buffer):
+            chunk = data.pop(0)
+            buffer[:len(chunk)] = chunk
+            return len(chunk)
+
+        reader = mock_zstandard.ZstdDecompressor.return_value.\
+            stream_reader.return_value
+        reader.readinto.side_effect = readinto
+        with ZStd.open(file_name) as stream:
+            assert isinstance(stream, ZStdReader)
+            assert stream.read(8) == b'abcde'
+            assert stream.read(8) is None
+            stream_reader = mock_zstandard.ZstdDecompressor.return_value.\
+                stream_reader
+            assert stream_reader.call_args[1] == {'read_across_frames': True}
+        reader.close.assert_called_once_with()
+        assert stream.zstd_file.closed
+
+    def test_zstd_size_from_frames(self):
+        # frame with window descriptor, dictionary id, two byte content
+        # size and checksum, holding one RLE block
+        rle_frame = struct.pack('<IB', ZStd.FRAME_MAGIC, 0x45) + \
+            b'\x00' + b'\x01' + struct.pack('<H', 1000 - 256) + \
+            struct.pack('<I', (1000 << 3) | (1 << 1) | 0x01)[:3] + \
+            b'\x00' + b'csum'
+        skippable_frame = struct.pack('<II', 0x184D2A50, 4) + b'skip'
+        file_name = self.__write(
+            'image.raw.zst',
+            self.__zstd_frame(b'hello', header=b'\x05') + skippable_frame +
+            rle_frame + self.__zstd_frame(
+                b'world', descriptor=0xa0,
+                header=struct.pack('<I', 5)
+            ) + self.__zstd_frame(
+                b'!', descriptor=0xe0, header=struct.pack('<Q', 1)
+            )
+        )
+        assert ZStd.uncompressed_size(file_name) == 1011
+
+    def test_zstd_size_unknown(self):
+        assert ZStd.uncompressed_size(self.__write(
+            'no-content-size.zst',
+            self.__zstd_frame(b'hello', descriptor=0x00, header=b'\x00')
+        )) is None
+        assert ZStd.uncompressed_size(self.__write(
+            'bad-magic.zst', b'\x00' * 16
+        )) is None
+        assert ZStd.uncompressed_size(self.__write(
+            'truncated-header.zst', self.__zstd_frame(b'', header=b'\x05')[:6]
+        )) is None
+        assert ZStd.uncompressed_size(self.__write(
+            'truncated-block.zst',
+            self.__zstd_frame(b'hello', header=b'\x05')[:-6]
+        )) is None
+        reserved_block = struct.pack('<IB', ZStd.FRAME_MAGIC, 0x20) + \
+            b'\x05' + struct.pack('<I', (5 << 3) | (3 << 1) | 0x01)[:3]
+        assert ZStd.uncompressed_size(self.__write(
+            'reserved-block.zst', reserved_block + b'hello'
+        )) is None
+
+    def test_zstd_size_from_seek_table(self):
+        frames = self.__zstd_frame(b'hello', header=b'\x05') * 2
+        file_name = self.__write(
+            'image.raw.zst',
+            frames + self.__seek_table([[9, 5], [9, 5]])
+        )
+        assert ZStd.uncompressed_size(file_name) == 10
+        file_name = self.__write(
+            'image.raw.zst',
+            frames + self.__seek_table([[9, 5, 0], [9, 5, 0]], True)
+        )
+        assert ZStd.uncompressed_size(file_name) == 10
+
+    def test_zstd_size_seek_table_invalid(self):
+        frame = self.__zstd_frame(b'hello', header=b'\x05')
+        seek_table = self.__seek_table([[9, 5]])
+        # wrong skippable frame size, falls back to the frame headers
+        file_name = self.__write(
+            'image.raw.zst',
+            frame + seek_table[:4] + struct.pack('<I', 42) + seek_table[8:]
+        )
+        assert ZStd.uncompressed_size(file_name) == 5
+        # more entries than the file holds
+        file_name = self.__write(
+            'image.raw.zst',
+            frame + struct.pack(
+                '<IBI', 1000, 0x00, ZStd.SEEK_TABLE_FOOTER_MAGIC
+            )
+        )
+        assert ZStd.uncompressed_size(file_name) is None
+        file_name = self.__write('image.raw.zst', frame[:4])
+        assert ZStd.uncompressed_size(file_name) is None
+
+    def test_supports(self):
+        for file_format in FileType.COMPRESSED:
+            assert Codec.supports(file_format) is True
+        assert Codec.supports(FileType.QCOW2) is True
+        assert Codec.supports(FileType.VHD_DYNAMIC) is True
+        assert Codec.supports(FileType.RAW) is False
+        assert Codec.supports(FileType.VHD) is False
+
+    @patch.object(XZ, 'open')
+    def test_open(self, mock_xz_open):
+        assert Codec.open(FileType.XZ, '../data/blob.xz', threads=4) == \
+            mock_xz_open.return_value
+        mock_xz_open.assert_called_once_with('../data/blob.xz', threads=4)
+
+    @patch.object(QCow2, 'open')
+    @patch.object(DynamicVHD, 'open')
+    def test_open_image_formats(self, mock_vhd_open, mock_qcow2_open):
+        assert Codec.open(FileType.QCOW2, 'image.qcow2') == \
+            mock_qcow2_open.return_value
+        assert Codec.open(FileType.VHD_DYNAMIC, 'image.vhd') == \
+            mock_vhd_open.return_value
+
+    def test_uncompressed_size(self):
+        assert Codec.uncompressed_size(FileType.XZ, '../data/blob.xz') == \
+            XZ.uncompressed_size('../data/blob.xz')
+
+    def test_register(self):
+        codec = mock.Mock()
+        with patch.dict(Codec.codecs):
+            Codec.register('lz4', codec)
+            assert Codec.supports('lz4') is True
+            assert Codec.open('lz4', 'image.raw.lz4') == \
+                codec.open.return_value
+            codec.open.assert_called_once_with('image.raw.lz4', threads=1)
+        assert Codec.supports('lz4') is False
@@ -0,0 +1,71 @@
+from .test_helper import argv_kiwi_tests
+
+import io
+import mock
+from pytest import raises
+
+from azurectl.utils.datastream import SequentialStream
+
+from azurectl.azurectl_exceptions import AzureStorageStreamError
+
+
+class UnseekableStream(object):
+    # data stream without seek, like a decompressor
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def readinto(self, buffer):
+        # a pipe returns less than requested
+        return self.data.readinto(memoryview(buffer)[:100])
+
+    def close(self):
+        self.data.close()
+
+
+class TestSequentialStream:
+    def setup(self):
+        self.data = bytes(range(256)) * 16
+        self.stream = SequentialStream(UnseekableStream(self.data))
+
+    def test_read(self):
+        assert self.stream.read(1024) == self.data[:1024]
+        assert self.stream.position == 1024
+
+    def test_read_end_of_stream(self):
+        stream = SequentialStream(UnseekableStream(b''))
+        assert stream.read(0) is None
+
+    def test_read_ends_early(self):
+        with raises(EOFError):
+            self.stream.read(8192)
+
+    def test_seek_by_reading(self):
+        self.stream.SKIP_BUFFER_SIZE = 512
+        assert self.stream.seek(2048) == 2048
+        assert self.stream.seek(2048) == 2048
+        assert self.stream.read(512) == self.data[2048:2560]
+
+    def test_seek(self):
+        data_stream = io.BytesIO(self.data)
+        stream = SequentialStream(data_stream)
+        assert stream.seek(3072) == 3072
+        assert data_stream.tell() == 3072
+        assert stream.read(1024) == self.data[3072:]
+
+    def test_seek_backwards(self):
+        self.stream.read(1024)
+        with raises(AzureStorageStreamError):
+            self.stream.seek(512)
+
+    def test_decompress_time(self):
+        data_stream = mock.Mock(spec=['readinto', 'close'])
+        stream = SequentialStream(data_stream)
+        assert stream.decompress_time == 0
+        data_stream.decompress_time = 1.5
+        assert stream.decompress_time == 1.5
+
+    def test_context_manager(self):
+        data_stream = mock.Mock()
+        with SequentialStream(data_stream):
+            pass
+        data_stream.close.assert_called_once_with()
@@ -0,0 +1,97 @@
+from .test_helper import argv_kiwi_tests
+
+import io
+import mock
+from pytest import raises
+
+from azurectl.utils.extentstream import ExtentStream
+
+from azurectl.azurectl_exceptions import AzureStorageStreamError
+
+
+class TestExtentStream:
+    def setup(self):
+        # data outside of the extents is zero
+        self.data = bytearray(16384)
+        self.data[1024:2048] = bytes(range(256)) * 4
+        self.data[8192:8704] = bytes(range(256)) * 2
+        self.data = bytes(self.data)
+        self.extent_stream = ExtentStream(
+            io.BytesIO(self.data), [[1024, 2048], [8192, 8704]],
+            len(self.data)
+        )
+
+    def test_read_along_extents(self):
+        assert self.extent_stream.seek_data() == 1024
+        assert self.extent_stream.read(4096) == self.data[1024:2048]
+        assert self.extent_stream.read(4096) is None
+        assert self.extent_stream.seek_data() == 8192
+        assert self.extent_stream.read(4096) == self.data[8192:8704]
+        assert self.extent_stream.seek_data() == len(self.data)
+        assert self.extent_stream.read(4096) is None
+
+    def test_seek_data_within_extent(self):
+        self.extent_stream.seek_data()
+        self.extent_stream.read(512)
+        assert self.extent_stream.seek_data() == 1536
+
+    def test_seek_data_alignment(self):
+        assert self.extent_stream.seek_data(4096) == 0
+        assert self.extent_stream.read(8192) == self.data[:4096]
+        assert self.extent_stream.seek_data(4096) == 8192
+        assert self.extent_stream.read(8192) == self.data[8192:12288]
+
+    def test_seek_data_alignment_covers_extents(self):
+        extent_stream = ExtentStream(
+            io.BytesIO(self.data), [[0, 512], [1024, 2048], [8192, 8704]],
+            len(self.data)
+        )
+        assert extent_stream.seek_data(4096) == 0
+        assert extent_stream.read(8192) == self.data[:4096]
+        assert extent_stream.seek_data(4096) == 8192
+
+    def test_readinto_without_extents(self):
+        extent_stream = ExtentStream(io.BytesIO(self.data), [], 16384)
+        buffer = bytearray(1024)
+        assert extent_stream.readinto(buffer) == 1024
+        assert extent_stream.seek_data() == 16384
+        assert extent_stream.readinto(buffer) == 0
+
+    def test_skip_by_reading(self):
+        data_stream = mock.Mock(spec=['readinto', 'close'])
+        data_stream.readinto.side_effect = lambda view: len(view)
+        extent_stream = ExtentStream(data_stream, [[4096, 8192]], 16384)
+        extent_stream.image_file.SKIP_BUFFER_SIZE = 1024
+        assert extent_stream.seek_data() == 4096
+        assert len(extent_stream.read(512)) == 512
+        # four reads of the skip buffer and the read of the data
+        assert data_stream.readinto.call_count == 5
+
+    def test_skip_by_reading_eof(self):
+        data_stream = mock.Mock(spec=['readinto', 'close'])
+        data_stream.readinto.return_value = 0
+        extent_stream = ExtentStream(data_stream, [[4096, 8192]], 16384)
+        assert extent_stream.seek_data() == 4096
+        with raises(EOFError):
+            extent_stream.read(512)
+
+    def test_skip_by_seek(self):
+        data_stream = io.BytesIO(self.data)
+        extent_stream = ExtentStream(data_stream, [[8192, 8704]], 16384)
+        assert extent_stream.seek_data() == 8192
+        assert extent_stream.read(1024) == self.data[8192:8704]
+        assert data_stream.tell() == 8704
+
+    def test_read_backwards(self):
+        self.extent_stream.seek_data()
+        self.extent_stream.read(1024)
+        self.extent_stream.seek(0)
+        self.extent_stream.seek_data()
+        with raises(AzureStorageStreamError):
+            self.extent_stream.read(512)
+
+    def test_close(self):
+        data_stream = mock.Mock()
+        with ExtentStream(data_stream, [], 0):
+            pass
+        data_stream.close.assert_called_once_with()
@@ -1,5 +1,9 @@
 from .test_helper import argv_kiwi_tests
 
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
 from azurectl.utils.filetype import FileType
 
 
@@ -7,13 +11,91 @@ class TestFileType:
     def setup(self):
         self.filetype_xz = FileType('../data/blob.xz')
         self.filetype_not_xz = FileType('../data/id_test')
+        self.image_dir = mkdtemp()
+
+    def teardown(self):
+        rmtree(self.image_dir)
+
+    def __file_type(self, name, data):
+        file_name = os.path.join(self.image_dir, name)
+        with open(file_name, 'wb') as image:
+            image.write(data)
+        return FileType(file_name)
 
     def test_is_xz(self):
         assert self.filetype_xz.is_xz() is True
+        assert self.filetype_xz.format == FileType.XZ
 
     def test_not_xz(self):
         assert self.filetype_not_xz.is_xz() is False
+        assert self.filetype_not_xz.format == FileType.RAW
 
     def test_basename(self):
         assert self.filetype_xz.basename() == 'blob'
         assert self.filetype_not_xz.basename() == 'id_test'
+
+    def test_gzip(self):
+        file_type = self.__file_type('image.raw.gz', b'\x1f\x8b\x08\x00')
+        assert file_type.format == FileType.GZIP
+        assert file_type.is_compressed() is True
+        assert file_type.basename() == 'image.raw'
+        assert self.__file_type(
+            'image.tgz', b'\x1f\x8b\x08\x00'
+        ).basename() == 'image.tar'
+
+    def test_zstd(self):
+        file_type = self.__file_type('image.raw.zst', b'\x28\xb5\x2f\xfd\x00')
+        assert file_type.format == FileType.ZSTD
+        assert file_type.basename() == 'image.raw'
+
+    def test_zstd_skippable_frame(self):
+        assert self.__file_type(
+            'image.raw.zst', b'\x5e\x2a\x4d\x18\x00'
+        ).format == FileType.ZSTD
+        assert self.__file_type(
+            'image.raw', b'\x60\x2a\x4d\x18\x00'
+        ).format == FileType.RAW
+
+    def test_bzip2(self):
+        file_type = self.__file_type('image.raw.bz2', b'BZh91AY&SY')
+        assert file_type.format == FileType.BZIP2
+        assert file_type.basename() == 'image.raw'
+        assert self.__file_type(
+            'image.raw', b'BZh01AY&SY'
+        ).format == FileType.RAW
+
+    def test_qcow2(self):
+        file_type = self.__file_type('image.qcow2', b'QFI\xfb\x00\x00\x00\x03')
+        assert file_type.format == FileType.QCOW2
+        assert file_type.is_compressed() is False
+        assert file_type.basename() == 'image.qcow2'
+
+    def test_vhd_fixed(self):
+        file_type = self.__file_type(
+            'image.vhd', bytes(1024) + b'conectix' + bytes(504)
+        )
+        assert file_type.format == FileType.VHD
+        assert file_type.basename() == 'image.vhd'
+
+    def test_vhd_dynamic(self):
+        footer = b'conectix' + bytes(52)
+        file_type = self.__file_type(
+            'image.vhd', footer + b'\x00\x00\x00\x03' + bytes(448)
+        )
+        assert file_type.format == FileType.VHD_DYNAMIC
+        assert file_type.is_compressed() is False
+        assert self.__file_type(
+            'image.vhd', footer + b'\x00\x00\x00\x04' + bytes(448)
+        ).format == FileType.VHD_DYNAMIC
+        assert self.__file_type(
+            'image.vhd', footer + b'\x00\x00\x00\x02' + bytes(448)
+        ).format == FileType.VHD
+
+    def test_raw(self):
+        assert self.__file_type('image.raw', bytes(2048)).format == \
+            FileType.RAW
+        assert self.__file_type('image.raw', b'').format == FileType.RAW
+
+    def test_file_not_readable(self):
+        file_type = FileType(os.path.join(self.image_dir, 'no-such-image'))
+        assert file_type.format == FileType.RAW
@@ -0,0 +1,126 @@
+from .test_helper import argv_kiwi_tests
+
+import io
+import mock
+
+from azurectl.utils.mappedimage import (
+    ImageMap,
+    MappedImage
+)
+
+
+class TestImageMap:
+    def setup(self):
+        self.image_map = ImageMap()
+
+    def test_add_merges_contiguous_ranges(self):
+        self.image_map.add(0, 512, 4096)
+        self.image_map.add(512, 512, 4608)
+        self.image_map.add(1024, 512, 8192)
+        self.image_map.add(2048, 512, 8704)
+        assert len(self.image_map) == 3
+        assert list(self.image_map.lengths) == [1024, 512, 512]
+        assert self.image_map.guest_end(0) == 1024
+
+    def test_add_keeps_compressed_ranges(self):
+        self.image_map.add(0, 512, 4096, 100)
+        self.image_map.add(512, 512, 4196, 100)
+        self.image_map.add(1024, 512, 4296)
+        assert len(self.image_map) == 3
+
+    def test_find(self):
+        self.image_map.add(1024, 512, 4096)
+        self.image_map.add(4096, 512, 8192)
+        assert self.image_map.find(0) == 0
+        assert self.image_map.find(1024) == 0
+        assert self.image_map.find(1535) == 0
+        assert self.image_map.find(1536) == 1
+        assert self.image_map.find(4608) == 2
+
+
+class TestMappedImage:
+    def setup(self):
+        self.image_file = io.BytesIO(
+            bytes(512) + b'a' * 512 + b'b' * 512 + b'packed'
+        )
+        image_map = ImageMap()
+        # guest [1024, 1536) holds a, [1536, 2048) b and the
+        # compressed range [3072, 3584) x
+        image_map.add(1024, 512, 512)
+        image_map.add(1536, 512, 1024)
+        image_map.add(3072, 512, 1536, 6)
+        self.decompress = mock.Mock(return_value=b'x' * 512)
+        self.image = MappedImage(
+            self.image_file, 4096, image_map, b'footer', self.decompress
+        )
+        self.expected = bytes(1024) + b'a' * 512 + b'b' * 512 + \
+            bytes(1024) + b'x' * 512 + bytes(512) + b'footer'
+
+    def test_read(self):
+        assert self.image.byte_size == 4102
+        assert self.image.read(5000) == self.expected
+        assert self.image.read(5000) is None
+        self.decompress.assert_called_once_with(b'packed', 512)
+        assert self.image.decompress_time >= 0
+
+    def test_readinto_chunks(self):
+        data = b''
+        buffer = bytearray(300)
+        while True:
+            size = self.image.readinto(buffer)
+            if not size:
+                break
+            data += bytes(buffer[:size])
+        assert data == self.expected
+        # the compressed range is decompressed once
+        assert self.decompress.call_count == 1
+
+    def test_seek_data(self):
+        assert self.image.seek_data() == 1024
+        assert self.image.data_end == 2048
+        assert self.image.read(4096) == b'a' * 512 + b'b' * 512
+        assert self.image.seek_data() == 3072
+        assert self.image.data_end == 3584
+        assert self.image.read(4096) == b'x' * 512
+        assert self.image.seek_data() == 4096
+        assert self.image.data_end == 4102
+        assert self.image.read(4096) == b'footer'
+        assert self.image.seek_data() == 4102
+        assert self.image.read(4096) is None
+
+    def test_seek_data_within_range(self):
+        self.image.position = 1536
+        self.image.data_end = 2048
+        assert self.image.seek_data() == 1536
+        self.image.data_end = None
+        assert self.image.seek_data() == 1536
+        assert self.image.data_end == 2048
+
+    def test_seek_data_aligned(self):
+        assert self.image.seek_data(4096) == 0
+        assert self.image.data_end == 4096
+
+    def test_seek_data_last_range_ends_image(self):
+        image_map = ImageMap()
+        image_map.add(0, 1024, 0)
+        image = MappedImage(self.image_file, 1024, image_map, b'footer')
+        assert image.seek_data() == 0
+        assert image.data_end == 1030
+        assert image.read(2048) == bytes(512) + b'a' * 512 + b'footer'
+
+    def test_seek(self):
+        self.image.seek_data()
+        assert self.image.seek(3584) == 3584
+        assert self.image.data_end is None
+        assert self.image.read(1024) == bytes(512) + b'footer'
+
+    def test_read_beyond_image_file(self):
+        image_map = ImageMap()
+        image_map.add(0, 1024, 1536)
+        image = MappedImage(io.BytesIO(bytes(1536) + b'ab'), 1024, image_map)
+        assert image.read(2048) == b'ab' + bytes(1022)
+
+    def test_context_manager(self):
+        with self.image as image:
+            assert image.read(1) == b'\x00'
+        assert self.image_file.closed
@@ -0,0 +1,56 @@
+from .test_helper import argv_kiwi_tests
+
+import io
+import mock
+from mock import patch
+from pytest import raises
+
+from azurectl.utils.pipestream import PipeStream
+
+from azurectl.azurectl_exceptions import AzureStorageStreamError
+
+
+class ShortReads(io.BytesIO):
+    # a pipe returning at most 100 bytes per read
+    def readinto(self, buffer):
+        return io.BytesIO.readinto(self, memoryview(buffer)[:100])
+
+
+class TestPipeStream:
+    def setup(self):
+        self.data = b'a' * 512 + b'b' * 512
+        self.stream = PipeStream(ShortReads(self.data), 1024)
+
+    def test_read(self):
+        assert self.stream.read(768) == self.data[:768]
+        assert self.stream.read(768) == self.data[768:]
+        assert self.stream.read(768) is None
+        assert self.stream.position == 1024
+
+    def test_ends_early(self):
+        stream = PipeStream(ShortReads(self.data), 2048)
+        assert stream.read(1024) == self.data
+        with raises(EOFError):
+            stream.read(1024)
+
+    def test_exceeds_size(self):
+        stream = PipeStream(ShortReads(self.data), 512)
+        with raises(AzureStorageStreamError):
+            stream.read(1024)
+
+    @patch('azurectl.utils.pipestream.io.open')
+    @patch('azurectl.utils.pipestream.sys.stdin')
+    def test_open(self, mock_stdin, mock_open):
+        stream = PipeStream.open(1024)
+        mock_open.assert_called_once_with(
+            mock_stdin.fileno.return_value, 'rb', buffering=0,
+            closefd=False
+        )
+        assert stream.data_stream == mock_open.return_value
+        assert stream.byte_size == 1024
+
+    def test_context_manager(self):
+        data_stream = mock.Mock()
+        with PipeStream(data_stream, 512):
+            pass
+        data_stream.close.assert_called_once_with()
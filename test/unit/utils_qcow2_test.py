@@ -0,0 +1,182 @@
+from .test_helper import argv_kiwi_tests
+
+import os
+import struct
+import zlib
+from pytest import raises
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from azurectl.utils.mappedimage import MappedImage
+from azurectl.utils.qcow2 import QCow2
+from azurectl.utils.vhd import VHDFooter
+
+from azurectl.azurectl_exceptions import AzureQCow2FormatError
+
+
+class TestQCow2:
+    def setup(self):
+        self.image_dir = mkdtemp()
+        self.cluster_bits = 9
+        self.cluster_size = 512
+
+    def teardown(self):
+        rmtree(self.image_dir)
+
+    def __deflate(self, data):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -12)
+        return compressor.compress(data) + compressor.flush()
+
+    def __header(
+        self, size, l1_size, l1_table_offset, version=3,
+        backing_file_offset=0, crypt_method=0, incompatible_features=0
+    ):
+        header = struct.pack(
+            '>4sIQIIQIIQQIIQ', QCow2.MAGIC, version, backing_file_offset, 0,
+            self.cluster_bits, size, crypt_method, l1_size, l1_table_offset,
+            0, 0, 0, 0
+        )
+        if version == 3:
+            header += struct.pack('>QQQII', incompatible_features, 0, 0, 4, 104)
+        return header
+
+    def __qcow2(self, clusters, size, **header_args):
+        """
+            qcow2 image of the given size with one L2 table, clusters
+            maps guest cluster numbers to their data, to a tuple of
+            the deflated data of compressed clusters or to None for
+            zero clusters
+        """
+        cs = self.cluster_size
+        l1_table_offset = cs
+        l2_table_offset = 2 * cs
+        data = b''
+        data_offset = 3 * cs
+        l2_table = [0] * (cs // 8)
+        for cluster, cluster_data in sorted(clusters.items()):
+            if cluster_data is None:
+                l2_table[cluster] = QCow2.ZERO
+            elif isinstance(cluster_data, tuple):
+                # compressed data starts at an odd offset
+                compressed = b'\xff' + cluster_data[0]
+                offset = data_offset + len(data) + 1
+                sectors = (len(compressed) + 511) // 512 - 1
+                l2_table[cluster] = QCow2.COMPRESSED | \
+                    (sectors << (62 - (self.cluster_bits - 8))) | offset
+                data += compressed + bytes(-len(compressed) % cs)
+            else:
+                l2_table[cluster] = data_offset + len(data)
+                data += cluster_data
+        header = self.__header(size, 2, l1_table_offset, **header_args)
+        # the second L1 entry is beyond the virtual size
+        image = header + bytes(cs - len(header)) + \
+            struct.pack('>QQ', l2_table_offset | 1 << 63, 0) + \
+            bytes(cs - 16) + \
+            struct.pack('>%dQ' % len(l2_table), *l2_table) + data
+        return self.__write(image)
+
+    def __write(self, data):
+        file_name = os.path.join(self.image_dir, 'image.qcow2')
+        with open(file_name, 'wb') as image:
+            image.write(data)
+        return file_name
+
+    def test_open(self):
+        cs = self.cluster_size
+        packed = b'c' * 300 + b'd' * 212
+        file_name = self.__qcow2(
+            {
+                0: b'a' * cs, 1: b'b' * cs, 3: (self.__deflate(packed),),
+                4: None, 6: b'e' * cs
+            }, 7 * cs - 100
+        )
+        with QCow2.open(file_name) as stream:
+            assert isinstance(stream, MappedImage)
+            assert stream.virtual_size == VHDFooter.ALIGNMENT
+            image_map = stream.image_map
+            # the contiguous clusters 0 and 1 are merged, the zero
+            # cluster is not mapped, the last cluster is clipped
+            assert list(image_map.guest_offsets) == [0, 3 * cs, 6 * cs]
+            assert list(image_map.lengths) == [2 * cs, cs, cs - 100]
+            assert stream.seek_data() == 0
+            assert stream.read(4 * cs) == b'a' * cs + b'b' * cs
+            assert stream.seek_data() == 3 * cs
+            assert stream.read(4 * cs) == packed
+            assert stream.seek_data() == 6 * cs
+            assert stream.read(4 * cs) == b'e' * (cs - 100) + bytes(100)
+            assert stream.seek_data() == VHDFooter.ALIGNMENT
+            footer = stream.read(1024)
+            assert footer[:8] == VHDFooter.COOKIE
+            assert struct.unpack_from('>Q', footer, 48)[0] == \
+                VHDFooter.ALIGNMENT
+        assert QCow2.uncompressed_size(file_name) == \
+            VHDFooter.ALIGNMENT + VHDFooter.FOOTER_SIZE
+
+    def test_open_version_2(self):
+        file_name = self.__qcow2({0: b'a' * 512}, 1024, version=2)
+        with QCow2.open(file_name) as stream:
+            assert stream.read(512) == b'a' * 512
+
+    def test_open_dirty(self):
+        file_name = self.__qcow2(
+            {0: b'a' * 512}, 1024,
+            incompatible_features=QCow2.INCOMPATIBLE_DIRTY
+        )
+        with QCow2.open(file_name) as stream:
+            assert stream.read(512) == b'a' * 512
+
+    def test_open_unallocated_l2_table(self):
+        header = self.__header(1024, 1, 512)
+        file_name = self.__write(
+            header + bytes(512 - len(header)) + bytes(8)
+        )
+        with QCow2.open(file_name) as stream:
+            assert len(stream.image_map) == 0
+            assert stream.seek_data() == VHDFooter.ALIGNMENT
+
+    def test_compressed_cluster_corrupt(self):
+        file_name = self.__qcow2({0: (b'\xff' * 16,)}, 1024)
+        with QCow2.open(file_name) as stream:
+            with raises(AzureQCow2FormatError):
+                stream.read(512)
+
+    def test_compressed_cluster_short(self):
+        file_name = self.__qcow2({0: (self.__deflate(b'a' * 100),)}, 1024)
+        with QCow2.open(file_name) as stream:
+            with raises(AzureQCow2FormatError):
+                stream.read(512)
+
+    def test_not_qcow2(self):
+        file_name = self.__write(bytes(1024))
+        with raises(AzureQCow2FormatError):
+            QCow2.open(file_name)
+        with raises(AzureQCow2FormatError):
+            QCow2.uncompressed_size(file_name)
+
+    def test_unsupported(self):
+        for header_args in [
+            {'version': 4},
+            {'backing_file_offset': 1024},
+            {'crypt_method': 1},
+            {'incompatible_features': 2}
+        ]:
+            file_name = self.__qcow2({}, 1024, **header_args)
+            with raises(AzureQCow2FormatError):
+                QCow2.open(file_name)
+
+    def test_invalid_cluster_bits(self):
+        self.cluster_bits = 8
+        file_name = self.__write(self.__header(1024, 1, 512))
+        with raises(AzureQCow2FormatError):
+            QCow2.open(file_name)
+
+    def test_truncated_header(self):
+        file_name = self.__write(self.__header(1024, 1, 512)[:76])
+        with raises(AzureQCow2FormatError):
+            QCow2.open(file_name)
+
+    def test_truncated_table(self):
+        header = self.__header(1024, 1, 512)
+        file_name = self.__write(header + bytes(512 - len(header)))
+        with raises(AzureQCow2FormatError):
+            QCow2.open(file_name)
@@ -0,0 +1,24 @@
+from .test_helper import argv_kiwi_tests
+
+from azurectl.utils.ranges import ByteRanges
+
+
+class TestByteRanges:
+    def test_merge(self):
+        assert ByteRanges.merge([[5, 10], [0, 5], [20, 30], [25, 26]]) == \
+            [[0, 10], [20, 30]]
+
+    def test_intersect(self):
+        assert ByteRanges.intersect([[0, 10], [20, 30]], [[5, 25]]) == \
+            [[5, 10], [20, 25]]
+        assert ByteRanges.intersect([[0, 10]], []) == []
+
+    def test_subtract(self):
+        assert ByteRanges.subtract(
+            [[0, 10], [20, 30]], [[5, 7], [8, 25], [29, 40]]
+        ) == [[0, 5], [7, 8], [25, 29]]
+        assert ByteRanges.subtract([[0, 10]], []) == [[0, 10]]
+        assert ByteRanges.subtract([[0, 10]], [[0, 10]]) == []
+
+    def test_size(self):
+        assert ByteRanges.size([[0, 10], [20, 25]]) == 15
@@ -0,0 +1,72 @@
+from .test_helper import argv_kiwi_tests
+
+import io
+import mock
+from pytest import raises
+
+from azurectl.utils.readahead import ReadAhead
+
+
+class TestReadAhead:
+    def setup(self):
+        self.data = b'x' * 1024 + b'y' * 1024 + b'z' * 512
+
+    def test_read(self):
+        with ReadAhead(io.BytesIO(self.data), 1024, 4096) as read_ahead:
+            chunk = read_ahead.read(1024)
+            assert chunk == b'x' * 1024
+            assert isinstance(chunk, bytearray)
+            assert read_ahead.read(512) == b'y' * 512
+            assert read_ahead.seek_data() == 1536
+            assert read_ahead.read(1024) == b'y' * 512
+            assert read_ahead.read(1024) == b'z' * 512
+            assert read_ahead.read(1024) is None
+            assert read_ahead.read(1024) is None
+            assert read_ahead.seek_data() == 2560
+
+    def test_offset(self):
+        data_stream = io.BytesIO(self.data)
+        with ReadAhead(data_stream, 1024, 4096, offset=4096) as read_ahead:
+            assert read_ahead.seek_data() == 4096
+            read_ahead.read(1024)
+            assert read_ahead.seek_data() == 5120
+
+    def test_read_stream_without_readinto(self):
+        data_stream = mock.Mock(spec=['read', 'close'])
+        data_stream.read.side_effect = [b'foo', None]
+        with ReadAhead(data_stream, 1024, 1024) as read_ahead:
+            assert read_ahead.read(1024) == b'foo'
+            assert read_ahead.read(1024) is None
+        data_stream.read.assert_called_with(1024)
+        data_stream.close.assert_called_once_with()
+
+    def test_seek_data(self):
+        data_stream = mock.Mock(spec=['read', 'seek_data', 'close'])
+        data_stream.seek_data.side_effect = [4096, 8192, 9216]
+        data_stream.read.side_effect = [b'a' * 1024, b'b' * 1024, b'']
+        with ReadAhead(data_stream, 1024, 1024, 4096) as read_ahead:
+            assert read_ahead.seek_data(512) == 4096
+            assert read_ahead.read(1024) == b'a' * 1024
+            assert read_ahead.seek_data() == 8192
+            assert read_ahead.read(1024) == b'b' * 1024
+            assert read_ahead.seek_data() == 9216
+            assert read_ahead.read(1024) is None
+        data_stream.seek_data.assert_called_with(4096)
+
+    def test_read_raises(self):
+        data_stream = mock.Mock(spec=['read', 'close'])
+        data_stream.read.side_effect = EOFError
+        with ReadAhead(data_stream, 1024, 1024) as read_ahead:
+            with raises(EOFError):
+                read_ahead.read(1024)
+            assert read_ahead.read(1024) is None
+
+    def test_close_blocked_reader(self):
+        data_stream = mock.Mock(spec=['read', 'close'])
+        data_stream.read.return_value = b'x' * 1024
+        read_ahead = ReadAhead(data_stream, 1024, 2048)
+        assert read_ahead.chunks.maxsize == 2
+        assert read_ahead.read(1024) == b'x' * 1024
+        read_ahead.close()
+        assert not read_ahead.reader.is_alive()
+        data_stream.close.assert_called_once_with()
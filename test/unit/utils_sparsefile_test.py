@@ -0,0 +1,109 @@
+from .test_helper import argv_kiwi_tests
+
+import errno
+import os
+import mock
+from tempfile import NamedTemporaryFile
+
+from azurectl.utils.sparsefile import SparseFile
+
+
+class TestSparseFile:
+    def setup(self):
+        self.file_stream = mock.Mock()
+        self.sparse_file = SparseFile(self.file_stream)
+
+    def test_seek_data(self):
+        self.file_stream.seek.side_effect = [1100, 3000, 1024]
+        assert self.sparse_file.seek_data() == 1024
+        assert self.file_stream.seek.call_args_list == [
+            mock.call(0, os.SEEK_DATA),
+            mock.call(1100, os.SEEK_HOLE),
+            mock.call(1024)
+        ]
+        assert self.sparse_file.data_end == 3072
+
+    def test_seek_data_aligned(self):
+        self.file_stream.seek.side_effect = [5000, 9000, 4096]
+        assert self.sparse_file.seek_data(4096) == 4096
+        self.file_stream.seek.assert_called_with(4096)
+        assert self.sparse_file.data_end == 12288
+
+    def test_seek_data_within_extent(self):
+        self.sparse_file.data_end = 4096
+        self.sparse_file.position = 1024
+        assert self.sparse_file.seek_data() == 1024
+        assert not self.file_stream.seek.called
+
+    def test_seek_data_no_more_data(self):
+        self.file_stream.seek.side_effect = [
+            OSError(errno.ENXIO, 'No such device or address'), 8192
+        ]
+        assert self.sparse_file.seek_data() == 8192
+        self.file_stream.seek.assert_called_with(0, os.SEEK_END)
+
+    def test_seek_data_not_supported(self):
+        self.file_stream.seek.side_effect = [
+            OSError(errno.EINVAL, 'Invalid argument'), 0
+        ]
+        assert self.sparse_file.seek_data() == 0
+        assert self.sparse_file.hole_support is False
+        assert self.sparse_file.seek_data() == 0
+        assert len(self.file_stream.seek.call_args_list) == 2
+
+    def test_seek(self):
+        self.sparse_file.data_end = 1024
+        self.file_stream.seek.return_value = 4096
+        assert self.sparse_file.seek(4096) == 4096
+        self.file_stream.seek.assert_called_once_with(4096)
+        assert self.sparse_file.position == 4096
+        assert self.sparse_file.data_end is None
+
+    def test_read_within_extent(self):
+        self.sparse_file.data_end = 1024
+
+        def readinto(view):
+            view[:] = b'x' * len(view)
+            return len(view)
+
+        self.file_stream.readinto.side_effect = readinto
+        assert self.sparse_file.read(4096) == b'x' * 1024
+        assert self.sparse_file.position == 1024
+        assert self.sparse_file.read(4096) is None
+
+    def test_readinto_within_extent(self):
+        self.sparse_file.data_end = 1024
+        self.file_stream.readinto.return_value = 1024
+        buffer = bytearray(4096)
+        assert self.sparse_file.readinto(buffer) == 1024
+        view = self.file_stream.readinto.call_args[0][0]
+        assert len(view) == 1024
+        assert view.obj is buffer
+        assert self.sparse_file.position == 1024
+
+    def test_readinto(self):
+        with NamedTemporaryFile() as data_file:
+            data_file.write(b'foo')
+            data_file.flush()
+            buffer = bytearray(8)
+            with SparseFile.open(data_file.name) as sparse_file:
+                assert sparse_file.readinto(buffer) == 3
+                assert sparse_file.readinto(buffer) == 0
+        assert buffer[:3] == b'foo'
+
+    def test_read_sparse_file(self):
+        with NamedTemporaryFile() as sparse:
+            sparse.truncate(1024 * 1024)
+            sparse.seek(512 * 1024)
+            sparse.write(b'foo')
+            sparse.flush()
+            data = b''
+            with SparseFile.open(sparse.name) as sparse_file:
+                while True:
+                    position = sparse_file.seek_data()
+                    chunk = sparse_file.read(4096)
+                    if not chunk:
+                        break
+                    data = data.ljust(position, b'\0') + chunk
+        assert data.ljust(1024 * 1024, b'\0') == \
+            b'\0' * 512 * 1024 + b'foo' + b'\0' * (512 * 1024 - 3)
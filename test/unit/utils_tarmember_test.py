@@ -0,0 +1,389 @@
+from .test_helper import argv_kiwi_tests
+
+import io
+import mock
+import tarfile
+from pytest import raises
+
+from azurectl.utils.tarmember import TarMember
+
+from azurectl.azurectl_exceptions import (
+    AzureStorageStreamError,
+    AzureTarArchiveError
+)
+
+
+class UnseekableStream(object):
+    # data stream without seek, like a decompressor
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def readinto(self, buffer):
+        return self.data.readinto(buffer)
+
+    def close(self):
+        self.data.close()
+
+
+class TestTarMember:
+    def setup(self):
+        # a sparse member of 16k holding data at [1024, 2048) and
+        # [4096, 4608) followed by a hole
+        self.sparse_regions = [(1024, 1024), (4096, 512)]
+        self.sparse_data = b'a' * 1024 + b'b' * 512
+        self.sparse_image = bytes(1024) + b'a' * 1024 + bytes(2048) + \
+            b'b' * 512 + bytes(12288 - 512)
+
+    def __member(
+        self, tar, name, data, type_flag=tarfile.REGTYPE, pax=None
+    ):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.type = type_flag
+        info.pax_headers = pax or {}
+        tar.addfile(info, io.BytesIO(data))
+
+    def __archive(self, members, tar_format=tarfile.GNU_FORMAT, **tar_args):
+        archive = io.BytesIO()
+        with tarfile.open(
+            fileobj=archive, mode='w', format=tar_format, **tar_args
+        ) as tar:
+            for member in members:
+                self.__member(tar, *member)
+        return archive.getvalue()
+
+    def __header(self, name, size, type_flag, magic=b'ustar  \x00'):
+        header = bytearray(512)
+        header[0:len(name)] = name
+        header[100:108] = b'0000644\x00'
+        header[124:136] = b'%011o\x00' % size
+        header[156:157] = type_flag
+        header[257:265] = magic
+        return header
+
+    def __checksum(self, header):
+        header[148:156] = b' ' * 8
+        header[148:156] = b'%06o\x00 ' % sum(header)
+        return bytes(header)
+
+    def __padded(self, data):
+        return data + bytes(-len(data) % 512)
+
+    def __pax_header(self, records):
+        data = b''
+        for key, value in records:
+            record = b' %s=%s\n' % (key, value)
+            length = len(record) + 1
+            length += len(str(length + len(record))) - 1
+            data += b'%d%s' % (length, record)
+        return self.__checksum(
+            self.__header(b'PaxHeaders/disk.raw', len(data), b'x')
+        ) + self.__padded(data)
+
+    def __regions(self, member):
+        return list(
+            zip(member.image_map.guest_offsets, member.image_map.lengths)
+        )
+
+    def __read_image(self, member):
+        image = bytearray(member.byte_size)
+        ranges = []
+        while True:
+            offset = member.seek_data()
+            data = member.read(4096)
+            if not data:
+                break
+            ranges.append((offset, len(data)))
+            image[offset:offset + len(data)] = data
+        return bytes(image), ranges
+
+    def test_read(self):
+        archive = self.__archive(
+            [
+                ('first', b'z' * 700),
+                ('dir', b'', tarfile.DIRTYPE),
+                ('l' * 120, b'y' * 100),
+                ('disk.raw', b'x' * 1500)
+            ]
+        )
+        with TarMember(io.BytesIO(archive), 'disk.raw') as member:
+            assert member.byte_size == 1500
+            assert member.read(1000) == b'x' * 1000
+            assert member.read(1000) == b'x' * 500
+            assert member.read(1000) is None
+
+    def test_read_sequential_stream(self):
+        archive = self.__archive(
+            [('first', b'z' * 700), ('./disk.raw', b'x' * 1500)]
+        )
+        member = TarMember(UnseekableStream(archive), '/disk.raw')
+        assert member.read(2000) == b'x' * 1500
+
+    def test_read_long_name(self):
+        name = 'images/' + 'l' * 120
+        archive = self.__archive([('first', b'z' * 700), (name, b'x' * 10)])
+        assert TarMember(io.BytesIO(archive), name).read(20) == b'x' * 10
+
+    def test_read_ustar_prefix(self):
+        name = 'p' * 80 + '/' + 'n' * 80
+        archive = self.__archive(
+            [(name, b'x' * 10)], tar_format=tarfile.USTAR_FORMAT
+        )
+        assert archive[345:353] == b'p' * 8
+        assert TarMember(io.BytesIO(archive), name).read(20) == b'x' * 10
+
+    def test_read_pax(self):
+        archive = self.__archive(
+            [('first', b'z' * 700), ('l' * 120, b'x' * 10)],
+            tar_format=tarfile.PAX_FORMAT, pax_headers={'comment': 'images'}
+        )
+        # global header, pax header with the path, member
+        assert archive[156:157] == b'g'
+        member = TarMember(io.BytesIO(archive), 'l' * 120)
+        assert member.read(20) == b'x' * 10
+
+    def test_read_pax_size(self):
+        archive = self.__pax_header([(b'size', b'10')]) + self.__checksum(
+            self.__header(b'first', 0, b'0')
+        ) + self.__padded(b'z' * 10) + self.__archive([('disk.raw', b'x')])
+        assert TarMember(io.BytesIO(archive), 'disk.raw').read(2) == b'x'
+
+    def test_sparse_old_gnu(self):
+        # four regions fit into the header, the others go to an
+        # extension block
+        regions = [(512 * 2 * i, 512) for i in range(6)]
+        header = self.__header(b'disk.raw', 6 * 512, b'S')
+        for index, (offset, length) in enumerate(regions[:4]):
+            header[386 + index * 24:410 + index * 24] = \
+                b'%011o\x00%011o\x00' % (offset, length)
+        header[482] = 1
+        header[483:495] = b'%011o\x00' % 8192
+        extension = bytearray(512)
+        for index, (offset, length) in enumerate(regions[4:]):
+            extension[index * 24:index * 24 + 24] = \
+                b'%011o\x00%011o\x00' % (offset, length)
+        data = b''.join(bytes([65 + i]) * 512 for i in range(6))
+        sparse_member = self.__checksum(header) + bytes(extension) + data
+        # the extension block of a sparse member skipped is read along
+        # with its header
+        header[0:5] = b'first'
+        archive = self.__checksum(header) + bytes(extension) + data + \
+            sparse_member
+        member = TarMember(io.BytesIO(archive), 'disk.raw')
+        assert member.byte_size == 8192
+        assert self.__regions(member) == regions
+        image, ranges = self.__read_image(member)
+        assert ranges == regions
+        for offset, length in regions:
+            assert image[offset:offset + length] == \
+                bytes([65 + offset // 1024]) * 512
+        assert image[512:1024] == bytes(512)
+
+    def test_sparse_pax_0_0(self):
+        archive = self.__pax_header(
+            [
+                (b'GNU.sparse.size', b'16384'),
+                (b'GNU.sparse.numblocks', b'2'),
+                (b'GNU.sparse.offset', b'1024'),
+                (b'GNU.sparse.numbytes', b'1024'),
+                (b'GNU.sparse.offset', b'4096'),
+                (b'GNU.sparse.numbytes', b'512')
+            ]
+        ) + self.__checksum(
+            self.__header(b'disk.raw', len(self.sparse_data), b'0')
+        ) + self.sparse_data
+        member = TarMember(io.BytesIO(archive), 'disk.raw')
+        image, ranges = self.__read_image(member)
+        assert image == self.sparse_image
+        assert ranges == [(1024, 1024), (4096, 512)]
+
+    def test_sparse_pax_0_1(self):
+        archive = self.__archive(
+            [
+                (
+                    'GNUSparseFile.0/disk.raw', self.sparse_data,
+                    tarfile.REGTYPE, {
+                        'GNU.sparse.map': '1024,1024,4096,512,16384,0',
+                        'GNU.sparse.size': '16384',
+                        'GNU.sparse.name': 'disk.raw'
+                    }
+                )
+            ], tar_format=tarfile.PAX_FORMAT
+        )
+        member = TarMember(io.BytesIO(archive), 'disk.raw')
+        # the trailing empty region marks the size only
+        assert self.__regions(member) == [(1024, 1024), (4096, 512)]
+        image, ranges = self.__read_image(member)
+        assert image == self.sparse_image
+
+    def test_sparse_pax_1_0(self):
+        sparse_map = self.__padded(b'2\n1024\n1024\n4096\n512\n')
+        archive = self.__archive(
+            [
+                (
+                    'GNUSparseFile.0/disk.raw', sparse_map + self.sparse_data,
+                    tarfile.REGTYPE, {
+                        'GNU.sparse.major': '1',
+                        'GNU.sparse.minor': '0',
+                        'GNU.sparse.realsize': '16384',
+                        'GNU.sparse.name': 'disk.raw'
+                    }
+                )
+            ], tar_format=tarfile.PAX_FORMAT
+        )
+        member = TarMember(io.BytesIO(archive), 'disk.raw')
+        image, ranges = self.__read_image(member)
+        assert image == self.sparse_image
+
+    def test_sparse_pax_1_0_map_blocks(self):
+        # the map spans two blocks
+        offsets = range(0, 200 * 1024, 1024)
+        sparse_map = b'200\n' + b''.join(
+            b'%d\n1\n' % offset for offset in offsets
+        )
+        assert len(sparse_map) > 512
+        archive = self.__archive(
+            [
+                (
+                    'GNUSparseFile.0/disk.raw',
+                    self.__padded(sparse_map) + b'x' * 200,
+                    tarfile.REGTYPE, {
+                        'GNU.sparse.major': '1',
+                        'GNU.sparse.minor': '0',
+                        'GNU.sparse.realsize': '204800',
+                        'GNU.sparse.name': 'disk.raw'
+                    }
+                )
+            ], tar_format=tarfile.PAX_FORMAT
+        )
+        member = TarMember(io.BytesIO(archive), 'disk.raw')
+        assert len(self.__regions(member)) == 200
+        image, ranges = self.__read_image(member)
+        assert image.count(b'x') == 200
+        assert image[1024] == ord('x')
+
+    def test_seek_data_aligned(self):
+        archive = self.__archive(
+            [
+                (
+                    'disk.raw', self.sparse_data, tarfile.REGTYPE, {
+                        'GNU.sparse.map': '1024,1024,4096,512',
+                        'GNU.sparse.size': '16384',
+                        'GNU.sparse.name': 'disk.raw'
+                    }
+                )
+            ], tar_format=tarfile.PAX_FORMAT
+        )
+        member = TarMember(io.BytesIO(archive), 'disk.raw')
+        assert member.seek_data(4096) == 0
+        assert member.data_end == 4096
+        assert member.read(16384) == self.sparse_image[:4096]
+        assert member.seek_data(4096) == 4096
+        assert member.data_end == 8192
+        assert member.read(16384) == self.sparse_image[4096:8192]
+        assert member.seek_data(4096) == 16384
+        assert member.read(16384) is None
+        # within the data range
+        member.position = 0
+        member.data_end = 4096
+        assert member.seek_data() == 0
+
+    def test_seek_data_contiguous_regions(self):
+        archive = self.__archive(
+            [
+                (
+                    'disk.raw', b'a' * 1024, tarfile.REGTYPE, {
+                        'GNU.sparse.map': '512,512,1024,512',
+                        'GNU.sparse.size': '4096',
+                        'GNU.sparse.name': 'disk.raw'
+                    }
+                )
+            ], tar_format=tarfile.PAX_FORMAT
+        )
+        member = TarMember(io.BytesIO(archive), 'disk.raw')
+        assert member.seek_data() == 512
+        assert member.data_end == 1536
+        assert member.read(4096) == b'a' * 1024
+
+    def test_seek(self):
+        archive = self.__archive(
+            [('disk.raw', b'a' * 1024 + b'b' * 1024)]
+        )
+        member = TarMember(UnseekableStream(archive), 'disk.raw')
+        assert member.read(512) == b'a' * 512
+        assert member.seek(1536) == 1536
+        assert member.read(1024) == b'b' * 512
+        member.seek(0)
+        with raises(AzureStorageStreamError):
+            member.read(512)
+
+    def test_member_ends_early(self):
+        archive = self.__archive([('disk.raw', b'a' * 1024)])
+        member = TarMember(io.BytesIO(archive[:1024]), 'disk.raw')
+        with raises(EOFError):
+            member.read(1024)
+
+    def test_base_256_size(self):
+        header = self.__header(b'disk.raw', 0, b'0')
+        header[124:136] = b'\x80' + (1024).to_bytes(11, 'big')
+        archive = self.__checksum(header) + b'x' * 1024
+        member = TarMember(io.BytesIO(archive), 'disk.raw')
+        assert member.byte_size == 1024
+
+    def test_member_not_found(self):
+        archive = self.__archive([('first', b'z' * 700)])
+        with raises(AzureTarArchiveError):
+            TarMember(io.BytesIO(archive), 'disk.raw')
+        with raises(AzureTarArchiveError):
+            TarMember(io.BytesIO(archive[:1536]), 'disk.raw')
+
+    def test_not_regular_file(self):
+        archive = self.__archive([('disk.raw', b'', tarfile.DIRTYPE)])
+        with raises(AzureTarArchiveError):
+            TarMember(io.BytesIO(archive), 'disk.raw')
+
+    def test_invalid_checksum(self):
+        archive = bytearray(self.__archive([('disk.raw', b'x')]))
+        archive[0] = ord('D')
+        with raises(AzureTarArchiveError):
+            TarMember(io.BytesIO(bytes(archive)), 'disk.raw')
+
+    def test_invalid_number(self):
+        header = self.__header(b'disk.raw', 0, b'0')
+        header[124:136] = b'12345678901x'
+        with raises(AzureTarArchiveError):
+            TarMember(io.BytesIO(self.__checksum(header)), 'disk.raw')
+
+    def test_invalid_sparse_map(self):
+        for sparse_map in ['4096,512,1024,512', '16000,1024']:
+            archive = self.__archive(
+                [
+                    (
+                        'disk.raw', b'x' * 1024, tarfile.REGTYPE, {
+                            'GNU.sparse.map': sparse_map,
+                            'GNU.sparse.size': '16384',
+                            'GNU.sparse.name': 'disk.raw'
+                        }
+                    )
+                ], tar_format=tarfile.PAX_FORMAT
+            )
+            with raises(AzureTarArchiveError):
+                TarMember(io.BytesIO(archive), 'disk.raw')
+
+    def test_decompress_time(self):
+        archive = self.__archive([('disk.raw', b'x')])
+        data_stream = UnseekableStream(archive)
+        member = TarMember(data_stream, 'disk.raw')
+        assert member.decompress_time == 0
+        data_stream.decompress_time = 2.5
+        assert member.decompress_time == 2.5
+
+    def test_close(self):
+        data_stream = mock.Mock()
+        data_stream.readinto.side_effect = lambda view: 0
+        with raises(AzureTarArchiveError):
+            TarMember(data_stream, 'disk.raw')
+        archive = self.__archive([('disk.raw', b'x')])
+        stream = io.BytesIO(archive)
+        TarMember(stream, 'disk.raw').close()
+        assert stream.closed
@@ -35,6 +35,19 @@ class TestValidations:
         with raises(AzureInvalidCommand):
             Validations.validate_max_length('foo', '1234567890', 5)
 
+    def test_good_size(self):
+        assert Validations.validate_size('--size', '1024', 512) == 1024
+        assert Validations.validate_size('--size', '42') == 42
+
+    def test_bad_size(self):
+        for size in ('1k', '0', '-512'):
+            with raises(AzureInvalidCommand):
+                Validations.validate_size('--size', size, 512)
+
+    def test_unaligned_size(self):
+        with raises(AzureInvalidCommand):
+            Validations.validate_size('--size', '1000', 512)
+
     def test_good_at_least_one_argument_is_set(self):
         result = Validations.validate_at_least_one_argument_is_set(
             self.command_args,
@@ -0,0 +1,229 @@
+from .test_helper import argv_kiwi_tests
+
+import io
+import mock
+import os
+import struct
+from mock import patch
+from pytest import raises
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from azurectl.utils.mappedimage import MappedImage
+from azurectl.utils.vhd import (
+    DynamicVHD,
+    FixedVHD,
+    VHDFooter
+)
+
+from azurectl.azurectl_exceptions import AzureVHDFormatError
+
+
+class TestVHDFooter:
+    def test_aligned_size(self):
+        assert VHDFooter.aligned_size(0) == 0
+        assert VHDFooter.aligned_size(1) == VHDFooter.ALIGNMENT
+        assert VHDFooter.aligned_size(VHDFooter.ALIGNMENT) == \
+            VHDFooter.ALIGNMENT
+
+    @patch('azurectl.utils.vhd.time.time')
+    @patch('azurectl.utils.vhd.uuid4')
+    def test_fixed(self, mock_uuid4, mock_time):
+        mock_time.return_value = 1471858765.5
+        mock_uuid4.return_value.bytes = b'u' * 16
+        footer = VHDFooter.fixed(1073741824)
+        assert len(footer) == VHDFooter.FOOTER_SIZE
+        assert footer[:8] == b'conectix'
+        assert struct.unpack_from('>IIQI4sI4s', footer, 8) == (
+            2, 0x00010000, 0xffffffffffffffff, 1471858765 - 946684800,
+            b'wa\x00\x00', 0x00070000, b'Wi2k'
+        )
+        assert struct.unpack_from('>QQII', footer, 40) == (
+            1073741824, 1073741824, 0x0820103f, 2
+        )
+        assert footer[68:84] == b'u' * 16
+        checksum = struct.unpack_from('>I', footer, 64)[0]
+        assert checksum == ~(sum(footer) - sum(footer[64:68])) & 0xffffffff
+
+
+class TestFixedVHD:
+    def setup(self):
+        self.data = b'a' * 1000
+        self.vhd = FixedVHD(io.BytesIO(self.data), len(self.data))
+
+    def test_read(self):
+        assert self.vhd.byte_size == VHDFooter.ALIGNMENT + 512
+        data = self.vhd.read(VHDFooter.ALIGNMENT + 1024)
+        assert len(data) == VHDFooter.ALIGNMENT + 512
+        assert data[:1000] == self.data
+        assert data[1000:VHDFooter.ALIGNMENT] == \
+            bytes(VHDFooter.ALIGNMENT - 1000)
+        assert data[VHDFooter.ALIGNMENT:] == self.vhd.footer
+        assert struct.unpack_from('>Q', self.vhd.footer, 48)[0] == \
+            VHDFooter.ALIGNMENT
+        assert self.vhd.read(512) is None
+
+    def test_readinto_chunks(self):
+        buffer = bytearray(4096)
+        assert self.vhd.readinto(buffer) == 4096
+        assert bytes(buffer[:1000]) == self.data
+        self.vhd.position = VHDFooter.ALIGNMENT - 100
+        assert self.vhd.readinto(buffer) == 612
+        assert bytes(buffer[100:612]) == self.vhd.footer
+
+    def test_seek_data(self):
+        assert self.vhd.seek_data() == 0
+        assert self.vhd.read(512) == self.data[:512]
+        assert self.vhd.seek_data() == 512
+        assert self.vhd.read(512) == self.data[512:] + bytes(24)
+        # the padding is skipped
+        assert self.vhd.seek_data() == VHDFooter.ALIGNMENT
+        assert self.vhd.read(1024) == self.vhd.footer
+        assert self.vhd.seek_data() == VHDFooter.ALIGNMENT + 512
+
+    def test_seek_data_unaligned_end(self):
+        self.vhd.position = 1000
+        assert self.vhd.seek_data() == 1000
+        assert self.vhd.read(24) == bytes(24)
+        assert self.vhd.seek_data() == VHDFooter.ALIGNMENT
+
+    def test_seek_data_sparse(self):
+        data_stream = mock.Mock()
+        data_stream.seek_data.return_value = 4096
+        data_stream.readinto.return_value = 512
+        vhd = FixedVHD(data_stream, 8192)
+        assert vhd.seek_data(4096) == 4096
+        data_stream.seek_data.assert_called_once_with(4096)
+        # a short read of the data stream ends the read
+        assert vhd.readinto(bytearray(1024)) == 512
+        assert vhd.position == 4608
+        data_stream.seek_data.return_value = 8192
+        assert vhd.seek_data() == VHDFooter.ALIGNMENT
+
+    def test_seek_data_sparse_unaligned_end(self):
+        data_stream = mock.Mock()
+        data_stream.seek_data.return_value = 3146728
+        vhd = FixedVHD(data_stream, 3146728)
+        vhd.position = 2048
+        # the trailing hole ends off the page alignment
+        assert vhd.seek_data() == 4 * VHDFooter.ALIGNMENT
+        assert vhd.read(1024) == vhd.footer
+        assert not data_stream.readinto.called
+
+    def test_data_stream_ends_early(self):
+        vhd = FixedVHD(io.BytesIO(b'a' * 512), 1024)
+        assert vhd.read(2048) == b'a' * 512
+        with raises(EOFError):
+            vhd.read(2048)
+
+    def test_context_manager(self):
+        data_stream = mock.Mock()
+        with FixedVHD(data_stream, 512):
+            pass
+        data_stream.close.assert_called_once_with()
+
+
+class TestDynamicVHD:
+    def setup(self):
+        self.image_dir = mkdtemp()
+        self.block_size = 4096
+
+    def teardown(self):
+        rmtree(self.image_dir)
+
+    def __footer(self, current_size, disk_type=VHDFooter.DISK_TYPE_DYNAMIC):
+        footer = bytearray(VHDFooter.fixed(current_size))
+        struct.pack_into('>Q', footer, 16, 512)
+        struct.pack_into('>I', footer, 60, disk_type)
+        return bytes(footer)
+
+    def __vhd(self, blocks, current_size, **footer_args):
+        """
+            dynamic VHD image of the given size, blocks maps block
+            numbers to their data
+        """
+        entries = -(-current_size // self.block_size) + 1
+        table_offset = 1536
+        data_offset = table_offset + entries * 4
+        data_offset += -data_offset % 512
+        # the sector bitmap of a 4k block is padded to one sector
+        table = [DynamicVHD.UNALLOCATED] * entries
+        data = b''
+        for block, block_data in sorted(blocks.items()):
+            table[block] = (data_offset + len(data)) // 512
+            data += b'\xff' * 512 + block_data
+        header = struct.pack(
+            '>8sQQIII', DynamicVHD.DYNAMIC_HEADER_COOKIE,
+            0xffffffffffffffff, table_offset, 0x00010000, entries,
+            self.block_size
+        )
+        table_data = struct.pack('>%dI' % entries, *table)
+        image = self.__footer(current_size, **footer_args) + header + \
+            bytes(1024 - len(header)) + table_data + \
+            bytes(data_offset - table_offset - len(table_data)) + data + \
+            self.__footer(current_size, **footer_args)
+        return self.__write(image)
+
+    def __write(self, data):
+        file_name = os.path.join(self.image_dir, 'image.vhd')
+        with open(file_name, 'wb') as image:
+            image.write(data)
+        return file_name
+
+    def test_open(self):
+        bs = self.block_size
+        file_name = self.__vhd(
+            {0: b'a' * bs, 1: b'b' * bs, 3: b'c' * bs}, 4 * bs - 1024
+        )
+        with DynamicVHD.open(file_name) as stream:
+            assert isinstance(stream, MappedImage)
+            assert stream.virtual_size == VHDFooter.ALIGNMENT
+            # blocks are separated by their sector bitmaps
+            assert len(stream.image_map) == 3
+            assert stream.seek_data() == 0
+            assert stream.read(4 * bs) == b'a' * bs + b'b' * bs
+            assert stream.seek_data() == 3 * bs
+            assert stream.read(4 * bs) == b'c' * (bs - 1024)
+            assert stream.seek_data() == VHDFooter.ALIGNMENT
+            footer = stream.read(1024)
+            assert footer[:8] == VHDFooter.COOKIE
+            assert struct.unpack_from('>Q4xI', footer, 48) == (
+                VHDFooter.ALIGNMENT, VHDFooter.DISK_TYPE_FIXED
+            )
+        assert DynamicVHD.uncompressed_size(file_name) == \
+            VHDFooter.ALIGNMENT + VHDFooter.FOOTER_SIZE
+
+    def test_differencing(self):
+        file_name = self.__vhd(
+            {}, 4096, disk_type=VHDFooter.DISK_TYPE_DIFFERENCING
+        )
+        with raises(AzureVHDFormatError):
+            DynamicVHD.open(file_name)
+
+    def test_not_dynamic(self):
+        file_name = self.__vhd({}, 4096, disk_type=VHDFooter.DISK_TYPE_FIXED)
+        with raises(AzureVHDFormatError):
+            DynamicVHD.uncompressed_size(file_name)
+
+    def test_no_footer(self):
+        file_name = self.__write(bytes(1024))
+        with raises(AzureVHDFormatError):
+            DynamicVHD.open(file_name)
+
+    def test_no_dynamic_header(self):
+        file_name = self.__write(self.__footer(4096) + bytes(1024))
+        with raises(AzureVHDFormatError):
+            DynamicVHD.open(file_name)
+
+    def test_invalid_block_size(self):
+        self.block_size = 1000
+        file_name = self.__vhd({}, 4096)
+        with raises(AzureVHDFormatError):
+            DynamicVHD.open(file_name)
+
+    def test_truncated_table(self):
+        with open(self.__vhd({}, 4096 * 1024), 'rb') as image:
+            data = image.read(1600)
+        file_name = self.__write(data)
+        with raises(AzureVHDFormatError):
+            DynamicVHD.open(file_name)
@@ -3,7 +3,19 @@ from .test_helper import argv_kiwi_tests
 from mock import patch
 import mock
 
-from azurectl.utils.xz import XZ
+from pytest import raises
+
+import io
+import lzma
+import struct
+import zlib
+
+from azurectl.utils.xz import (
+    XZ,
+    ParallelXZ
+)
+
+from azurectl.azurectl_exceptions import AzureXZIndexError
 
 
 class TestXZ:
@@ -16,6 +28,12 @@ class TestXZ:
     def test_read(self):
         assert self.xz.read(128) == b'foo\n'
 
+    def test_close_keeps_other_streams_open(self):
+        with XZ.open('../data/blob.xz') as other:
+            self.xz.close()
+            assert other.read(128) == b'foo\n'
+        self.xz = XZ.open('../data/blob.xz')
+
     def test_read_chunks(self):
         with XZ.open('../data/blob.more.xz') as xz:
             chunk = xz.read(8)
@@ -37,5 +55,195 @@ class TestXZ:
             chunk = xz.read(8)
             assert chunk is None
 
+    def test_readinto(self):
+        buffer = bytearray(10)
+        with XZ.open('../data/blob.more.xz') as xz:
+            assert xz.readinto(memoryview(buffer)[:4]) == 4
+            assert buffer[:4] == b'Some'
+            assert xz.readinto(buffer) == 10
+            assert buffer == b' data so t'
+            assert xz.read(8) == b'hat we c'
+            assert xz.decompress_time > 0
+
     def test_uncompressed_size(self):
         assert XZ.uncompressed_size('../data/blob.xz') == 4
+
+    def test_uncompressed_size_multiple_streams(self):
+        assert XZ.uncompressed_size('../data/blob.multistream.xz') == 25
+
+    def test_uncompressed_size_not_xz(self):
+        with raises(AzureXZIndexError):
+            XZ.uncompressed_size('../data/blob.broken.xz')
+        with raises(AzureXZIndexError):
+            XZ.uncompressed_size('../data/blob.raw')
+
+    def test_stream_indexes(self):
+        with open('../data/blob.multistream.xz', 'rb') as xz_file:
+            streams = XZ.stream_indexes(xz_file)
+        assert [stream['offset'] for stream in streams] == [0, 76]
+        assert streams[0]['records'][0][1] == 10
+        assert streams[1]['records'][0][1] == 15
+
+    def test_read_stream_padding(self):
+        data = lzma.compress(b'foo') + bytes(16) + lzma.compress(b'bar')
+        xz = XZ(io.BytesIO(data), buffer_size=4)
+        assert xz.read(8) == b'foobar'
+
+    def test_stream_indexes_padding_only(self):
+        assert XZ.stream_indexes(io.BytesIO(bytes(8))) == []
+
+    def test_stream_indexes_truncated(self):
+        with open('../data/blob.xz', 'rb') as xz_file:
+            data = xz_file.read()
+        with raises(AzureXZIndexError):
+            XZ.stream_indexes(io.BytesIO(data[-12:]))
+        with raises(AzureXZIndexError):
+            XZ.stream_indexes(io.BytesIO(data[:-4] + b'YZ\0\0'))
+        with raises(AzureXZIndexError):
+            XZ.stream_indexes(io.BytesIO(b'\0' + data[1:]))
+        with raises(AzureXZIndexError):
+            XZ._XZ__read_at(io.BytesIO(b'YZ'), 0, 4)
+
+    def test_parse_stream_footer_crc_mismatch(self):
+        with raises(AzureXZIndexError):
+            XZ._XZ__parse_stream_footer(bytes(10) + b'YZ')
+
+    def test_parse_index_invalid(self):
+        records = b'\x00\x01\x04\x04'
+        index = records + struct.pack('<I', zlib.crc32(records))
+        assert XZ._XZ__parse_index(index) == [(4, 4)]
+        with raises(AzureXZIndexError):
+            XZ._XZ__parse_index(b'\x01' + index[1:])
+        with raises(AzureXZIndexError):
+            XZ._XZ__parse_index(index[:-1] + b'\x00')
+        records = b'\x00\x01\x04\x04\x00\x00\x00\x00'
+        with raises(AzureXZIndexError):
+            XZ._XZ__parse_index(
+                records + struct.pack('<I', zlib.crc32(records))
+            )
+        records = b'\x00\x02\x04\x04'
+        with raises(AzureXZIndexError):
+            XZ._XZ__parse_index(
+                records + struct.pack('<I', zlib.crc32(records))
+            )
+        records = b'\x00\x7f\x00\x00'
+        with raises(AzureXZIndexError):
+            XZ._XZ__parse_index(
+                records + struct.pack('<I', zlib.crc32(records))
+            )
+        records = b'\x00' + b'\xff' * 10 + b'\x00'
+        with raises(AzureXZIndexError):
+            XZ._XZ__parse_index(
+                records + struct.pack('<I', zlib.crc32(records))
+            )
+
+    def test_read_multiple_streams(self):
+        with XZ.open('../data/blob.multistream.xz') as xz:
+            assert xz.read(8) == b'Some dat'
+            assert xz.read(128) == b'a in two streams\n'
+            assert xz.read(8) is None
+
+    def test_read_truncated(self):
+        xz = XZ(mock.Mock())
+        xz.lzma_stream.read.return_value = b''
+        with raises(EOFError):
+            xz.read(8)
+
+    def test_open_parallel(self):
+        with XZ.open('../data/blob.blocks.xz', threads=4) as xz:
+            assert isinstance(xz, ParallelXZ)
+        with XZ.open('../data/blob.more.xz', threads=4) as xz:
+            assert isinstance(xz, XZ)
+
+
+class TestParallelXZ:
+    def setup(self):
+        with open('../data/blob.blocks.xz', 'rb') as xz_file:
+            self.streams = XZ.stream_indexes(xz_file)
+            xz_file.seek(0)
+            self.data = lzma.decompress(xz_file.read())
+
+    def test_read(self):
+        with ParallelXZ('../data/blob.blocks.xz', self.streams, 2) as xz:
+            chunks = []
+            while True:
+                chunk = xz.read(3000)
+                if chunk is None:
+                    break
+                chunks.append(chunk)
+        assert b''.join(chunks) == self.data
+        assert len(chunks[0]) == 3000
+
+    def test_readinto(self):
+        buffer = bytearray(len(self.data) + 1)
+        with ParallelXZ('../data/blob.blocks.xz', self.streams, 2) as xz:
+            assert xz.readinto(memoryview(buffer)[:1000]) == 1000
+            assert xz.readinto(memoryview(buffer)[1000:]) == \
+                len(self.data) - 1000
+            assert xz.readinto(buffer) == 0
+            assert xz.decompress_time > 0
+        assert buffer[:-1] == self.data
+
+    def test_read_range(self):
+        block_sizes = [
+            block_size
+            for stream in self.streams
+            for unpadded_size, block_size in stream['records']
+        ]
+        start = block_sizes[0]
+        end = start + block_sizes[1]
+        with ParallelXZ(
+            '../data/blob.blocks.xz', self.streams, 1, start, end
+        ) as xz:
+            assert len(xz.blocks) == 1
+            assert xz.read(len(self.data)) == self.data[start:end]
+
+    @patch('azurectl.utils.xz.lzma.LZMADecompressor')
+    def test_read_size_mismatch(self, mock_decompressor):
+        mock_decompressor.return_value.decompress.return_value = b'foo'
+        with ParallelXZ('../data/blob.blocks.xz', self.streams, 2) as xz:
+            with raises(lzma.LZMAError):
+                xz.read(3000)
+
+    def test_buffer_limit(self):
+        with ParallelXZ('../data/blob.blocks.xz', self.streams, 4) as xz:
+            xz.XZ_MAX_BUFFER_SIZE = 1
+            xz.read(1)
+            assert len(xz.pending_blocks) == 0
+            assert len(xz.blocks) == 2
+
+    def test_seek(self):
+        block_sizes = [
+            block_size
+            for stream in self.streams
+            for unpadded_size, block_size in stream['records']
+        ]
+        with ParallelXZ('../data/blob.blocks.xz', self.streams, 1) as xz:
+            xz.read(10)
+            # within the buffered bytes of the first block
+            assert xz.seek(20) == 20
+            assert xz.read(10) == self.data[20:30]
+            # over the pending and the queued blocks into the last one
+            offset = sum(block_sizes[:-1]) + 10
+            assert xz.seek(offset) == offset
+            assert len(xz.blocks) == 0
+            assert xz.read(10) == self.data[offset:offset + 10]
+            # backwards is a noop
+            assert xz.seek(0) == offset + 10
+
+    def test_seek_pending_blocks(self):
+        block_sizes = [
+            block_size
+            for stream in self.streams
+            for unpadded_size, block_size in stream['records']
+        ]
+        with ParallelXZ('../data/blob.blocks.xz', self.streams, 4) as xz:
+            xz.read(1)
+            offset = sum(block_sizes[:2])
+            assert xz.seek(offset) == offset
+            assert xz.read(10) == self.data[offset:offset + 10]
+
+    def test_supports(self):
+        assert ParallelXZ.supports(self.streams) is True
+        assert ParallelXZ.supports([{'offset': 0, 'records': [(8, 8)]}]) \
+            is False
@@ -0,0 +1,36 @@
+from .test_helper import argv_kiwi_tests
+
+from azurectl.utils.zeropages import ZeroPages
+
+
+class TestZeroPages:
+    def setup(self):
+        self.zero_pages = ZeroPages()
+
+    def test_is_zero(self):
+        data = bytearray(2048)
+        data[1024] = 1
+        assert self.zero_pages.is_zero(data, 0, 1024) is True
+        assert self.zero_pages.is_zero(data, 512, 1536) is False
+        assert self.zero_pages.is_zero(data, 1536, 2048) is True
+
+    def test_non_zero_ranges_zero_chunk(self):
+        assert self.zero_pages.non_zero_ranges(bytes(4096), 4096) == []
+
+    def test_non_zero_ranges(self):
+        zero_pages = ZeroPages(max_zero_gap_size=512)
+        data = bytearray(8192)
+        data[0] = 1
+        data[1024] = 1
+        data[4096] = 1
+        data[8191] = 1
+        assert zero_pages.non_zero_ranges(data, 8192) == [
+            [0, 1536], [4096, 4608], [7680, 8192]
+        ]
+
+    def test_non_zero_ranges_length(self):
+        # data beyond length is not looked at
+        data = bytearray(4096)
+        data[2048] = 1
+        assert self.zero_pages.non_zero_ranges(data, 2048) == []
+        assert self.zero_pages.non_zero_ranges(data, 2560) == [[2048, 2560]]